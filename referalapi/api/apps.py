@@ -4,3 +4,24 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.conf import settings
+        from django.contrib.auth.password_validation import (
+            get_default_password_validators
+        )
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .metrics import install_db_wrapper
+        from .utils import close_unusable_connections
+
+        if settings.PERFORMANCE_METRICS['ENABLED']:
+            connection_created.connect(install_db_wrapper)
+        request_started.connect(close_unusable_connections)
+
+        # Валидаторы паролей создаются один раз на процесс: список
+        # распространенных паролей загружается при старте, а не
+        # на первой регистрации.
+        get_default_password_validators()
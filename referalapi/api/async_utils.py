@@ -0,0 +1,115 @@
+from asgiref.sync import SyncToAsync, sync_to_async
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest
+from django.db import close_old_connections
+from django.http import StreamingHttpResponse
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+
+from .utils import close_unusable_connections
+
+
+class DatabaseSyncToAsync(SyncToAsync):
+    '''
+    Выполняет синхронный код с ORM в пуле потоков, закрывая
+    устаревшие и оборванные соединения с БД до вызова и устаревшие
+    после, как это делает обработчик запроса в синхронных вьюхах.
+    '''
+    def thread_handler(self, loop, *args, **kwargs):
+        close_old_connections()
+        close_unusable_connections()
+        try:
+            return super().thread_handler(loop, *args, **kwargs)
+        finally:
+            close_old_connections()
+
+
+def database_sync_to_async(func):
+    return DatabaseSyncToAsync(func, thread_sensitive=False)
+
+
+def authenticate_sync(request):
+    '''
+    Аутентифицирует запрос классами из DEFAULT_AUTHENTICATION_CLASSES.
+    Возвращает юзера или None.
+    '''
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = authentication_class().authenticate(request)
+        if result is not None:
+            return result[0]
+    return None
+
+
+async def authenticate(request):
+    try:
+        return await database_sync_to_async(authenticate_sync)(request)
+    except exceptions.AuthenticationFailed:
+        return None
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    '''
+    StreamingHttpResponse с асинхронным итератором. В Django 3.2
+    ASGIHandler перебирает поток синхронно прямо в цикле событий,
+    поэтому такой ответ отдает только StreamingASGIHandler
+    (referalapi.asgi), не занимая поток на время ожидания.
+    '''
+
+    @property
+    def streaming_content(self):
+        return self._aiter_content()
+
+    @streaming_content.setter
+    def streaming_content(self, value):
+        self._iterator = value
+
+    async def _aiter_content(self):
+        async for part in self._iterator:
+            yield self.make_bytes(part)
+
+
+async def aiterate(iterator):
+    '''
+    Перебирает синхронный итератор (например, queryset.iterator())
+    в потоке для синхронного кода, не занимая цикл событий. Все
+    части читаются в одном потоке, поэтому курсор и соединение
+    с БД остаются теми же, что у синхронной вьюхи.
+    '''
+    get_next = sync_to_async(next, thread_sensitive=True)
+    done = object()
+    while (part := await get_next(iterator, done)) is not done:
+        yield part
+
+
+def streaming_response(request, content, **kwargs) -> StreamingHttpResponse:
+    '''
+    Потоковый ответ из синхронного итератора. Под ASGI итератор
+    перебирается через aiterate: ASGIHandler в Django 3.2 перебирает
+    StreamingHttpResponse прямо в цикле событий, где запросы к БД
+    запрещены.
+    '''
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        return AsyncStreamingHttpResponse(aiterate(iter(content)), **kwargs)
+    return StreamingHttpResponse(content, **kwargs)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    '''ASGIHandler, который отдает AsyncStreamingHttpResponse.'''
+
+    async def send_response(self, response, send):
+        if not isinstance(response, AsyncStreamingHttpResponse):
+            return await super().send_response(response, send)
+        headers = [
+            (str(header).encode('ascii'), str(value).encode('latin1'))
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        )
+        await send({'type': 'http.response.start',
+                    'status': response.status_code,
+                    'headers': headers})
+        async for part in response.streaming_content:
+            await send({'type': 'http.response.body', 'body': part,
+                        'more_body': True})
+        await send({'type': 'http.response.body'})
@@ -0,0 +1,276 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework import exceptions, serializers, status
+from rest_framework.request import Request
+
+from users.constans import EMAIL_LENGTH
+from users.models import Codes
+
+from .async_utils import (AsyncStreamingHttpResponse, authenticate,
+                          database_sync_to_async)
+from .cache import code_cache
+from .events import get_event_log, get_read_params, stream_events
+from .mail import queue_code_email
+from .passwords import ahash_password
+from .renderers import ORJSONRenderer
+from .serializers import (CodeSerializer, EventBatchSerializer,
+                          UserCreationSerializer)
+from .throttling import (SEND_EMAIL_THROTTLES, SIGNUP_THROTTLES,
+                         check_throttles)
+from .verification import get_email_verifier
+
+
+renderer = ORJSONRenderer()
+
+# Формат почты и кода проверяется до обращения к верификатору
+# и кешу кодов: некорректные значения не расходуют лимит Hunter.io.
+EMAIL_FIELD = serializers.EmailField(max_length=EMAIL_LENGTH)
+CODE_FIELD = serializers.CharField()
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(renderer.render(data), status=status,
+                        content_type=renderer.media_type)
+
+
+def unauthorized():
+    return json_response(
+        {'detail': 'Учетные данные не были предоставлены.'},
+        status=status.HTTP_401_UNAUTHORIZED
+    )
+
+
+def forbidden():
+    return json_response(
+        {'detail': 'У вас недостаточно прав для выполнения данного '
+                   'действия.'},
+        status=status.HTTP_403_FORBIDDEN
+    )
+
+
+async def throttle(request, throttle_classes, user=None, data=None):
+    '''
+    Проверяет лимиты запросов теми же классами, что и синхронные
+    вьюхи. Возвращает ответ 429, если лимит превышен, иначе None.
+    '''
+    request = Request(request)
+    if user is not None:
+        request.user = user
+    if data is not None:
+        request._full_data = data
+    wait = await sync_to_async(check_throttles, thread_sensitive=False)(
+        request, throttle_classes
+    )
+    if wait is None:
+        return None
+    error = exceptions.Throttled(wait)
+    response = json_response({'detail': error.detail},
+                             status=error.status_code)
+    response['Retry-After'] = str(error.wait)
+    return response
+
+
+def clean_field(field, value):
+    '''Значение, прошедшее проверку формата полем, или None.'''
+    try:
+        return field.run_validation(value)
+    except serializers.ValidationError:
+        return None
+
+
+def validate_user(data, context):
+    serializer = UserCreationSerializer(data=data, context=context)
+    serializer.is_valid()
+    return serializer
+
+
+def save_user(serializer):
+    try:
+        serializer.save()
+    except serializers.ValidationError as e:
+        return e.detail, status.HTTP_400_BAD_REQUEST
+    return serializer.data, status.HTTP_201_CREATED
+
+
+async def signup(request):
+    '''
+    Асинхронная регистрация. Проверка почты и поиск реферального
+    кода идут параллельно, затем данные проверяются, пароль
+    хешируется в отдельном пуле потоков, и пользователь создается
+    одним вызовом в пуле потоков для БД.
+    '''
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return json_response({'detail': 'Некорректный JSON.'},
+                             status=status.HTTP_400_BAD_REQUEST)
+    throttled = await throttle(request, SIGNUP_THROTTLES, data=data)
+    if throttled is not None:
+        return throttled
+    if not isinstance(data, dict):
+        # Ошибку формата данных возвращает сериализатор, как
+        # в синхронной регистрации; к БД он при этом не обращается.
+        serializer = UserCreationSerializer(data=data)
+        serializer.is_valid()
+        return json_response(serializer.errors,
+                             status=status.HTTP_400_BAD_REQUEST)
+
+    # Ошибки формата вернет сериализатор, как в синхронной регистрации.
+    email = clean_field(EMAIL_FIELD, data.get('email'))
+    referral_code = clean_field(CODE_FIELD, data.get('referral_code'))
+    checks = []
+    if email:
+        checks.append(get_email_verifier().ais_valid(email))
+    if referral_code:
+        checks.append(
+            database_sync_to_async(code_cache.fetch)(referral_code)
+        )
+    results = await asyncio.gather(*checks)
+
+    context = {'request': request}
+    if email:
+        context['email_is_valid'] = results[0]
+    serializer = await database_sync_to_async(validate_user)(data, context)
+    if serializer.errors:
+        return json_response(serializer.errors,
+                             status=status.HTTP_400_BAD_REQUEST)
+    context['password_hash'] = await ahash_password(
+        serializer.validated_data['password']
+    )
+    payload, code = await database_sync_to_async(save_user)(serializer)
+    return json_response(payload, status=code)
+
+
+signup.csrf_exempt = True
+
+
+def get_codes(user, **filters):
+    codes = Codes.objects.filter(user=user, **filters).select_related('user')
+    return CodeSerializer(codes, many=True).data
+
+
+async def code_list(request):
+    '''Асинхронное чтение собственного кода юзера.'''
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+    codes = await database_sync_to_async(get_codes)(user)
+    if not codes:
+        return json_response(
+            {'detail': 'Упс, у вас еще нет своего кода.'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return json_response(codes)
+
+
+async def code_detail(request, pk):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+    codes = await database_sync_to_async(get_codes)(user, pk=pk)
+    if not codes:
+        return json_response({'detail': 'Страница не найдена.'},
+                             status=status.HTTP_404_NOT_FOUND)
+    return json_response(codes[0])
+
+
+async def send_code_email(request):
+    '''Асинхронная постановка письма с кодом в очередь.'''
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+    throttled = await throttle(request, SEND_EMAIL_THROTTLES, user=user)
+    if throttled is not None:
+        return throttled
+    ref_code = await database_sync_to_async(code_cache.fetch_for_user)(
+        user.id
+    )
+    if ref_code is None:
+        return json_response(
+            {'detail': 'У вас нет своего реферального кода!'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    await database_sync_to_async(queue_code_email)(user, ref_code)
+    return json_response(
+        {'detail': 'Реферальный код будет отправлен на вашу почту.'},
+        status=status.HTTP_202_ACCEPTED
+    )
+
+
+async def read_events_params(request):
+    '''
+    Проверяет, что запрос от персонала, и возвращает журнал событий
+    и параметры чтения (см. events.get_read_params) или ответ
+    с ошибкой.
+    '''
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+    if not user.is_staff:
+        return forbidden()
+    log = get_event_log()
+    try:
+        params = await database_sync_to_async(get_read_params)(
+            log, request.GET, request.headers
+        )
+    except ValueError:
+        return json_response({'after': ['Некорректный id события.']},
+                             status=status.HTTP_400_BAD_REQUEST)
+    return log, params
+
+
+async def events(request):
+    '''
+    Длинный опрос журнала событий: до limit событий после after.
+    Если новых событий нет, ответ ждет их до timeout секунд, не
+    занимая ни воркер, ни поток.
+    '''
+    result = await read_events_params(request)
+    if isinstance(result, HttpResponse):
+        return result
+    log, (after, limit, timeout) = result
+    found = await log.aread(after, limit, block=timeout)
+    return json_response(EventBatchSerializer(
+        {'last_id': found[-1].id if found else after, 'events': found}
+    ).data)
+
+
+async def event_stream(request):
+    '''
+    Поток Server-Sent Events. Закрывается через
+    EVENT_LOG['STREAM_TIMEOUT'] секунд, EventSource
+    переподключается сам с Last-Event-ID. Работает только
+    под ASGI-сервером с referalapi.asgi:application.
+    '''
+    result = await read_events_params(request)
+    if isinstance(result, HttpResponse):
+        return result
+    if not isinstance(request, ASGIRequest):
+        return json_response(
+            {'detail': 'Поток событий доступен только под ASGI-сервером.'},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+    log, (after, limit, _) = result
+    response = AsyncStreamingHttpResponse(
+        stream_events(log, after, settings.EVENT_LOG['STREAM_TIMEOUT'],
+                      limit),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
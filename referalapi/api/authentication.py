@@ -0,0 +1,174 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import (TokenRefreshSerializer,
+                                                  TokenVerifySerializer)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
+
+# Черный список из таблиц приложения token_blacklist, которое
+# больше не установлено: таблицы остаются в БД после его удаления.
+SQL_BLACKLIST_TABLES = ('token_blacklist_blacklistedtoken',
+                        'token_blacklist_outstandingtoken')
+SQL_BLACKLIST_SQL = '''
+SELECT outstanding.jti, outstanding.expires_at
+FROM token_blacklist_blacklistedtoken blacklisted
+JOIN token_blacklist_outstandingtoken outstanding
+    ON outstanding.id = blacklisted.token_id
+WHERE outstanding.expires_at > %s
+'''
+
+USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name',
+               'is_active', 'is_staff', 'is_superuser', 'date_joined')
+
+
+class UserCache:
+    '''
+    Короткоживущий кеш полей юзера для аутентификации по JWT.
+    Сбрасывается сигналами при изменении и удалении юзера,
+    поэтому аутентифицированный запрос обычно не обращается к БД.
+    Пароль в кеш не попадает.
+    '''
+    version = 1
+
+    @property
+    def fields(self) -> list:
+        # from_db ждет значения в порядке полей модели.
+        return [field.attname
+                for field in get_user_model()._meta.concrete_fields
+                if field.attname in USER_FIELDS]
+
+    def key(self, user_id) -> str:
+        return f'user:v{self.version}:{user_id}'
+
+    def get(self, user_id):
+        '''Юзер с полями USER_FIELDS или None, если его нет.'''
+        model = get_user_model()
+        fields = self.fields
+        values = cache.get(self.key(user_id))
+        if values is None:
+            values = model.objects.filter(pk=user_id).values_list(
+                *fields).first()
+            if values is None:
+                return None
+            cache.set(self.key(user_id), values,
+                      timeout=settings.USER_CACHE_TIMEOUT)
+        return model.from_db('default', fields, values)
+
+    def delete(self, user_id):
+        cache.delete(self.key(user_id))
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    '''
+    JWTAuthentication, который берет юзера по id из токена
+    из кеша UserCache, а не запросом к БД на каждый запрос.
+    '''
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Для проверки нужен хеш пароля, которого нет в кеше.
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('В токене нет id пользователя.')
+        user = user_cache.get(user_id)
+        if user is None:
+            raise AuthenticationFailed('Пользователь не найден.',
+                                       code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('Пользователь неактивен.',
+                                       code='user_inactive')
+        return user
+
+
+class TokenBlacklist:
+    '''
+    Черный список refresh токенов в кеше (Redis) вместо таблиц
+    token_blacklist: ключ по jti живет, пока не истечет сам токен.
+    '''
+    version = 1
+
+    def key(self, jti: str) -> str:
+        return f'jwt:v{self.version}:blacklist:{jti}'
+
+    def add(self, token) -> bool:
+        '''
+        Добавляет токен в список. Возвращает False, если он уже был
+        в списке: из двух параллельных обновлений одним токеном
+        пройдет только одно.
+        '''
+        return self.add_jti(token[api_settings.JTI_CLAIM],
+                            token['exp'] - int(time.time()))
+
+    def add_jti(self, jti: str, timeout: int) -> bool:
+        if timeout <= 0:
+            return True
+        return cache.add(self.key(jti), 1, timeout=timeout)
+
+    def contains(self, jti: str) -> bool:
+        return cache.get(self.key(jti)) is not None
+
+    def import_sql(self):
+        '''
+        Переносит в кеш еще не истекшие токены из черного списка
+        в таблицах token_blacklist. Возвращает их число или None,
+        если таблиц нет.
+        '''
+        tables = connection.introspection.table_names()
+        if not all(table in tables for table in SQL_BLACKLIST_TABLES):
+            return None
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(SQL_BLACKLIST_SQL, [
+                connection.ops.adapt_datetimefield_value(now)
+            ])
+            rows = cursor.fetchall()
+        for jti, expires_at in rows:
+            if isinstance(expires_at, str):
+                expires_at = parse_datetime(expires_at)
+            if timezone.is_naive(expires_at):
+                expires_at = timezone.make_aware(expires_at, timezone.utc)
+            self.add_jti(jti, int((expires_at - now).total_seconds()) + 1)
+        return len(rows)
+
+
+token_blacklist = TokenBlacklist()
+
+
+class BlacklistRefreshToken(RefreshToken):
+    '''Refresh токен с проверкой по черному списку в кеше.'''
+
+    def verify(self):
+        super().verify()
+        if token_blacklist.contains(self.payload.get(api_settings.JTI_CLAIM)):
+            raise TokenError('Токен в черном списке.')
+
+    def blacklist(self):
+        if not token_blacklist.add(self):
+            raise TokenError('Токен в черном списке.')
+
+
+class BlacklistTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = BlacklistRefreshToken
+
+
+class BlacklistTokenVerifySerializer(TokenVerifySerializer):
+
+    def validate(self, attrs):
+        token = UntypedToken(attrs['token'])
+        if token_blacklist.contains(token.get(api_settings.JTI_CLAIM)):
+            raise serializers.ValidationError('Токен в черном списке.')
+        return {}
@@ -0,0 +1,626 @@
+import io
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import CommonPasswordValidator
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django_redis.cache import RedisCache
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.models import Codes, ReferCounter, Refers, User
+
+from .authentication import BlacklistRefreshToken
+from .counters import rebuild_refer_counters
+from .leaderboard import leaderboard
+from .renderers import ORJSONParser, ORJSONRenderer
+from .serializers import ReferalSerializer
+from .tree import downline, level_counts
+from .utils import batched
+
+BENCHMARK_PASSWORD = 'Bench-pass-2024'
+
+BENCHMARK_SETTINGS = {
+    'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+    'EMAIL_VERIFICATION': {
+        'BACKEND': 'api.verification.StubEmailVerifier',
+        'CACHE_TIMEOUT': 60,
+        'NEGATIVE_CACHE_TIMEOUT': 60,
+    },
+    'ALLOWED_HOSTS': ['testserver'],
+}
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# Больше скольких запросов к БД сценарий делать не должен (для SQLite
+# с BEGIN, без Redis). Ответы с кодом юзера берутся из кеша без
+# обращения к БД. Проверяется тестами api.tests.test_queries.
+QUERY_BUDGETS = {
+    'signup': 4,
+    'signup_referral': 8,
+    'code_create': 5,
+    'code_patch': 2,
+    'code_delete': 3,
+    'code_list': 0,
+    'code_detail': 0,
+    'code_list_jwt': 0,
+    'code_list_etag': 0,
+    'code_detail_etag': 0,
+    'jwt_refresh': 0,
+    'send_code_email': 5,
+    'referals': 1,
+    'referals_500': 1,
+    'referer': 2,
+    'referer_stats': 3,
+    'leaderboard': 2,
+    'leaderboard_me': 2,
+    'events': 1,
+}
+
+HASHER_PROFILES = {
+    'pbkdf2': ['django.contrib.auth.hashers.PBKDF2PasswordHasher'],
+    'argon2': ['api.passwords.TunedArgon2PasswordHasher'],
+}
+
+
+def get_test_settings(cache='locmem', **extra_settings) -> dict:
+    '''
+    Настройки для бенчмарка и тестов: локальные заглушки вместо
+    Redis (locmem или fakeredis), SMTP и Hunter.io. Лимиты запросов
+    подняты, чтобы троттлинг проверялся, но не срабатывал.
+    '''
+    rest_framework = {
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': dict.fromkeys(
+            settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'],
+            '1000000/hour'
+        ),
+    }
+    return {'CACHES': get_cache_settings(cache),
+            'REST_FRAMEWORK': rest_framework,
+            **BENCHMARK_SETTINGS, **extra_settings}
+
+
+@contextmanager
+def test_environment(cache='locmem', **extra_settings):
+    '''
+    Временная тестовая БД (test_<имя БД> для PostgreSQL) с настройками
+    get_test_settings. SQLite создается в файле, а не в памяти, чтобы
+    потоки писали в одну БД так же, как в рабочем окружении.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                directory, 'benchmark.sqlite3'
+            )
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            with override_settings(**get_test_settings(cache,
+                                                       **extra_settings)):
+                yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed(referers: int, fanout: int, batch_size: int = 5000) -> list:
+    '''
+    Заполняет БД тестовыми данными: referers рефереров с кодами,
+    у каждого по fanout рефералов. Возвращает рефереров.
+    '''
+    password = make_password(BENCHMARK_PASSWORD)
+    User.objects.bulk_create(
+        User(username=f'referer{i}', email=f'referer{i}@bench.local',
+             password=password)
+        for i in range(referers)
+    )
+    owners = list(User.objects.filter(username__startswith='referer')
+                  .order_by('pk'))
+    Codes.objects.bulk_create(
+        Codes(code=f'BENCH{owner.pk}', user=owner, live_days=30,
+              expires_at=timezone.now() + timedelta(days=30))
+        for owner in owners
+    )
+    for owner in owners:
+        for batch in batched(range(fanout), batch_size):
+            User.objects.bulk_create(
+                User(username=f'r{owner.pk}_{i}',
+                     email=f'r{owner.pk}_{i}@bench.local',
+                     password=password)
+                for i in batch
+            )
+        referals = (User.objects.filter(username__startswith=f'r{owner.pk}_')
+                    .values_list('pk', flat=True).iterator())
+        for batch in batched(referals, batch_size):
+            Refers.objects.bulk_create(
+                Refers(referer=owner, referal_id=pk) for pk in batch
+            )
+    rebuild_refer_counters()
+    leaderboard.rebuild()
+    return owners
+
+
+def seed_tree(users: int, branching: int, batch_size: int = 5000) -> list:
+    '''
+    Заполняет БД полным деревом рефералов из users юзеров, у каждого
+    юзера branching рефералов. Возвращает id юзеров в порядке обхода
+    в ширину, первый - корень дерева.
+    '''
+    password = make_password(BENCHMARK_PASSWORD)
+    for batch in batched(range(users), batch_size):
+        User.objects.bulk_create(
+            User(username=f'tree{i}', email=f'tree{i}@bench.local',
+                 password=password)
+            for i in batch
+        )
+    ids = list(User.objects.filter(username__startswith='tree')
+               .order_by('pk').values_list('pk', flat=True))
+    refers = (Refers(referer_id=ids[(i - 1) // branching],
+                     referal_id=ids[i])
+              for i in range(1, len(ids)))
+    for batch in batched(refers, batch_size):
+        Refers.objects.bulk_create(batch)
+    return ids
+
+
+def measure_tree(user_id: int, depth: int, repeat: int,
+                 closure: bool) -> dict:
+    '''
+    Замеряет чтение дерева рефералов юзера: число рефералов
+    по уровням до depth и первую страницу самого глубокого уровня.
+    Возвращает число запросов к БД, медиану и p95 в миллисекундах.
+    '''
+    scenarios = {
+        'levels': lambda: level_counts(user_id, depth, closure),
+        'level_page': lambda: list(
+            downline(user_id, depth, closure).order_by('node')[:50]
+        ),
+    }
+    results = {}
+    for name, scenario in scenarios.items():
+        scenario()
+        reset_queries()
+        timings, queries = [], []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                scenario()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context))
+        timings.sort()
+        results[name] = {
+            'queries': statistics.fmean(queries),
+            'p50_ms': percentile(timings, 0.5),
+            'p95_ms': percentile(timings, 0.95),
+        }
+    return results
+
+
+class CountingCacheMixin:
+    '''Считает попадания и промахи при чтении из кеша.'''
+    stats = Counter()
+    _missing = object()
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, self._missing, version=version)
+        if value is self._missing:
+            self.stats['misses'] += 1
+            return default
+        self.stats['hits'] += 1
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = super().get_many(keys, version=version)
+        self.stats['hits'] += len(found)
+        self.stats['misses'] += len(keys) - len(found)
+        return found
+
+
+class CountingLocMemCache(CountingCacheMixin, LocMemCache):
+    pass
+
+
+class CountingRedisCache(CountingCacheMixin, RedisCache):
+    pass
+
+
+def get_cache_settings(backend: str) -> dict:
+    '''
+    Кеш для бенчмарка: locmem или fakeredis (клиент django_redis
+    поверх Redis, эмулируемого внутри процесса).
+    '''
+    if backend == 'fakeredis':
+        import fakeredis
+        return {
+            'default': {
+                'BACKEND': 'api.benchmark.CountingRedisCache',
+                'LOCATION': 'redis://benchmark/0',
+                'OPTIONS': {
+                    'CONNECTION_POOL_KWARGS': {
+                        'connection_class': fakeredis.FakeConnection,
+                    },
+                },
+            }
+        }
+    return {
+        'default': {
+            'BACKEND': 'api.benchmark.CountingLocMemCache',
+            'LOCATION': 'benchmark',
+        }
+    }
+
+
+def get_scenarios(owners: list, repeat: int) -> dict:
+    '''
+    Сценарии бенчмарка: имя -> функция (client, номер итерации),
+    возвращающая ответ. Итерация с номером 0 - прогревочная.
+    '''
+    owner = owners[0]
+    code = owner.code.get()
+    free_users = list(
+        User.objects.filter(username__startswith=f'r{owner.pk}_')
+        .order_by('pk')[:repeat + 1]
+    )
+    created = {}
+
+    def as_user(client, user):
+        client.force_authenticate(user)
+        return client
+
+    def get(url, data=None):
+        return lambda client, i: as_user(client, owner).get(url, data)
+
+    def signup(prefix, referral_code=None):
+        def request(client, i):
+            data = {'username': f'{prefix}{i}',
+                    'email': f'{prefix}{i}@bench.local',
+                    'password': BENCHMARK_PASSWORD}
+            if referral_code:
+                data['referral_code'] = referral_code
+            # Новый клиент без сессии: force_authenticate(None)
+            # выходит из сессии и добавляет запросы к django_session.
+            return APIClient().post('/api/users/', data)
+        return request
+
+    etags = {}
+
+    def conditional_get(url):
+        def request(client, i):
+            as_user(client, owner)
+            if i == 0:
+                etags[url] = client.get(url)['ETag']
+            return client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+        return request
+
+    staff, _ = User.objects.get_or_create(
+        username='bench_staff',
+        defaults={'email': 'staff@bench.local', 'is_staff': True,
+                  'password': make_password(BENCHMARK_PASSWORD)}
+    )
+
+    def staff_get(url, data=None):
+        return lambda client, i: as_user(client, staff).get(url, data)
+
+    def jwt_get(url):
+        token = str(AccessToken.for_user(owner))
+
+        def request(client, i):
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            return client.get(url)
+        return request
+
+    refresh_tokens = [str(BlacklistRefreshToken.for_user(owner))
+                      for _ in range(repeat + 1)]
+
+    def jwt_refresh(client, i):
+        return client.post('/api/auth/jwt/refresh/',
+                           {'refresh': refresh_tokens[i]})
+
+    def code_create(client, i):
+        response = as_user(client, free_users[i]).post(
+            '/api/code/', {'code': f'NEW{i}', 'live_days': 10}
+        )
+        created[i] = response.data.get('id')
+        return response
+
+    def code_patch(client, i):
+        return as_user(client, free_users[i]).patch(
+            f'/api/code/{created[i]}/', {'live_days': 20}
+        )
+
+    def code_delete(client, i):
+        return as_user(client, free_users[i]).delete(
+            f'/api/code/{created[i]}/'
+        )
+
+    return {
+        'signup': signup('plain'),
+        'signup_referral': signup('invited', code.code),
+        'code_create': code_create,
+        'code_patch': code_patch,
+        'code_delete': code_delete,
+        'code_list': get('/api/code/'),
+        'code_detail': get(f'/api/code/{code.pk}/'),
+        'code_list_jwt': jwt_get('/api/code/'),
+        'code_list_etag': conditional_get('/api/code/'),
+        'code_detail_etag': conditional_get(f'/api/code/{code.pk}/'),
+        'jwt_refresh': jwt_refresh,
+        'send_code_email': get('/api/send-code-email/'),
+        'referals': get('/api/referals/'),
+        'referals_500': get('/api/referals/', {'page_size': 500}),
+        'referer': get(f'/api/referer/{owner.pk}/'),
+        'referer_stats': get(f'/api/referer/{owner.pk}/stats/'),
+        'leaderboard': get('/api/leaderboard/'),
+        'events': staff_get('/api/events/', {'after': '0', 'timeout': 0}),
+        'leaderboard_me': get('/api/leaderboard/me/', {'window': 'week'}),
+    }
+
+
+def measure(client: APIClient, scenario, repeat: int) -> dict:
+    '''
+    Выполняет сценарий repeat раз после прогревочного запуска
+    и возвращает самый частый статус, число запросов к БД
+    на запрос, перцентили времени ответа в миллисекундах
+    и долю попаданий в кеш.
+    '''
+    scenario(client, 0)
+    cache_before = Counter(CountingCacheMixin.stats)
+    timings, queries, statuses = [], [], Counter()
+    for i in range(1, repeat + 1):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = scenario(client, i)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(context))
+        statuses[response.status_code] += 1
+    cache_stats = Counter(CountingCacheMixin.stats)
+    cache_stats.subtract(cache_before)
+    reads = cache_stats['hits'] + cache_stats['misses']
+    timings.sort()
+    return {
+        'status': statuses.most_common(1)[0][0],
+        'queries': statistics.fmean(queries),
+        'max_queries': max(queries),
+        'mean_ms': statistics.fmean(timings),
+        'p50_ms': percentile(timings, 0.5),
+        'p95_ms': percentile(timings, 0.95),
+        'p99_ms': percentile(timings, 0.99),
+        'cache_hit_rate': cache_stats['hits'] / reads if reads else None,
+    }
+
+
+def run(owners: list, repeat: int, only=()) -> dict:
+    scenarios = get_scenarios(owners, repeat)
+    return {
+        name: measure(APIClient(), scenario, repeat)
+        for name, scenario in scenarios.items()
+        if not only or name in only
+    }
+
+
+def percentile(timings: list, share: float) -> float:
+    '''Перцентиль по отсортированному списку.'''
+    return timings[min(len(timings) - 1, int(len(timings) * share))]
+
+
+def measure_listing(referer_id: int, repeat: int) -> dict:
+    '''
+    Медиана времени в миллисекундах для всех рефералов реферера:
+    выборка и сериализация через модели и ReferalSerializer на каждую
+    строку (models) и из строк values() (rows), рендеринг ответа
+    и разбор его обратно стандартным json и orjson.
+    '''
+    def models():
+        queryset = (Refers.objects.filter(referer_id=referer_id)
+                    .select_related('referal')
+                    .only('id', 'created_at', 'referal__username',
+                          'referal__date_joined'))
+        return ListSerializer(child=ReferalSerializer(),
+                              instance=queryset).data
+
+    def rows():
+        return ReferalSerializer(Refers.objects.for_referer(referer_id),
+                                 many=True).data
+
+    data = rows()
+    body = JSONRenderer().render(data)
+    stages = {
+        'serialize_models': models,
+        'serialize_rows': rows,
+        'render_json': partial(JSONRenderer().render, data),
+        'render_orjson': partial(ORJSONRenderer().render, data),
+        'parse_json': lambda: JSONParser().parse(io.BytesIO(body)),
+        'parse_orjson': lambda: ORJSONParser().parse(io.BytesIO(body)),
+    }
+    results = {'rows': len(data), 'bytes': len(body)}
+    for name, stage in stages.items():
+        stage()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            stage()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = statistics.median(timings)
+    return results
+
+
+def measure_export(owner: User, output: str) -> dict:
+    '''
+    Выгружает всех рефералов реферера потоком (/export/) и замеряет
+    время до первой части ответа и до конца в миллисекундах, размер
+    ответа и, отдельным прогоном под tracemalloc, пик памяти Python
+    в мегабайтах. Для сравнения output=list собирает тот же список
+    в памяти через ReferalSerializer и ORJSONRenderer, как при ответе
+    одной страницей.
+    '''
+    client = APIClient()
+    client.force_authenticate(owner)
+
+    def chunks():
+        if output == 'list':
+            yield ORJSONRenderer().render(ReferalSerializer(
+                Refers.objects.for_referer(owner.pk), many=True
+            ).data)
+            return
+        yield from client.get(f'/api/referer/{owner.pk}/export/',
+                              {'output': output}).streaming_content
+
+    started = time.perf_counter()
+    first_ms, size = None, 0
+    for chunk in chunks():
+        if first_ms is None:
+            first_ms = (time.perf_counter() - started) * 1000
+        size += len(chunk)
+    total_ms = (time.perf_counter() - started) * 1000
+
+    tracemalloc.start()
+    for chunk in chunks():
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'first_ms': first_ms, 'total_ms': total_ms,
+            'peak_mb': peak / 2 ** 20, 'bytes': size}
+
+
+def get_cores(threads: int) -> int:
+    '''Сколько ядер могут занять threads потоков.'''
+    return min(threads, os.cpu_count() or 1)
+
+
+def measure_hashing(total: int, threads: int) -> dict:
+    '''
+    Хеширует total паролей настроенным хешером в threads потоках.
+    Возвращает число хешей в секунду всего и на ядро.
+    '''
+    def worker(count):
+        for _ in range(count):
+            make_password(BENCHMARK_PASSWORD)
+
+    make_password(BENCHMARK_PASSWORD)
+    per_thread = max(1, total // threads)
+    workers = [threading.Thread(target=worker, args=(per_thread,))
+               for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    per_second = per_thread * threads / (time.perf_counter() - started)
+    return {'per_second': per_second,
+            'per_core': per_second / get_cores(threads)}
+
+
+def measure_common_passwords(repeat: int = 1000) -> dict:
+    '''
+    Время загрузки списка распространенных паролей и время проверки
+    пароля по уже загруженному списку, в миллисекундах.
+    '''
+    started = time.perf_counter()
+    validator = CommonPasswordValidator()
+    load_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    for _ in range(repeat):
+        validator.validate(BENCHMARK_PASSWORD)
+    return {'load_ms': load_ms,
+            'validate_ms': (time.perf_counter() - started) * 1000 / repeat}
+
+
+def load_signups(total: int, threads: int, referral_code=None,
+                 duplicates: bool = False, url: str = '/api/users/') -> dict:
+    '''
+    Регистрирует total юзеров в threads потоках, у каждого потока
+    свой клиент и свое соединение с БД. С duplicates каждое имя
+    одновременно регистрируют два потока, и успешной должна быть
+    ровно одна попытка. Возвращает пропускную способность (всего
+    и на ядро), перцентили времени ответа и статусы неуспешных
+    ответов.
+    '''
+    timings, errors = [], []
+    lock = threading.Lock()
+
+    def worker(numbers):
+        client = APIClient()
+        for number in numbers:
+            data = {'username': f'load{number}',
+                    'email': f'load{number}@bench.local',
+                    'password': BENCHMARK_PASSWORD}
+            if referral_code:
+                data['referral_code'] = referral_code
+            started = time.perf_counter()
+            try:
+                status = client.post(url, data, format='json').status_code
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if status == 201:
+                    timings.append(elapsed)
+                else:
+                    errors.append(status)
+        connection.close()
+
+    step = threads // 2 if duplicates else threads
+    workers = [
+        threading.Thread(target=worker,
+                         args=(range(i % step, total, step),))
+        for i in range(threads)
+    ]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        'ok': len(timings),
+        'errors': len(errors),
+        'error_kinds': dict(Counter(map(str, errors))),
+        'seconds': elapsed,
+        'per_second': len(timings) / elapsed,
+        'per_core': len(timings) / elapsed / get_cores(threads),
+        'p50_ms': percentile(timings, 0.5) if timings else 0,
+        'p95_ms': percentile(timings, 0.95) if timings else 0,
+        'p99_ms': percentile(timings, 0.99) if timings else 0,
+    }
+
+
+def check_signups(referer=None) -> list:
+    '''
+    Проверяет результат нагрузочного теста регистрации: у каждого
+    зарегистрированного по коду юзера есть рефералка, а счетчик
+    рефералов совпадает с их числом. Возвращает найденные нарушения.
+    '''
+    problems = []
+    if referer is None:
+        return problems
+    users = User.objects.filter(username__startswith='load')
+    orphans = users.filter(referal__isnull=True).count()
+    if orphans:
+        problems.append(f'юзеров без рефералки: {orphans}')
+    refers = Refers.objects.filter(referer=referer).count()
+    if refers != users.count():
+        problems.append(f'рефералок {refers}, юзеров {users.count()}')
+    total = ReferCounter.objects.filter(user=referer).values_list(
+        'total', flat=True).first() or 0
+    if total != refers:
+        problems.append(f'счетчик рефералов {total}, рефералок {refers}')
+    return problems
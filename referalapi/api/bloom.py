@@ -0,0 +1,231 @@
+import math
+import threading
+from datetime import timedelta
+from hashlib import blake2b
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import Codes
+
+from .utils import get_redis
+
+COUNTER_MAX = 15
+REBUILD_MARGIN = timedelta(minutes=1)
+
+CHECK_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+for i = 1, #ARGV do
+    local value = redis.call('BITFIELD', KEYS[1], 'GET', 'u4', '#' .. ARGV[i])
+    if value[1] == 0 then
+        return 0
+    end
+end
+return 1
+'''
+
+CHANGE_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local delta = tonumber(ARGV[1])
+for i = 2, #ARGV do
+    local offset = '#' .. ARGV[i]
+    local value = redis.call('BITFIELD', KEYS[1], 'GET', 'u4', offset)[1]
+    if value < 15 and value + delta >= 0 then
+        redis.call('BITFIELD', KEYS[1], 'SET', 'u4', offset, value + delta)
+    end
+end
+return 1
+'''
+
+
+class CountingBloomFilter:
+    '''
+    Считающий фильтр Блума: вместо битов 4-битные счетчики, поэтому
+    значения можно не только добавлять, но и удалять. Счетчики
+    упакованы по два в байт в том же порядке, что BITFIELD u4
+    в Redis. Переполненный счетчик больше не меняется, чтобы
+    удаление не давало ложноотрицательных ответов.
+    '''
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+
+    def positions(self, value: str) -> list:
+        digest = blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size
+                for i in range(self.hashes)]
+
+    def new(self) -> bytearray:
+        return bytearray((self.size + 1) // 2)
+
+    def change(self, data: bytearray, value: str, delta: int):
+        for position in self.positions(value):
+            byte, odd = divmod(position, 2)
+            shift = 0 if odd else 4
+            counter = (data[byte] >> shift) & COUNTER_MAX
+            if counter < COUNTER_MAX and counter + delta >= 0:
+                data[byte] += delta << shift
+
+    def contains(self, data: bytearray, value: str) -> bool:
+        for position in self.positions(value):
+            byte, odd = divmod(position, 2)
+            if not (data[byte] >> (0 if odd else 4)) & COUNTER_MAX:
+                return False
+        return True
+
+    def build(self, values) -> tuple:
+        '''Собирает фильтр из значений, возвращает его и их число.'''
+        data = self.new()
+        count = 0
+        for value in values:
+            self.change(data, value, 1)
+            count += 1
+        return data, count
+
+
+class CodeFilter:
+    '''
+    Фильтр Блума существующих реферальных кодов в Redis. Если фильтр
+    говорит, что кода нет, код точно не существует и запрос к БД
+    не нужен. Собирается командой rebuild_code_filter, а если ключа
+    в Redis нет (первый запуск, вытеснение, очистка) - в фоновом
+    потоке одного из процессов; пока фильтр не собран, любой код
+    считается возможным. Обновляется сигналами при создании,
+    переименовании и удалении кодов. Без Redis фильтр отключен:
+    в памяти процесса он не видел бы коды, созданные другими
+    процессами.
+    '''
+    version = 1
+
+    def __init__(self):
+        self._bloom = None
+        self._lock = threading.Lock()
+        self._builder = None
+        self._check = None
+        self._change = None
+
+    @property
+    def bloom(self) -> CountingBloomFilter:
+        if self._bloom is None:
+            config = settings.CODE_FILTER
+            self._bloom = CountingBloomFilter(config['CAPACITY'],
+                                              config['ERROR_RATE'])
+        return self._bloom
+
+    @property
+    def enabled(self) -> bool:
+        return get_redis() is not None
+
+    @property
+    def key(self) -> str:
+        return (f'code_filter:v{self.version}:'
+                f'{self.bloom.size}:{self.bloom.hashes}')
+
+    @property
+    def lock_key(self) -> str:
+        return f'{self.key}:lock'
+
+    def might_contain(self, code: str) -> bool:
+        client = get_redis()
+        if client is None:
+            return True
+        if self._check is None:
+            self._check = client.register_script(CHECK_SCRIPT)
+        found = self._check(keys=[self.key],
+                            args=self.bloom.positions(code), client=client)
+        if found < 0:
+            self.build_in_background()
+            return True
+        return bool(found)
+
+    def add_many(self, codes):
+        self.change(codes, 1)
+
+    def remove_many(self, codes):
+        self.change(codes, -1)
+
+    def change(self, codes, delta: int):
+        codes = list(codes)
+        if not codes:
+            return
+        client = get_redis()
+        if client is None:
+            return
+        if self._change is None:
+            self._change = client.register_script(CHANGE_SCRIPT)
+        positions = [position for code in codes
+                     for position in self.bloom.positions(code)]
+        self._change(keys=[self.key], args=[delta, *positions],
+                     client=client)
+
+    def build_in_background(self):
+        '''
+        Запускает сборку фильтра в фоновом потоке, чтобы запрос,
+        заметивший пропажу ключа, не ждал чтения всей таблицы кодов.
+        '''
+        with self._lock:
+            if self._builder is not None and self._builder.is_alive():
+                return
+            self._builder = threading.Thread(target=self.build_once,
+                                             name='code-filter-build',
+                                             daemon=True)
+            self._builder.start()
+
+    def build_once(self):
+        '''Собирает фильтр в Redis, если его не собирает другой процесс.'''
+        if not cache.add(self.lock_key, 1, timeout=300):
+            return
+        try:
+            self.rebuild()
+        finally:
+            cache.delete(self.lock_key)
+            connection.close()
+
+    def rebuild(self) -> int:
+        '''
+        Собирает фильтр по всем кодам из БД и возвращает их число.
+        Коды, созданные во время сборки, добавляются повторно:
+        лишний счетчик дает только ложноположительный ответ.
+        '''
+        client = get_redis()
+        if client is None:
+            return 0
+        started = timezone.now()
+        data, count = self.bloom.build(
+            Codes.objects.values_list('code', flat=True)
+            .iterator(chunk_size=5000)
+        )
+        recent = Codes.objects.filter(
+            created_at__gte=started - REBUILD_MARGIN
+        ).values_list('code', flat=True)
+        temporary = f'{self.key}:build'
+        client.set(temporary, bytes(data))
+        client.rename(temporary, self.key)
+        self.add_many(recent)
+        return count
+
+    def reset(self):
+        self._bloom = None
+        self._check = None
+        self._change = None
+
+
+code_filter = CodeFilter()
+
+
+@receiver(setting_changed)
+def reset_code_filter(*, setting, **kwargs):
+    if setting in ('CODE_FILTER', 'CACHES'):
+        code_filter.reset()
@@ -0,0 +1,270 @@
+import csv
+import json
+from datetime import timedelta
+from functools import partial
+
+from django.contrib.auth.hashers import make_password
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users.models import Codes, Refers, User
+
+from .bloom import code_filter
+from .cache import code_cache, referals_version
+from .counters import add_refer_counters
+from .events import code_created, get_event_log, referral_created
+from .leaderboard import leaderboard
+from .tree import add_edge, use_closure
+from .utils import batched
+
+FORMATS = ('csv', 'jsonl')
+
+
+def read_rows(file, fmt: str):
+    '''Построчно читает словари из CSV или JSONL.'''
+    if fmt == 'csv':
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Echo:
+    '''Файл, который возвращает записанное: для csv.writer в потоке.'''
+
+    def write(self, value):
+        return value
+
+
+def iter_lines(fmt: str, fields: tuple, rows):
+    '''Построчно отдает кортежи строками CSV (с заголовком) или JSONL.'''
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow(
+                value.isoformat() if hasattr(value, 'isoformat') else value
+                for value in row
+            )
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder,
+                             ensure_ascii=False) + '\n'
+
+
+def stream_rows(fmt: str, fields: tuple, rows, batch_size: int = 500):
+    '''
+    Отдает строки CSV или JSONL частями по batch_size строк
+    для StreamingHttpResponse.
+    '''
+    for batch in batched(iter_lines(fmt, fields, rows), batch_size):
+        yield ''.join(batch)
+
+
+def write_rows(file, fmt: str, fields: tuple, rows) -> int:
+    '''Построчно пишет кортежи в CSV или JSONL, возвращает их число.'''
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    file.writelines(iter_lines(fmt, fields, counted()))
+    return count
+
+
+def parse_date(value):
+    return parse_datetime(value) if value else None
+
+
+def get_user_ids(usernames) -> dict:
+    return dict(User.objects.filter(username__in=set(usernames))
+                .values_list('username', 'id'))
+
+
+class UsersIO:
+    '''
+    Пользователи: username, email, password, date_joined.
+    password должен быть уже захешированным, пустой пароль
+    делает вход по паролю невозможным.
+    '''
+    fields = ('username', 'email', 'password', 'date_joined')
+
+    def export_rows(self, chunk_size):
+        return (User.objects.order_by('pk').values_list(*self.fields)
+                .iterator(chunk_size=chunk_size))
+
+    def import_rows(self, rows) -> int:
+        '''
+        Пропускает строки, у которых username или email уже заняты
+        в БД или раньше в той же пачке. Возвращает число юзеров,
+        которые действительно добавлены: вставку, пропущенную из-за
+        параллельного импорта, bulk_create не сообщает, поэтому
+        добавленные перечитываются.
+        '''
+        users, usernames, emails = [], set(), set()
+        for row in rows:
+            if row['username'] in usernames or row['email'] in emails:
+                continue
+            usernames.add(row['username'])
+            emails.add(row['email'])
+            users.append(User(
+                username=row['username'], email=row['email'],
+                password=row.get('password') or make_password(None),
+                date_joined=parse_date(row.get('date_joined'))
+                or timezone.now()
+            ))
+        taken_usernames, taken_emails = set(), set()
+        for username, email in User.objects.filter(
+                Q(username__in=usernames) | Q(email__in=emails)
+        ).values_list('username', 'email'):
+            taken_usernames.add(username)
+            taken_emails.add(email)
+        users = [user for user in users
+                 if user.username not in taken_usernames
+                 and user.email not in taken_emails]
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        inserted = set(User.objects.filter(
+            username__in=[user.username for user in users]
+        ).values_list('username', 'email'))
+        return sum((user.username, user.email) in inserted for user in users)
+
+
+class RefersIO:
+    '''
+    Рефералки: referer, referal (username), created_at.
+    Счетчики рефералов, замыкание дерева, рейтинг, версии списков
+    и журнал событий обновляются по вставленным строкам, так как
+    bulk_create не отправляет сигналы.
+    '''
+    fields = ('referer', 'referal', 'created_at')
+
+    def export_rows(self, chunk_size):
+        return (Refers.objects.order_by('pk')
+                .values_list('referer__username', 'referal__username',
+                             'created_at')
+                .iterator(chunk_size=chunk_size))
+
+    def import_rows(self, rows) -> int:
+        '''
+        Пропускает строки, у реферала которых уже есть реферер в БД
+        или раньше в той же пачке. Счетчики, дерево, рейтинг
+        и события обновляются только по рефералкам, которые
+        действительно добавлены: они перечитываются после вставки,
+        как в UsersIO. Возвращает их число.
+        '''
+        ids = get_user_ids(
+            name for row in rows for name in (row['referer'], row['referal'])
+        )
+        refers = {}
+        for row in rows:
+            referer_id = ids.get(row['referer'])
+            referal_id = ids.get(row['referal'])
+            if referer_id and referal_id and referal_id not in refers:
+                refers[referal_id] = Refers(
+                    referer_id=referer_id, referal_id=referal_id,
+                    created_at=parse_date(row.get('created_at'))
+                    or timezone.now()
+                )
+        existing = Refers.objects.filter(
+            referal_id__in=refers
+        ).values_list('referal_id', flat=True)
+        for referal_id in existing:
+            refers.pop(referal_id, None)
+
+        with transaction.atomic():
+            Refers.objects.bulk_create(refers.values(),
+                                       ignore_conflicts=True)
+            inserted = set(Refers.objects.filter(
+                referal_id__in=refers
+            ).values_list('referer_id', 'referal_id'))
+            refers = [refer for refer in refers.values()
+                      if (refer.referer_id, refer.referal_id) in inserted]
+            add_refer_counters(refers)
+            if use_closure():
+                for refer in refers:
+                    add_edge(refer.referer_id, refer.referal_id)
+        for referer_id in {refer.referer_id for refer in refers}:
+            transaction.on_commit(partial(referals_version.bump, referer_id))
+        transaction.on_commit(partial(leaderboard.add, refers))
+        usernames = {id: username for username, id in ids.items()}
+        get_event_log().publish_many([
+            referral_created(refer, usernames[refer.referal_id])
+            for refer in refers
+        ])
+        return len(refers)
+
+
+class CodesIO:
+    '''
+    Реферальные коды: code, user (username), live_days, created_at,
+    expires_at. При импорте created_at нужен только для расчета
+    expires_at, если тот не указан. Новые коды добавляются
+    в фильтр Блума, кеш кодов и журнал событий, так как bulk_create
+    не отправляет сигналы.
+    '''
+    fields = ('code', 'user', 'live_days', 'created_at', 'expires_at')
+
+    def values(self, queryset):
+        return queryset.values_list('code', 'user__username', 'live_days',
+                                    'created_at', 'expires_at')
+
+    def export_rows(self, chunk_size):
+        return (self.values(Codes.objects.order_by('pk'))
+                .iterator(chunk_size=chunk_size))
+
+    def import_rows(self, rows) -> int:
+        '''
+        У юзера может быть только один код, поэтому пропускаются
+        строки с занятым кодом и строки юзеров, у которых код уже
+        есть в БД или раньше в той же пачке. Добавленные коды
+        перечитываются, как в UsersIO, и попадают в кеш кодов поверх
+        закешированного отсутствия. Возвращает их число.
+        '''
+        ids = get_user_ids(row['user'] for row in rows)
+        taken_codes, taken_users = set(), set()
+        for code, user_id in Codes.objects.filter(
+                Q(code__in={row['code'] for row in rows})
+                | Q(user_id__in=ids.values())
+        ).values_list('code', 'user_id'):
+            taken_codes.add(code)
+            taken_users.add(user_id)
+        codes = []
+        for row in rows:
+            user_id = ids.get(row['user'])
+            if (user_id is None or user_id in taken_users
+                    or row['code'] in taken_codes):
+                continue
+            taken_users.add(user_id)
+            taken_codes.add(row['code'])
+            live_days = int(row['live_days'])
+            created_at = parse_date(row.get('created_at')) or timezone.now()
+            codes.append(Codes(
+                code=row['code'], user_id=user_id,
+                live_days=live_days, created_at=created_at,
+                expires_at=parse_date(row.get('expires_at'))
+                or created_at + timedelta(days=live_days)
+            ))
+        Codes.objects.bulk_create(codes, ignore_conflicts=True)
+        pairs = {(code.code, code.user_id) for code in codes}
+        codes = [code for code in Codes.objects.filter(
+            code__in=[code for code, _ in pairs]
+        ) if (code.code, code.user_id) in pairs]
+        code_filter.add_many(code.code for code in codes)
+        for code in codes:
+            code_cache.set(code)
+        get_event_log().publish_many([code_created(code) for code in codes])
+        return len(codes)
+
+
+MODELS = {
+    'users': UsersIO(),
+    'refers': RefersIO(),
+    'codes': CodesIO(),
+}
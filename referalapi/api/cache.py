@@ -0,0 +1,325 @@
+import datetime as dt
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from hashlib import md5
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from users.models import Codes
+
+from .bloom import code_filter
+
+MISSING = 'missing'
+
+
+class CachedCode(NamedTuple):
+    '''Реферальный код в том виде, в котором он хранится в кеше.'''
+    id: int
+    code: str
+    user_id: int
+    expires_at: dt.datetime
+
+    @property
+    def is_expired(self) -> bool:
+        return timezone.now() > self.expires_at
+
+
+class LocalCache:
+    '''
+    Ограниченный по размеру LRU-кеш внутри процесса
+    со сроком жизни записей.
+    '''
+    def __init__(self, max_size: int, timeout: float):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CodeCache:
+    '''
+    Кеш реферальных кодов.
+    Код хранится кортежем (id, user_id, expires_at в секундах),
+    срок действия вычисляется при чтении. Записи обновляются
+    и удаляются сигналами модели Codes (см. api.signals).
+
+    Перед общим кешем стоит LRU-кеш процесса. При изменении или
+    удалении кода увеличивается общая метка версии; каждый процесс
+    сверяет ее не чаще раза в STAMP_INTERVAL секунд и при расхождении
+    очищает свой локальный кеш.
+
+    Несуществующие коды отсекаются фильтром Блума (api.bloom, с Redis),
+    а его ложноположительные ответы кешируются как MISSING на
+    CODE_NEGATIVE_CACHE_TIMEOUT, поэтому перебор кодов не доходит
+    до БД. MISSING хранится только в общем кеше и перезаписывается
+    при создании кода.
+    '''
+    version = 1
+
+    def __init__(self):
+        self.stats = Counter()
+        self._local = None
+        self._batch = threading.local()
+        self._stamp = None
+        self._stamp_checked = 0.0
+
+    @property
+    def stamp_key(self) -> str:
+        return f'code:v{self.version}:stamp'
+
+    @property
+    def local(self) -> LocalCache:
+        if self._local is None:
+            config = settings.CODE_LOCAL_CACHE
+            self._local = LocalCache(config['MAX_SIZE'], config['TIMEOUT'])
+        return self._local
+
+    def code_key(self, code: str) -> str:
+        return f'code:v{self.version}:{code}'
+
+    def user_key(self, user_id: int) -> str:
+        return f'code:v{self.version}:user:{user_id}'
+
+    @property
+    def timeout(self):
+        return settings.CODE_CACHE_TIMEOUT
+
+    def get(self, code: str):
+        '''Возвращает CachedCode, MISSING или None при промахе.'''
+        self.check_stamp()
+        cached = self.local.get(code)
+        if cached is not None:
+            self.stats['local_hits'] += 1
+            return cached
+        value = cache.get(self.code_key(code))
+        if value is None:
+            self.stats['misses'] += 1
+            return None
+        if value == MISSING:
+            self.stats['negative_hits'] += 1
+            return MISSING
+        self.stats['shared_hits'] += 1
+        cached = self.decode(code, value)
+        self.local.set(code, cached)
+        return cached
+
+    def get_for_user(self, user_id: int) -> Optional[str]:
+        return cache.get(self.user_key(user_id))
+
+    def fetch(self, code: str) -> Optional[CachedCode]:
+        '''Возвращает код из кеша, при промахе загружает его из БД.'''
+        cached = self.get(code)
+        if cached is MISSING:
+            return None
+        if cached is None:
+            if not code_filter.might_contain(code):
+                self.stats['filter_rejects'] += 1
+                return None
+            instance = Codes.objects.filter(code=code).first()
+            if instance is None:
+                cache.add(self.code_key(code), MISSING,
+                          timeout=settings.CODE_NEGATIVE_CACHE_TIMEOUT)
+                return None
+            cached = self.set(instance)
+        return cached
+
+    def fetch_for_user(self, user_id: int) -> Optional[str]:
+        '''Возвращает код юзера из кеша, при промахе загружает из БД.'''
+        code = self.get_for_user(user_id)
+        if code is None:
+            instance = Codes.objects.filter(user_id=user_id).first()
+            if instance is None:
+                return None
+            code = self.set(instance).code
+        return code
+
+    def set(self, instance: Codes) -> CachedCode:
+        cache.set_many(
+            {
+                self.code_key(instance.code): self.encode(instance),
+                self.user_key(instance.user_id): instance.code,
+            },
+            timeout=self.timeout
+        )
+        cached = CachedCode(instance.id, instance.code,
+                            instance.user_id, instance.expires_at)
+        self.local.set(instance.code, cached)
+        return cached
+
+    def delete(self, code: str, user_id: int):
+        pending = getattr(self._batch, 'pending', None)
+        if pending is not None:
+            pending.append((code, user_id))
+            return
+        self.delete_many([(code, user_id)])
+
+    def delete_many(self, codes):
+        '''
+        Удаляет коды и готовые ответы с ними (CodeResponseCache)
+        из кеша одним запросом по парам (code, user_id) и убирает
+        коды из фильтра Блума.
+        '''
+        keys = []
+        for code, user_id in codes:
+            keys += [self.code_key(code), self.user_key(user_id),
+                     code_response_cache.key(user_id)]
+            self.local.delete(code)
+        cache.delete_many(keys)
+        code_filter.remove_many(code for code, _ in codes)
+        self.bump()
+
+    @contextmanager
+    def batch_delete(self):
+        '''
+        Копит удаления кодов в текущем потоке и выполняет их
+        одним запросом при выходе из блока.
+        '''
+        self._batch.pending = []
+        try:
+            yield
+        finally:
+            pending = self._batch.pending
+            del self._batch.pending
+            if pending:
+                self.delete_many(pending)
+
+    def bump(self):
+        '''Сбрасывает локальные кеши кодов во всех процессах.'''
+        try:
+            cache.incr(self.stamp_key)
+        except ValueError:
+            cache.add(self.stamp_key, time.time_ns(), timeout=None)
+
+    def check_stamp(self):
+        now = time.monotonic()
+        interval = settings.CODE_LOCAL_CACHE['STAMP_INTERVAL']
+        if now - self._stamp_checked < interval:
+            return
+        self._stamp_checked = now
+        stamp = cache.get(self.stamp_key)
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self.local.clear()
+
+    @staticmethod
+    def encode(instance: Codes) -> tuple:
+        return (instance.id, instance.user_id,
+                instance.expires_at.timestamp())
+
+    @staticmethod
+    def decode(code: str, value: tuple) -> CachedCode:
+        id, user_id, expires_at = value
+        return CachedCode(
+            id, code, user_id,
+            dt.datetime.fromtimestamp(expires_at, tz=dt.timezone.utc)
+        )
+
+
+code_cache = CodeCache()
+
+
+class CachedResponse(NamedTuple):
+    '''Готовый ответ с кодом юзера: id кода, ETag и тело в JSON.'''
+    id: int
+    etag: str
+    body: bytes
+
+
+class CodeResponseCache:
+    '''
+    Кеш готовых ответов CodesViewSet. У юзера не больше одного кода,
+    поэтому на юзера хранится одна запись с уже отрендеренным кодом,
+    и чтение кода обходится одним запросом к кешу без БД.
+    Запись сбрасывается сигналами при создании, изменении и удалении
+    кода и при изменении юзера (в ответе есть его username).
+    Пока код действует, запись живет не дольше кода, чтобы поле
+    is_expired в ответе не устарело.
+    '''
+    version = 1
+
+    def key(self, user_id: int) -> str:
+        return f'code:v{self.version}:response:{user_id}'
+
+    def get(self, user_id: int) -> Optional[CachedResponse]:
+        return cache.get(self.key(user_id))
+
+    def set(self, instance: Codes, body: bytes) -> CachedResponse:
+        cached = CachedResponse(instance.id, md5(body).hexdigest(), body)
+        timeout = settings.CODE_CACHE_TIMEOUT
+        if not instance.is_expired:
+            timeout = min(timeout, (instance.expires_at
+                                    - timezone.now()).total_seconds())
+        cache.set(self.key(instance.user_id), cached, timeout=timeout)
+        return cached
+
+    def delete(self, user_id: int):
+        cache.delete(self.key(user_id))
+
+
+code_response_cache = CodeResponseCache()
+
+
+class ReferalsVersion:
+    '''
+    Счетчик версии списка рефералов для каждого реферера.
+    Увеличивается сигналами при изменении рефералов и используется
+    для ETag в условных GET-запросах.
+    '''
+    version = 1
+
+    def key(self, referer_id: int) -> str:
+        return f'referals:v{self.version}:version:{referer_id}'
+
+    def get(self, referer_id: int) -> int:
+        key = self.key(referer_id)
+        value = cache.get(key)
+        if value is None:
+            cache.add(key, time.time_ns(), timeout=None)
+            value = cache.get(key)
+        return value
+
+    def bump(self, referer_id: int):
+        try:
+            cache.incr(self.key(referer_id))
+        except ValueError:
+            cache.add(self.key(referer_id), time.time_ns(), timeout=None)
+
+
+referals_version = ReferalsVersion()
@@ -0,0 +1,155 @@
+import re
+import threading
+from hashlib import blake2b, sha256
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import receiver
+
+from users.constans import CODE_MAX_LENGTH, CODE_PREFIX
+from users.models import Sequence
+
+from .utils import get_redis
+
+CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CODE_BODY_LENGTH = CODE_MAX_LENGTH - len(CODE_PREFIX)
+HALF_BITS = 22
+RESERVED_CODE = re.compile(
+    rf'{re.escape(CODE_PREFIX)}[{CROCKFORD}]{{{CODE_BODY_LENGTH}}}'
+)
+
+
+def allocate_block(name: str, size: int) -> range:
+    '''
+    Выдает следующий блок номеров счетчика name. Выполняется
+    в отдельной транзакции (durable), чтобы откат внешней транзакции
+    не вернул уже выданный блок.
+    '''
+    with transaction.atomic(durable=True):
+        Sequence.objects.get_or_create(name=name)
+        Sequence.objects.filter(name=name).update(value=F('value') + size)
+        end = Sequence.objects.values_list('value', flat=True).get(name=name)
+    return range(end - size, end)
+
+
+class FeistelPermutation:
+    '''
+    Перестановка чисел от 0 до 2 ** (2 * half_bits) - 1, заданная
+    ключом: сеть Фейстеля с раундовой функцией на keyed BLAKE2b.
+    Соседние номера дают непохожие значения, и разные номера
+    всегда дают разные значения.
+    '''
+    def __init__(self, key: bytes, half_bits: int = HALF_BITS,
+                 rounds: int = 4):
+        self.key = sha256(key).digest()
+        self.half_bits = half_bits
+        self.mask = (1 << half_bits) - 1
+        self.rounds = rounds
+
+    def round(self, number: int, value: int) -> int:
+        digest = blake2b(value.to_bytes(4, 'big'), key=self.key,
+                         digest_size=4, person=bytes([number])).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def apply(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.mask
+        for number in range(self.rounds):
+            left, right = right, left ^ self.round(number, right)
+        return (left << self.half_bits) | right
+
+
+def encode(value: int) -> str:
+    '''Число в CODE_BODY_LENGTH символов base32 Крокфорда.'''
+    chars = []
+    for _ in range(CODE_BODY_LENGTH):
+        value, index = divmod(value, len(CROCKFORD))
+        chars.append(CROCKFORD[index])
+    return ''.join(reversed(chars))
+
+
+def is_reserved(code: str) -> bool:
+    '''Код в формате сгенерированных, такие коды нельзя задать вручную.'''
+    return RESERVED_CODE.fullmatch(code) is not None
+
+
+class CodeGenerator:
+    '''
+    Генератор реферальных кодов без коллизий и повторных попыток.
+    Номера берутся блоками по BLOCK_SIZE из счетчика в БД
+    (один запрос на блок), переставляются сетью Фейстеля
+    с ключом KEY и кодируются как R + 9 символов base32.
+
+    Если POOL_SIZE больше нуля и кеш в Redis, коды сначала берутся
+    из заранее заполненного списка (команда fill_code_pool),
+    а при пустом списке генерируются на месте.
+    '''
+    sequence = 'referral_code'
+    pool_key = 'codegen:v1:pool'
+
+    def __init__(self):
+        self._permutation = None
+        self._block = range(0)
+        self._position = 0
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> dict:
+        return settings.CODE_GENERATOR
+
+    @property
+    def permutation(self) -> FeistelPermutation:
+        if self._permutation is None:
+            self._permutation = FeistelPermutation(
+                self.config['KEY'].encode()
+            )
+        return self._permutation
+
+    def format(self, number: int) -> str:
+        return CODE_PREFIX + encode(self.permutation.apply(number))
+
+    def next_number(self) -> int:
+        with self._lock:
+            if self._position >= len(self._block):
+                self._block = allocate_block(self.sequence,
+                                             self.config['BLOCK_SIZE'])
+                self._position = 0
+            number = self._block[self._position]
+            self._position += 1
+        return number
+
+    def generate(self) -> str:
+        if self.config['POOL_SIZE']:
+            client = get_redis()
+            code = client.lpop(self.pool_key) if client else None
+            if code is not None:
+                return code.decode()
+        return self.format(self.next_number())
+
+    def fill_pool(self) -> int:
+        '''
+        Дополняет список готовых кодов до POOL_SIZE одним блоком
+        номеров. Возвращает число добавленных кодов.
+        '''
+        client = get_redis()
+        if client is None:
+            return 0
+        missing = self.config['POOL_SIZE'] - client.llen(self.pool_key)
+        if missing <= 0:
+            return 0
+        block = allocate_block(self.sequence, missing)
+        client.rpush(self.pool_key, *map(self.format, block))
+        return missing
+
+    def reset(self):
+        self._permutation = None
+
+
+code_generator = CodeGenerator()
+
+
+@receiver(setting_changed)
+def reset_code_generator(*, setting, **kwargs):
+    if setting == 'CODE_GENERATOR':
+        code_generator.reset()
@@ -0,0 +1,123 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from users.models import ReferCounter, ReferDailyCounter, Refers
+
+from .utils import batched
+
+TOTALS = ReferCounter._meta.db_table
+DAILY = ReferDailyCounter._meta.db_table
+
+ADD_TOTAL_SQL = f'''
+INSERT INTO {TOTALS} (user_id, total) VALUES (%s, %s)
+ON CONFLICT (user_id) DO UPDATE SET total = {TOTALS}.total + excluded.total
+'''
+
+ADD_DAILY_SQL = f'''
+INSERT INTO {DAILY} (user_id, day, count) VALUES (%s, %s, %s)
+ON CONFLICT (user_id, day) DO UPDATE SET count = {DAILY}.count + excluded.count
+'''
+
+
+def increase_refer_counters(totals: dict, days: dict):
+    '''
+    Прибавляет к общим счетчикам totals ({user_id: число}) и к дневным
+    days ({(user_id, день): число}) upsert'ами, создавая недостающие
+    счетчики: по запросу на таблицу, а для одного реферера на
+    PostgreSQL - один запрос на обе таблицы (psycopg2 отправляет
+    несколько команд одним запросом).
+    '''
+    if not totals:
+        return
+    total_rows = list(totals.items())
+    daily_rows = [(user_id, connection.ops.adapt_datefield_value(day), count)
+                  for (user_id, day), count in days.items()]
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql' and len(daily_rows) == 1:
+            cursor.execute(ADD_TOTAL_SQL + ';' + ADD_DAILY_SQL,
+                           [*total_rows[0], *daily_rows[0]])
+        else:
+            cursor.executemany(ADD_TOTAL_SQL, total_rows)
+            cursor.executemany(ADD_DAILY_SQL, daily_rows)
+
+
+def add_refer_counters(refers):
+    '''Добавляет вставленные рефералки в счетчики одним проходом.'''
+    increase_refer_counters(
+        Counter(refer.referer_id for refer in refers),
+        Counter((refer.referer_id, timezone.localdate(refer.created_at))
+                for refer in refers)
+    )
+
+
+def change_refer_counters(referer_id: int, created_at, delta: int):
+    '''
+    Изменяет общий и дневной счетчики рефералов юзера на delta.
+    Счетчики создаются только при увеличении: при каскадном удалении
+    юзера его счетчиков уже может не быть. Внутри уже открытой
+    транзакции (например, регистрации) точка сохранения не нужна.
+    '''
+    day = timezone.localdate(created_at)
+    if delta > 0:
+        increase_refer_counters({referer_id: delta},
+                                {(referer_id, day): delta})
+        return
+    with transaction.atomic(savepoint=False):
+        ReferCounter.objects.filter(user_id=referer_id).update(
+            total=F('total') + delta
+        )
+        ReferDailyCounter.objects.filter(user_id=referer_id, day=day).update(
+            count=F('count') + delta
+        )
+
+
+def get_refer_stats(referer_id: int, days: int) -> dict:
+    '''
+    Статистика рефералов юзера из счетчиков: общее число
+    и число по дням за последние days дней.
+    '''
+    since = timezone.localdate() - timedelta(days=days - 1)
+    total = ReferCounter.objects.filter(
+        user_id=referer_id).values_list('total', flat=True).first()
+    daily = ReferDailyCounter.objects.filter(
+        user_id=referer_id, day__gte=since, count__gt=0
+    ).order_by('day').values('day', 'count')
+    return {'referer': referer_id, 'total': total or 0, 'daily': daily}
+
+
+def rebuild_refer_counters(batch_size: int = 1000) -> tuple:
+    '''
+    Пересчитывает все счетчики рефералов по таблице Refers.
+    Возвращает число общих и дневных счетчиков.
+    '''
+    totals = (
+        Refers.objects.order_by().values('referer_id')
+        .annotate(total=Count('id'))
+    )
+    daily = (
+        Refers.objects.order_by()
+        .annotate(day=TruncDate('created_at',
+                                tzinfo=timezone.get_current_timezone()))
+        .values('referer_id', 'day').annotate(count=Count('id'))
+    )
+    with transaction.atomic():
+        ReferCounter.objects.all().delete()
+        ReferDailyCounter.objects.all().delete()
+        for batch in batched(totals.iterator(), batch_size):
+            ReferCounter.objects.bulk_create(
+                ReferCounter(user_id=row['referer_id'], total=row['total'])
+                for row in batch
+            )
+        for batch in batched(daily.iterator(), batch_size):
+            ReferDailyCounter.objects.bulk_create(
+                ReferDailyCounter(user_id=row['referer_id'], day=row['day'],
+                                  count=row['count'])
+                for row in batch
+            )
+    return (ReferCounter.objects.count(),
+            ReferDailyCounter.objects.count())
@@ -0,0 +1,393 @@
+import asyncio
+import datetime as dt
+import json
+import re
+import time
+from functools import partial
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Max
+from django.dispatch import receiver
+from django.utils import timezone
+from redis.exceptions import RedisError, ResponseError
+
+from users.models import Event as EventRecord
+from users.models import EventOffset
+
+from .async_utils import database_sync_to_async
+from .utils import get_redis
+
+REFERRAL_CREATED = 'referral.created'
+CODE_CREATED = 'code.created'
+LATEST = '$'
+STREAM_ID = re.compile(r'\d+(-\d+)?')
+
+_event_log = None
+
+
+class Event(NamedTuple):
+    '''
+    Событие журнала: id (растет в порядке записи в журнал), тип,
+    данные и время создания. События, которые relay перенес в Redis
+    позже, получают новый id, но сохраняют исходный created_at.
+    '''
+    id: str
+    type: str
+    data: dict
+    created_at: str
+
+
+def referral_created(refer, username: str) -> tuple:
+    return REFERRAL_CREATED, {
+        'referer': refer.referer_id,
+        'referal': refer.referal_id,
+        'username': username,
+        'created_at': refer.created_at.isoformat(),
+    }
+
+
+def code_created(code) -> tuple:
+    return CODE_CREATED, {
+        'user': code.user_id,
+        'code': code.code,
+        'expires_at': code.expires_at.isoformat(),
+    }
+
+
+class BaseEventLog:
+    '''
+    Журнал событий только на добавление. Потребители читают его
+    после последнего известного им id (read) или группой
+    потребителей с подтверждением обработки (read_group и ack)
+    и не перечитывают списки рефералов целиком.
+    '''
+
+    @property
+    def config(self) -> dict:
+        return settings.EVENT_LOG
+
+    def publish(self, event_type: str, data: dict):
+        '''Добавляет событие после коммита текущей транзакции.'''
+        self.publish_many([(event_type, data)])
+
+    def publish_many(self, events: list):
+        if events:
+            transaction.on_commit(partial(self.append_many, events))
+
+    def append_many(self, events: list) -> list:
+        '''Добавляет пары (тип, данные), возвращает id событий.'''
+        raise NotImplementedError
+
+    def read(self, after: str, count: int, block: float = 0) -> list:
+        '''
+        До count событий после id after. Если их нет, ждет новые
+        до block секунд.
+        '''
+        raise NotImplementedError
+
+    async def aread(self, after: str, count: int, block: float = 0) -> list:
+        '''
+        read для асинхронных вьюх: журнал опрашивается без ожидания
+        раз в POLL_INTERVAL секунд, поэтому ожидание не занимает
+        ни воркер, ни поток.
+        '''
+        read = database_sync_to_async(self.read)
+        deadline = time.monotonic() + block
+        while True:
+            events = await read(after, count)
+            left = deadline - time.monotonic()
+            if events or left <= 0:
+                return events
+            await asyncio.sleep(min(self.config['POLL_INTERVAL'], left))
+
+    def read_group(self, group: str, consumer: str, count: int,
+                   block: float = 0) -> list:
+        '''
+        События для потребителя группы: сначала выданные раньше,
+        но не подтвержденные, затем новые.
+        '''
+        raise NotImplementedError
+
+    def ack(self, group: str, ids: list):
+        '''Подтверждает обработку событий группой.'''
+        raise NotImplementedError
+
+    def last_id(self) -> str:
+        raise NotImplementedError
+
+    def parse_id(self, value: str) -> str:
+        '''
+        Проверяет id события из запроса, $ - последнее событие.
+        При неверном id бросает ValueError.
+        '''
+        raise NotImplementedError
+
+    def relay(self) -> int:
+        '''Переносит в журнал отложенные события, возвращает их число.'''
+        return 0
+
+
+class DatabaseEventLog(BaseEventLog):
+    '''
+    Журнал в таблице Event для разработки без Redis. Ожидание
+    новых событий - опрос таблицы раз в POLL_INTERVAL секунд,
+    а у каждой группы потребителей одна позиция (EventOffset),
+    поэтому в группе должен быть один потребитель.
+    '''
+
+    def publish_many(self, events: list):
+        '''
+        Записывает события сразу, в текущей транзакции: они
+        сохраняются или откатываются вместе с ней, без отдельной
+        транзакции после коммита.
+        '''
+        if events:
+            self.append_many(events)
+
+    def append_many(self, events: list) -> list:
+        records = EventRecord.objects.bulk_create(
+            EventRecord(type=event_type, data=data)
+            for event_type, data in events
+        )
+        return [str(record.id) for record in records]
+
+    def read(self, after: str, count: int, block: float = 0) -> list:
+        deadline = time.monotonic() + block
+        while True:
+            records = (EventRecord.objects.filter(id__gt=int(after))
+                       .order_by('id')
+                       .values_list('id', 'type', 'data', 'created_at')
+                       [:count])
+            events = [Event(str(id), event_type, data, created_at.isoformat())
+                      for id, event_type, data, created_at in records]
+            left = deadline - time.monotonic()
+            if events or left <= 0:
+                return events
+            time.sleep(min(self.config['POLL_INTERVAL'], left))
+
+    def read_group(self, group: str, consumer: str, count: int,
+                   block: float = 0) -> list:
+        offset, _ = EventOffset.objects.get_or_create(group=group)
+        return self.read(str(offset.last_id), count, block)
+
+    def ack(self, group: str, ids: list):
+        if ids:
+            last_id = max(map(int, ids))
+            EventOffset.objects.filter(
+                group=group, last_id__lt=last_id
+            ).update(last_id=last_id)
+
+    def last_id(self) -> str:
+        return str(EventRecord.objects.aggregate(last=Max('id'))['last']
+                   or 0)
+
+    def parse_id(self, value: str) -> str:
+        if value == LATEST:
+            return self.last_id()
+        if not value.isdigit():
+            raise ValueError(value)
+        return value
+
+
+class RedisEventLog(BaseEventLog):
+    '''
+    Журнал в Redis Stream: XADD с MAXLEN (примерно MAXLEN последних
+    событий), ожидание новых событий - блокирующий XREAD, группы
+    потребителей - XREADGROUP и XACK. Потребитель забирает себе
+    события, которые другой потребитель группы получил, но не
+    подтвердил за CLAIM_IDLE секунд. Если Redis недоступен,
+    события сохраняются в таблицу Event, и relay переносит их
+    в поток позже: такие события идут в потоке после записанных
+    раньше них напрямую, порядок создания - по created_at.
+    '''
+    version = 1
+
+    def __init__(self):
+        self._groups = set()
+
+    @property
+    def key(self) -> str:
+        return f'events:v{self.version}'
+
+    def write(self, events: list) -> list:
+        '''Добавляет в поток тройки (тип, данные, created_at).'''
+        with get_redis().pipeline(transaction=False) as pipe:
+            for event_type, data, created_at in events:
+                pipe.xadd(
+                    self.key,
+                    {'type': event_type,
+                     'data': json.dumps(data, ensure_ascii=False),
+                     'created_at': created_at.isoformat()},
+                    maxlen=self.config['MAXLEN'], approximate=True
+                )
+            return [id.decode() for id in pipe.execute()]
+
+    def append_many(self, events: list) -> list:
+        now = timezone.now()
+        try:
+            return self.write([(event_type, data, now)
+                               for event_type, data in events])
+        except RedisError:
+            DatabaseEventLog().append_many(events)
+            return []
+
+    def decode(self, entries) -> list:
+        return [
+            Event(id.decode(), fields[b'type'].decode(),
+                  json.loads(fields[b'data']),
+                  fields[b'created_at'].decode() if b'created_at' in fields
+                  else self.id_time(id).isoformat())
+            for id, fields in entries
+            if fields
+        ]
+
+    @staticmethod
+    def id_time(id: bytes) -> dt.datetime:
+        '''Время записи события в поток по его id.'''
+        return dt.datetime.fromtimestamp(int(id.split(b'-')[0]) / 1000,
+                                         tz=dt.timezone.utc)
+
+    def read(self, after: str, count: int, block: float = 0) -> list:
+        response = get_redis().xread({self.key: after}, count=count,
+                                     block=int(block * 1000) or None)
+        if not response:
+            return []
+        return self.decode(response[0][1])
+
+    def create_group(self, client, group: str):
+        if group in self._groups:
+            return
+        try:
+            client.xgroup_create(self.key, group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._groups.add(group)
+
+    def read_group(self, group: str, consumer: str, count: int,
+                   block: float = 0) -> list:
+        client = get_redis()
+        self.create_group(client, group)
+        try:
+            response = client.xreadgroup(group, consumer, {self.key: '0'},
+                                         count=count)
+        except ResponseError as e:
+            # Поток с группой пропал (очистка или вытеснение ключа).
+            if 'NOGROUP' not in str(e):
+                raise
+            self._groups.discard(group)
+            self.create_group(client, group)
+            response = None
+        entries = response[0][1] if response else []
+        if not entries:
+            _, entries, *_ = client.xautoclaim(
+                self.key, group, consumer,
+                int(self.config['CLAIM_IDLE'] * 1000), count=count
+            )
+        if not entries:
+            response = client.xreadgroup(group, consumer, {self.key: '>'},
+                                         count=count,
+                                         block=int(block * 1000) or None)
+            entries = response[0][1] if response else []
+        # Удаленные из потока (MAXLEN) события приходят без данных.
+        trimmed = [id for id, fields in entries if not fields]
+        if trimmed:
+            client.xack(self.key, group, *trimmed)
+        return self.decode(entries)
+
+    def ack(self, group: str, ids: list):
+        if ids:
+            get_redis().xack(self.key, group, *ids)
+
+    def last_id(self) -> str:
+        entries = get_redis().xrevrange(self.key, count=1)
+        return entries[0][0].decode() if entries else '0-0'
+
+    def parse_id(self, value: str) -> str:
+        if value == LATEST:
+            return self.last_id()
+        if STREAM_ID.fullmatch(value) is None:
+            raise ValueError(value)
+        return value
+
+    def relay(self, batch_size: int = 1000) -> int:
+        records = list(EventRecord.objects.order_by('id')
+                       .values_list('id', 'type', 'data', 'created_at')
+                       [:batch_size])
+        if records:
+            self.write([record[1:] for record in records])
+            EventRecord.objects.filter(
+                id__in=[record[0] for record in records]
+            ).delete()
+        return len(records)
+
+
+def get_event_log() -> BaseEventLog:
+    '''
+    Журнал событий процесса: Redis Stream, если кеш в Redis,
+    иначе таблица Event (locmem в разработке).
+    '''
+    global _event_log
+    if _event_log is None:
+        _event_log = (RedisEventLog() if get_redis() is not None
+                      else DatabaseEventLog())
+    return _event_log
+
+
+async def stream_events(log: BaseEventLog, after: str, timeout: float,
+                        count: int):
+    '''
+    События после after в формате Server-Sent Events. Пока новых
+    событий нет, раз в MAX_WAIT секунд отправляется комментарий,
+    чтобы прокси не закрыли соединение. Через timeout секунд поток
+    заканчивается, и EventSource переподключается с Last-Event-ID.
+    '''
+    config = log.config
+    yield f'retry: {config["RETRY"] * 1000}\n\n'
+    deadline = time.monotonic() + timeout
+    while (left := deadline - time.monotonic()) > 0:
+        events = await log.aread(after, count,
+                                 block=min(config['MAX_WAIT'], left))
+        if not events:
+            yield ': ping\n\n'
+            continue
+        yield ''.join(
+            f'id: {event.id}\nevent: {event.type}\n'
+            f'data: {json.dumps(event.data, ensure_ascii=False)}\n\n'
+            for event in events
+        )
+        after = events[-1].id
+
+
+def get_read_params(log: BaseEventLog, params, headers) -> tuple:
+    '''
+    Параметры чтения журнала из запроса: after (заголовок
+    Last-Event-ID или параметр after, по умолчанию $ - только новые
+    события), limit (по умолчанию 100, не больше PAGE_SIZE) и timeout
+    (по умолчанию и максимум - MAX_WAIT). При неверном after бросает
+    ValueError.
+    '''
+    config = log.config
+    after = log.parse_id(headers.get('Last-Event-ID')
+                         or params.get('after', LATEST))
+    try:
+        limit = min(max(int(params.get('limit', 100)), 1),
+                    config['PAGE_SIZE'])
+    except ValueError:
+        limit = 100
+    try:
+        timeout = min(max(int(params.get('timeout', config['MAX_WAIT'])), 0),
+                      config['MAX_WAIT'])
+    except ValueError:
+        timeout = config['MAX_WAIT']
+    return after, limit, timeout
+
+
+@receiver(setting_changed)
+def reset_event_log(*, setting, **kwargs):
+    global _event_log
+    if setting in ('EVENT_LOG', 'CACHES'):
+        _event_log = None
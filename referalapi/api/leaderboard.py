@@ -0,0 +1,184 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from users.models import ReferCounter, ReferDailyCounter
+
+from .metrics import timed
+from .utils import batched, get_redis
+
+ALL_TIME = 'all'
+
+
+class Leaderboard:
+    '''
+    Рейтинг рефереров по числу рефералов в sorted set Redis:
+    общий и по дням. Наборы обновляются сигналами Refers после
+    коммита, рейтинг за окно (day, week, month) собирается
+    ZUNIONSTORE из дневных наборов и кешируется на
+    WINDOW_CACHE_TIMEOUT секунд. Место юзера ищется ZREVRANK
+    за O(log N). Если кеш не в Redis или Redis недоступен,
+    рейтинг считается по счетчикам рефералов в БД.
+    '''
+    version = 1
+
+    @property
+    def config(self) -> dict:
+        return settings.LEADERBOARD
+
+    @property
+    def windows(self) -> tuple:
+        return (ALL_TIME, *self.config['WINDOWS'])
+
+    @property
+    def max_days(self) -> int:
+        return max(self.config['WINDOWS'].values())
+
+    @property
+    def total_key(self) -> str:
+        return f'leaderboard:v{self.version}:total'
+
+    def day_key(self, day) -> str:
+        return f'leaderboard:v{self.version}:day:{day.isoformat()}'
+
+    def window_days(self, window: str) -> list:
+        today = timezone.localdate()
+        return [today - timedelta(days=i)
+                for i in range(self.config['WINDOWS'][window])]
+
+    def add(self, refers, delta: int = 1):
+        '''
+        Прибавляет delta к очкам рефереров за каждую рефералку.
+        Ошибки Redis не мешают запросу: рейтинг чинится командой
+        rebuild_leaderboard.
+        '''
+        client = get_redis()
+        if client is None:
+            return
+        totals, days = Counter(), Counter()
+        for refer in refers:
+            totals[refer.referer_id] += delta
+            days[(timezone.localdate(refer.created_at),
+                  refer.referer_id)] += delta
+        ttl = timedelta(days=self.max_days + 1)
+        try:
+            with client.pipeline(transaction=False) as pipe:
+                for user_id, value in totals.items():
+                    pipe.zincrby(self.total_key, value, user_id)
+                for (day, user_id), value in days.items():
+                    pipe.zincrby(self.day_key(day), value, user_id)
+                    pipe.expire(self.day_key(day), ttl)
+                if delta < 0:
+                    for key in {self.total_key,
+                                *(self.day_key(day) for day, _ in days)}:
+                        pipe.zremrangebyscore(key, '-inf', 0)
+                pipe.execute()
+        except RedisError:
+            pass
+
+    def window_key(self, client, window: str) -> str:
+        '''Ключ набора за окно, при необходимости собирает его.'''
+        if window == ALL_TIME:
+            return self.total_key
+        days = self.window_days(window)
+        key = f'leaderboard:v{self.version}:{window}:{days[0].isoformat()}'
+        if not client.exists(key):
+            with client.pipeline() as pipe:
+                pipe.zunionstore(key, [self.day_key(day) for day in days])
+                pipe.expire(key, self.config['WINDOW_CACHE_TIMEOUT'])
+                pipe.execute()
+        return key
+
+    def top(self, window: str, limit: int) -> list:
+        '''Первые limit рефереров: список пар (id юзера, число).'''
+        client = get_redis()
+        if client is not None:
+            try:
+                with timed('leaderboard'):
+                    key = self.window_key(client, window)
+                    return [
+                        (int(user_id), int(score))
+                        for user_id, score in client.zrevrange(
+                            key, 0, limit - 1, withscores=True
+                        )
+                    ]
+            except RedisError:
+                pass
+        return list(self.scores(window).order_by('-count', 'user_id')
+                    .values_list('user_id', 'count')[:limit])
+
+    def rank(self, window: str, user_id: int) -> tuple:
+        '''Место юзера (с 1) и его число, место None - нет в рейтинге.'''
+        client = get_redis()
+        if client is not None:
+            try:
+                with timed('leaderboard'):
+                    key = self.window_key(client, window)
+                    with client.pipeline(transaction=False) as pipe:
+                        pipe.zrevrank(key, user_id)
+                        pipe.zscore(key, user_id)
+                        rank, score = pipe.execute()
+                if rank is None:
+                    return None, 0
+                return rank + 1, int(score)
+            except RedisError:
+                pass
+        scores = self.scores(window)
+        count = scores.filter(user_id=user_id).values_list(
+            'count', flat=True).first()
+        if not count:
+            return None, 0
+        return scores.filter(count__gt=count).count() + 1, count
+
+    def scores(self, window: str):
+        '''Очки рефереров по счетчикам в БД (запасной вариант).'''
+        if window == ALL_TIME:
+            return (ReferCounter.objects.filter(total__gt=0)
+                    .annotate(count=F('total')).values('user_id', 'count'))
+        days = self.window_days(window)
+        return (ReferDailyCounter.objects.filter(day__gte=days[-1])
+                .values('user_id').annotate(count=Sum('count'))
+                .filter(count__gt=0))
+
+    def rebuild(self, batch_size: int = 5000) -> int:
+        '''
+        Пересобирает наборы из счетчиков рефералов в БД во временных
+        ключах и подменяет ими рабочие (RENAME). Возвращает число
+        рефереров в общем рейтинге.
+        '''
+        client = get_redis()
+        if client is None:
+            return 0
+        sources = {
+            self.total_key: ReferCounter.objects.filter(total__gt=0)
+            .values_list('user_id', 'total')
+        }
+        today = timezone.localdate()
+        for offset in range(self.max_days):
+            day = today - timedelta(days=offset)
+            sources[self.day_key(day)] = ReferDailyCounter.objects.filter(
+                day=day, count__gt=0).values_list('user_id', 'count')
+        total = 0
+        for key, rows in sources.items():
+            temporary = f'{key}:build'
+            client.delete(temporary)
+            count = 0
+            for batch in batched(rows.iterator(), batch_size):
+                client.zadd(temporary, dict(batch))
+                count += len(batch)
+            if key == self.total_key:
+                total = count
+            if count:
+                client.rename(temporary, key)
+                if key != self.total_key:
+                    client.expire(key, timedelta(days=self.max_days + 1))
+            else:
+                client.delete(key)
+        return total
+
+
+leaderboard = Leaderboard()
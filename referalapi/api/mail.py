@@ -0,0 +1,120 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from users.constans import (EMAIL_MAX_ATTEMPTS, EMAIL_MAX_RETRY_DELAY,
+                            EMAIL_RETRY_DELAY, EMAIL_SEND_LEASE)
+from users.models import OutgoingEmail
+
+from .metrics import timed
+
+REFERRAL_CODE_EMAIL = 'referral_code'
+
+
+def queue_code_email(user, code: str) -> OutgoingEmail:
+    '''
+    Ставит письмо с реферальным кодом в очередь на отправку.
+    Если для юзера уже есть неотправленное письмо с кодом,
+    обновляет его вместо создания дубля.
+    '''
+    fields = {
+        'recipient': user.email,
+        'subject': 'Your referral code',
+        'body': f'Ваш реферальный код: {code}',
+        'next_attempt_at': timezone.now(),
+    }
+    try:
+        with transaction.atomic():
+            email, _ = OutgoingEmail.objects.update_or_create(
+                user=user, kind=REFERRAL_CODE_EMAIL,
+                status=OutgoingEmail.PENDING, defaults=fields
+            )
+    except IntegrityError:
+        email = OutgoingEmail.objects.get(
+            user=user, kind=REFERRAL_CODE_EMAIL, status=OutgoingEmail.PENDING
+        )
+    return email
+
+
+def get_retry_delay(attempts: int) -> timedelta:
+    '''
+    Экспоненциальная задержка перед повторной отправкой письма.
+    '''
+    return timedelta(seconds=min(EMAIL_RETRY_DELAY * 2 ** (attempts - 1),
+                                 EMAIL_MAX_RETRY_DELAY))
+
+
+def claim_emails(batch_size: int) -> tuple:
+    '''
+    Забирает пачку писем из очереди в короткой транзакции: следующая
+    попытка переносится на EMAIL_SEND_LEASE секунд вперед, поэтому
+    другие воркеры эти письма не возьмут, а блокировки строк
+    снимаются до отправки. Если воркер упадет, письма вернутся
+    в очередь после этого срока. Возвращает письма и новое время
+    попытки, по которому потом проверяется, что письмо не менялось.
+    '''
+    with transaction.atomic():
+        emails = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutgoingEmail.PENDING,
+                    next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        claimed_until = timezone.now() + timedelta(seconds=EMAIL_SEND_LEASE)
+        OutgoingEmail.objects.filter(
+            pk__in=[email.pk for email in emails]
+        ).update(next_attempt_at=claimed_until)
+    return emails, claimed_until
+
+
+def send_queued_emails(connection, batch_size: int = 100) -> tuple:
+    '''
+    Отправляет пачку писем из очереди через переданное соединение.
+    Письма забираются claim_emails, а отправка и запись результата
+    идут вне транзакции, поэтому queue_code_email не ждет SMTP.
+    Результат записывается, только если письмо не поставили в очередь
+    заново во время отправки, иначе оно уйдет еще раз с новым текстом.
+    Возвращает число отправленных и неотправленных писем.
+    '''
+    emails, claimed_until = claim_emails(batch_size)
+    sent_ids = []
+    failed = 0
+    for email in emails:
+        message = EmailMessage(
+            subject=email.subject,
+            body=email.body,
+            from_email=settings.EMAIL_HOST_USER,
+            to=[email.recipient],
+            connection=connection,
+        )
+        try:
+            with timed('smtp'):
+                connection.open()
+                message.send(fail_silently=False)
+        except Exception as e:
+            failed += 1
+            attempts = email.attempts + 1
+            fields = {'attempts': attempts, 'last_error': str(e)}
+            if attempts >= EMAIL_MAX_ATTEMPTS:
+                fields['status'] = OutgoingEmail.FAILED
+            else:
+                fields['next_attempt_at'] = (
+                    timezone.now() + get_retry_delay(attempts)
+                )
+            OutgoingEmail.objects.filter(
+                pk=email.pk, status=OutgoingEmail.PENDING,
+                next_attempt_at=claimed_until
+            ).update(**fields)
+            connection.close()
+        else:
+            sent_ids.append(email.pk)
+    OutgoingEmail.objects.filter(
+        pk__in=sent_ids, status=OutgoingEmail.PENDING,
+        next_attempt_at=claimed_until
+    ).update(status=OutgoingEmail.SENT, sent_at=timezone.now(),
+             attempts=F('attempts') + 1, last_error='')
+    return len(sent_ids), failed
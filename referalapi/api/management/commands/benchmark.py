@@ -0,0 +1,102 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmark
+
+REGRESSION_RATIO = 1.2
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время ответа, число запросов к БД и попадания '
+            'в кеш для основных сценариев API на сгенерированных данных '
+            'во временной тестовой БД. Redis, SMTP и Hunter.io заменены '
+            'локальными заглушками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--referers', type=int, default=5)
+        parser.add_argument('--fanout', type=int, default=2000,
+                            help='Число рефералов у каждого реферера.')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--only', nargs='+', default=(),
+                            help='Запустить только указанные сценарии.')
+        parser.add_argument('--cache', choices=('locmem', 'fakeredis'),
+                            default='locmem')
+        parser.add_argument('--fast-hasher', action='store_true',
+                            help='Быстрый хешер паролей для сценариев '
+                                 'регистрации.')
+        parser.add_argument('--output',
+                            help='Сохранить результаты в JSON-файл.')
+        parser.add_argument('--compare',
+                            help='JSON-файл прошлого запуска для сравнения.')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Завершиться с ошибкой, если сценарий '
+                                 'стал медленнее, делает больше '
+                                 'запросов к БД или превышает '
+                                 'benchmark.QUERY_BUDGETS.')
+
+    def handle(self, *args, **options):
+        if options['fanout'] <= options['repeat']:
+            raise CommandError('--fanout должен быть больше --repeat.')
+        if options['cache'] == 'fakeredis':
+            try:
+                import fakeredis  # noqa: F401
+                import lupa  # noqa: F401
+            except ImportError:
+                raise CommandError('Для --cache fakeredis установите '
+                                   'пакет fakeredis[lua].')
+        extra = {}
+        if options['fast_hasher']:
+            extra['PASSWORD_HASHERS'] = benchmark.FAST_HASHERS
+        with benchmark.test_environment(options['cache'], **extra):
+            owners = benchmark.seed(options['referers'], options['fanout'])
+            results = benchmark.run(owners, options['repeat'],
+                                    options['only'])
+
+        previous = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                previous = json.load(file)
+        regressions = self.report(results, previous)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'Регрессии: {", ".join(regressions)}.')
+
+    def report(self, results, previous) -> list:
+        '''
+        Печатает таблицу результатов и возвращает сценарии, которые
+        делают больше запросов к БД или стали медленнее более чем
+        на 20% по медиане по сравнению с прошлым запуском, а также
+        сценарии, превысившие лимит запросов из QUERY_BUDGETS.
+        '''
+        self.stdout.write(
+            f'{"scenario":<17}{"status":>7}{"queries":>9}{"p50 ms":>10}'
+            f'{"p95 ms":>10}{"p99 ms":>10}{"cache hit":>11}'
+        )
+        regressions = []
+        for name, result in results.items():
+            hit_rate = result['cache_hit_rate']
+            hit_rate = '-' if hit_rate is None else f'{hit_rate:.0%}'
+            line = (
+                f'{name:<17}{result["status"]:>7}{result["queries"]:>9.1f}'
+                f'{result["p50_ms"]:>10.2f}{result["p95_ms"]:>10.2f}'
+                f'{result["p99_ms"]:>10.2f}{hit_rate:>11}'
+            )
+            budget = benchmark.QUERY_BUDGETS.get(name)
+            if budget is not None and result['max_queries'] > budget:
+                regressions.append(name)
+                line += f'  ЛИМИТ ЗАПРОСОВ: {budget}'
+            before = previous.get(name)
+            if before:
+                line += (f'   было: {before["queries"]:.1f} запр., '
+                         f'p50 {before["p50_ms"]:.2f} мс')
+                if (result['queries'] > before['queries']
+                        or result['p50_ms']
+                        > before['p50_ms'] * REGRESSION_RATIO):
+                    if name not in regressions:
+                        regressions.append(name)
+                    line += '  РЕГРЕССИЯ'
+            self.stdout.write(line)
+        return regressions
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Замеряет потоковую выгрузку рефералов (/export/): время '
+            'до первого байта, общее время и пик памяти для списков '
+            'разной длины во временной тестовой БД. Для сравнения '
+            'формат list собирает весь список в памяти.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+',
+                            default=[10000, 100000],
+                            help='Длины списков рефералов.')
+        parser.add_argument('--output', nargs='+',
+                            choices=('ndjson', 'csv', 'list'),
+                            default=['ndjson', 'csv', 'list'])
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"rows":>8} {"output":<8}{"first ms":>10}{"total ms":>10}'
+            f'{"peak MB":>9}{"MB":>8}'
+        )
+        for rows in options['rows']:
+            with benchmark.test_environment():
+                owners = benchmark.seed(1, rows)
+                for output in options['output']:
+                    result = benchmark.measure_export(owners[0], output)
+                    self.stdout.write(
+                        f'{rows:>8} {output:<8}'
+                        f'{result["first_ms"]:>10.1f}'
+                        f'{result["total_ms"]:>10.1f}'
+                        f'{result["peak_mb"]:>9.1f}'
+                        f'{result["bytes"] / 2 ** 20:>8.1f}'
+                    )
+        self.stdout.write(f'БД: {connection.vendor}.')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает сериализацию списка рефералов через модели '
+            'и из строк values(), а также рендеринг и разбор JSON '
+            'стандартным json и orjson на сгенерированном списке '
+            'во временной тестовой БД.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Число рефералов в списке.')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with benchmark.test_environment():
+            owners = benchmark.seed(1, options['rows'])
+            results = benchmark.measure_listing(owners[0].pk,
+                                                options['repeat'])
+        self.stdout.write(
+            f'{connection.vendor}: {results.pop("rows")} рефералов, ответ '
+            f'{results.pop("bytes") / 1024:.0f} КБ.'
+        )
+        self.stdout.write(f'{"stage":<18}{"p50 ms":>10}')
+        for name, value in results.items():
+            self.stdout.write(f'{name:<18}{value:>10.2f}')
@@ -0,0 +1,43 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Замеряет скорость хеширования паролей профилями хешеров '
+            '(хешей в секунду всего и на ядро) и проверку по списку '
+            'распространенных паролей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+',
+                            choices=tuple(benchmark.HASHER_PROFILES),
+                            default=tuple(benchmark.HASHER_PROFILES))
+        parser.add_argument('--threads', type=int, nargs='+',
+                            default=sorted({1, os.cpu_count() or 1}))
+        parser.add_argument('--count', type=int, default=50,
+                            help='Число хешей на замер.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"profile":<9}{"threads":>8}{"hash/s":>10}{"per core":>10}'
+        )
+        for profile in options['profiles']:
+            hashers = benchmark.HASHER_PROFILES[profile]
+            with override_settings(PASSWORD_HASHERS=hashers):
+                for threads in options['threads']:
+                    result = benchmark.measure_hashing(options['count'],
+                                                       threads)
+                    self.stdout.write(
+                        f'{profile:<9}{threads:>8}'
+                        f'{result["per_second"]:>10.1f}'
+                        f'{result["per_core"]:>10.1f}'
+                    )
+        result = benchmark.measure_common_passwords()
+        self.stdout.write(
+            f'Список распространенных паролей: загрузка '
+            f'{result["load_ms"]:.1f} мс, проверка пароля '
+            f'{result["validate_ms"] * 1000:.2f} мкс.'
+        )
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api import benchmark
+from api.tree import get_max_depth, rebuild_closure
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает чтение дерева рефералов рекурсивным CTE '
+            'и по таблице замыкания на сгенерированном дереве '
+            'во временной тестовой БД.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--branching', type=int, default=4,
+                            help='Число рефералов у каждого юзера.')
+        parser.add_argument('--depth', type=int, default=None,
+                            help='Глубина дерева в запросах, по умолчанию '
+                                 'REFER_TREE["MAX_DEPTH"].')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        depth = options['depth'] or get_max_depth()
+        tree = {'CLOSURE': False, 'MAX_DEPTH': depth}
+        with benchmark.test_environment(REFER_TREE=tree):
+            started = time.perf_counter()
+            ids = benchmark.seed_tree(options['users'], options['branching'])
+            self.stdout.write(
+                f'{connection.vendor}: {len(ids)} юзеров за '
+                f'{time.perf_counter() - started:.1f} с.'
+            )
+            started = time.perf_counter()
+            links = rebuild_closure(depth)
+            self.stdout.write(
+                f'Замыкание: {links} связей за '
+                f'{time.perf_counter() - started:.1f} с.'
+            )
+            self.stdout.write(
+                f'{"user":<8}{"method":<9}{"scenario":<12}{"queries":>9}'
+                f'{"p50 ms":>10}{"p95 ms":>10}'
+            )
+            for label, user_id in (('root', ids[0]), ('child', ids[1])):
+                for method, closure in (('cte', False), ('closure', True)):
+                    results = benchmark.measure_tree(
+                        user_id, depth, options['repeat'], closure
+                    )
+                    for name, result in results.items():
+                        self.stdout.write(
+                            f'{label:<8}{method:<9}{name:<12}'
+                            f'{result["queries"]:>9.1f}'
+                            f'{result["p50_ms"]:>10.2f}'
+                            f'{result["p95_ms"]:>10.2f}'
+                        )
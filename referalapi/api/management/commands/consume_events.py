@@ -0,0 +1,44 @@
+import json
+import socket
+
+from django.core.management.base import BaseCommand
+
+from api.events import get_event_log
+
+
+class Command(BaseCommand):
+    help = ('Читает журнал событий группой потребителей и пишет '
+            'события в stdout в JSONL. Событие подтверждается после '
+            'записи, поэтому после падения неподтвержденные события '
+            'будут выданы снова. Заодно переносит в поток события, '
+            'которые не удалось записать в Redis.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group', required=True,
+                            help='Имя группы потребителей.')
+        parser.add_argument('--consumer', default=socket.gethostname(),
+                            help='Имя потребителя в группе.')
+        parser.add_argument('--count', type=int, default=100,
+                            help='Сколько событий читать за раз.')
+        parser.add_argument('--block', type=float, default=5,
+                            help='Сколько секунд ждать новых событий.')
+        parser.add_argument('--once', action='store_true',
+                            help='Прочитать одну пачку и выйти.')
+
+    def handle(self, *args, **options):
+        log = get_event_log()
+        try:
+            while True:
+                log.relay()
+                events = log.read_group(options['group'],
+                                        options['consumer'],
+                                        options['count'], options['block'])
+                for event in events:
+                    self.stdout.write(json.dumps(event._asdict(),
+                                                 ensure_ascii=False))
+                self.stdout.flush()
+                log.ack(options['group'], [event.id for event in events])
+                if options['once']:
+                    break
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,37 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.bulk import FORMATS, MODELS, write_rows
+
+
+class Command(BaseCommand):
+    help = ('Выгружает пользователей, рефералки или коды в CSV/JSONL. '
+            'Строки читаются из БД частями, поэтому память не растет '
+            'с размером таблицы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=MODELS)
+        parser.add_argument('path', nargs='?', default='-',
+                            help='Файл или - для stdout.')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        io = MODELS[options['model']]
+        file = (sys.stdout if options['path'] == '-'
+                else open(options['path'], 'w', encoding='utf-8',
+                          newline=''))
+        started = time.monotonic()
+        try:
+            count = write_rows(file, options['format'], io.fields,
+                               io.export_rows(options['chunk_size']))
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        elapsed = time.monotonic() - started
+        self.stderr.write(
+            f'Выгружено: {count}, {elapsed:.2f} с '
+            f'({count / elapsed if elapsed else 0:.0f} строк/с).'
+        )
@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.codegen import code_generator
+from api.utils import get_redis
+
+
+class Command(BaseCommand):
+    help = ('Поддерживает в Redis запас сгенерированных реферальных '
+            'кодов размером CODE_POOL_SIZE.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Пауза в секундах между проверками.')
+        parser.add_argument('--once', action='store_true',
+                            help='Дополнить запас один раз и выйти.')
+
+    def handle(self, *args, **options):
+        if not settings.CODE_GENERATOR['POOL_SIZE']:
+            raise CommandError('Запас кодов выключен: CODE_POOL_SIZE=0.')
+        if get_redis() is None:
+            raise CommandError('Запас кодов хранится только в Redis.')
+        try:
+            while True:
+                added = code_generator.fill_pool()
+                if added:
+                    self.stdout.write(f'Добавлено кодов: {added}.')
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,41 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.bulk import FORMATS, MODELS, read_rows
+from api.utils import batched
+
+
+class Command(BaseCommand):
+    help = ('Импортирует пользователей, рефералки или коды из CSV/JSONL '
+            'пачками через bulk_create. Уже существующие записи '
+            '(для пользователей - с занятым username или email) '
+            'пропускаются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=MODELS)
+        parser.add_argument('path', help='Файл или - для stdin.')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        io = MODELS[options['model']]
+        file = (sys.stdin if options['path'] == '-'
+                else open(options['path'], encoding='utf-8', newline=''))
+        started = time.monotonic()
+        read = inserted = 0
+        with file:
+            rows = read_rows(file, options['format'])
+            for batch in batched(rows, options['batch_size']):
+                read += len(batch)
+                inserted += io.import_rows(batch)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'Прочитано {read} строк.')
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Прочитано: {read}, добавлено: {inserted}, '
+            f'пропущено: {read - inserted}, '
+            f'{elapsed:.2f} с ({read / elapsed if elapsed else 0:.0f} '
+            f'строк/с).'
+        )
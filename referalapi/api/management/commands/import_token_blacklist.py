@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api.authentication import token_blacklist
+
+
+class Command(BaseCommand):
+    help = ('Переносит черный список refresh токенов из таблиц '
+            'token_blacklist в кеш. Запускается при деплое после '
+            'остановки старых воркеров и до запуска новых, иначе '
+            'токены из старого черного списка снова принимаются.')
+
+    def handle(self, *args, **options):
+        count = token_blacklist.import_sql()
+        if count is None:
+            self.stdout.write('Таблиц token_blacklist нет, переносить '
+                              'нечего.')
+            return
+        self.stdout.write(f'Токенов перенесено в кеш: {count}.')
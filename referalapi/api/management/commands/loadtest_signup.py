@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест регистрации: параллельные регистрации '
+            'во временной тестовой БД настроенного сервера БД. После '
+            'теста проверяется, что нет юзеров без рефералок и счетчики '
+            'рефералов сходятся.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--signups', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--referral', action='store_true',
+                            help='Регистрироваться по реферальному коду.')
+        parser.add_argument('--duplicates', action='store_true',
+                            help='Каждое имя одновременно регистрируют '
+                                 'два потока.')
+        parser.add_argument('--fast-hasher', action='store_true',
+                            help='Быстрый хешер паролей, чтобы мерить '
+                                 'только запись в БД.')
+        parser.add_argument('--hasher',
+                            choices=tuple(benchmark.HASHER_PROFILES),
+                            help='Профиль хешера паролей, по умолчанию '
+                                 'из PASSWORD_HASHERS.')
+        parser.add_argument('--async', action='store_true',
+                            dest='use_async',
+                            help='Регистрироваться через /api/async/users/.')
+
+    def handle(self, *args, **options):
+        extra = {}
+        if options['hasher']:
+            extra['PASSWORD_HASHERS'] = benchmark.HASHER_PROFILES[
+                options['hasher']
+            ]
+        if options['fast_hasher']:
+            extra['PASSWORD_HASHERS'] = benchmark.FAST_HASHERS
+        url = '/api/async/users/' if options['use_async'] else '/api/users/'
+        if options['duplicates'] and options['threads'] < 2:
+            raise CommandError('Для --duplicates нужно минимум 2 потока.')
+        with benchmark.test_environment(**extra):
+            owner = code = None
+            if options['referral']:
+                owner = benchmark.seed(referers=1, fanout=0)[0]
+                code = owner.code.get().code
+            result = benchmark.load_signups(
+                options['signups'], options['threads'], code,
+                options['duplicates'], url
+            )
+            problems = benchmark.check_signups(owner)
+
+        self.stdout.write(
+            f'{connection.vendor}, потоков: {options["threads"]}, '
+            f'CONN_MAX_AGE: {connection.settings_dict["CONN_MAX_AGE"]}'
+        )
+        self.stdout.write(
+            f'Успешно: {result["ok"]}, ошибок: {result["errors"]} '
+            f'{result["error_kinds"] or ""}'
+        )
+        self.stdout.write(
+            f'{result["per_second"]:.1f} регистраций/с '
+            f'({result["per_core"]:.1f} на ядро), '
+            f'p50 {result["p50_ms"]:.1f} мс, p95 {result["p95_ms"]:.1f} мс, '
+            f'p99 {result["p99_ms"]:.1f} мс'
+        )
+        if result['ok'] != options['signups']:
+            problems.append(f'успешных регистраций {result["ok"]} '
+                            f'вместо {options["signups"]}')
+        if problems:
+            raise CommandError(f'Нарушения: {"; ".join(problems)}.')
+        self.stdout.write('Нарушений нет.')
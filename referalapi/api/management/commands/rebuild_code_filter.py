@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.bloom import code_filter
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает фильтр Блума реферальных кодов по таблице '
+            'Codes. Запускается при деплое и периодически, так как '
+            'удаленные коды со временем копят ложноположительные ответы.')
+
+    def handle(self, *args, **options):
+        if not code_filter.enabled:
+            self.stdout.write('Кеш не в Redis, фильтр кодов отключен.')
+            return
+        count = code_filter.rebuild()
+        bloom = code_filter.bloom
+        self.stdout.write(
+            f'Кодов в фильтре: {count}, счетчиков: {bloom.size}, '
+            f'хеш-функций: {bloom.hashes}.'
+        )
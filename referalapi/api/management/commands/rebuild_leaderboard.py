@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.leaderboard import leaderboard
+from api.utils import get_redis
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает рейтинг рефереров в Redis по счетчикам '
+            'рефералов в БД.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if get_redis() is None:
+            self.stdout.write('Кеш не в Redis, рейтинг считается по БД.')
+            return
+        total = leaderboard.rebuild(options['batch_size'])
+        self.stdout.write(f'Рефереров в рейтинге: {total}.')
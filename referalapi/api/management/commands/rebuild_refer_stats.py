@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import rebuild_refer_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики рефералов по таблице Refers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        totals, daily = rebuild_refer_counters(options['batch_size'])
+        self.stdout.write(
+            f'Счетчиков рефералов: {totals}, дневных счетчиков: {daily}.'
+        )
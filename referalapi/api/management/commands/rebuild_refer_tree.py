@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.tree import get_max_depth, rebuild_closure
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает таблицу замыкания дерева рефералов '
+            'по таблице Refers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-depth', type=int, default=None,
+                            help='По умолчанию REFER_TREE["MAX_DEPTH"].')
+
+    def handle(self, *args, **options):
+        max_depth = options['max_depth'] or get_max_depth()
+        total = rebuild_closure(max_depth)
+        self.stdout.write(
+            f'Связей в дереве рефералов: {total} (до {max_depth} уровней).'
+        )
@@ -0,0 +1,46 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from api import metrics
+from api.mail import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = ('Отправляет письма из очереди пачками через одно '
+            'постоянное SMTP-соединение.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Сколько писем брать из очереди за раз.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Пауза в секундах, когда очередь пуста.')
+        parser.add_argument('--once', action='store_true',
+                            help='Разобрать очередь один раз и выйти.')
+
+    def handle(self, *args, **options):
+        connection = get_connection(fail_silently=False)
+        try:
+            while True:
+                with metrics.collect() as timings:
+                    sent, failed = send_queued_emails(
+                        connection, batch_size=options['batch_size']
+                    )
+                if sent or failed:
+                    self.stdout.write(
+                        f'Отправлено: {sent}, с ошибкой: {failed}.'
+                    )
+                    if options['verbosity'] > 1:
+                        self.stdout.write(
+                            timings.server_timing(timings.total)
+                        )
+                if sent + failed == options['batch_size']:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
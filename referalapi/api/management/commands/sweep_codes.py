@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.bulk import MODELS, write_rows
+from api.cache import code_cache
+from users.models import Codes
+
+
+class Command(BaseCommand):
+    help = ('Удаляет истекшие реферальные коды пачками и сбрасывает '
+            'их кеш. Рассчитана на запуск по расписанию (cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--older-than', type=int, default=0,
+                            help='Удалять коды, истекшие больше N дней '
+                                 'назад.')
+        parser.add_argument('--archive',
+                            help='Дописывать удаленные коды в JSONL-файл.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать истекшие коды.')
+
+    def handle(self, *args, **options):
+        expired = Codes.objects.filter(
+            expires_at__lt=timezone.now() - timedelta(
+                days=options['older_than'])
+        )
+        if options['dry_run']:
+            self.stdout.write(f'Истекших кодов: {expired.count()}.')
+            return
+
+        archive = None
+        if options['archive']:
+            archive = open(options['archive'], 'a', encoding='utf-8')
+        started = time.monotonic()
+        deleted = 0
+        try:
+            while True:
+                ids = list(expired.order_by('expires_at').values_list(
+                    'pk', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                batch = Codes.objects.filter(pk__in=ids)
+                with code_cache.batch_delete(), transaction.atomic():
+                    if archive:
+                        codes_io = MODELS['codes']
+                        write_rows(archive, 'jsonl', codes_io.fields,
+                                   codes_io.values(batch))
+                    deleted += batch.delete()[0]
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'Удалено {deleted} кодов.')
+        finally:
+            if archive:
+                archive.close()
+        self.stdout.write(
+            f'Удалено истекших кодов: {deleted} '
+            f'за {time.monotonic() - started:.2f} с.'
+        )
@@ -0,0 +1,266 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django_redis.cache import RedisCache
+
+from .passwords import TunedArgon2PasswordHasher
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    '''
+    Число обращений и суммарное время по компонентам (db, cache,
+    email, smtp, hash) за один запрос или одну пачку работы.
+    '''
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.components = {}
+
+    def add(self, component: str, seconds: float):
+        item = self.components.setdefault(component, [0, 0.0])
+        item[0] += 1
+        item[1] += seconds
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total: float) -> str:
+        '''Значение заголовка Server-Timing, время в миллисекундах.'''
+        parts = [
+            f'{name};desc="{name} x{count}";dur={seconds * 1000:.2f}'
+            for name, (count, seconds) in self.components.items()
+        ]
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+@contextmanager
+def collect():
+    '''Собирает замеры компонентов, сделанные внутри блока.'''
+    timings = RequestTimings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def record(component: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(component, seconds)
+
+
+@contextmanager
+def timed(component: str):
+    '''Замеряет время блока, если идет сбор замеров.'''
+    if _timings.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(component, time.perf_counter() - started)
+
+
+def db_wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', time.perf_counter() - started)
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    '''Подключает замер запросов к новому соединению с БД.'''
+    if db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_wrapper)
+
+
+def _timed_cache_method(name):
+    def method(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return getattr(super(TimedCacheMixin, self), name)(*args,
+                                                               **kwargs)
+        finally:
+            record('cache', time.perf_counter() - started)
+    method.__name__ = name
+    return method
+
+
+class TimedCacheMixin:
+    '''Замеряет время обращений к кешу.'''
+    get = _timed_cache_method('get')
+    set = _timed_cache_method('set')
+    add = _timed_cache_method('add')
+    delete = _timed_cache_method('delete')
+    get_many = _timed_cache_method('get_many')
+    set_many = _timed_cache_method('set_many')
+    delete_many = _timed_cache_method('delete_many')
+    incr = _timed_cache_method('incr')
+    has_key = _timed_cache_method('has_key')
+
+
+class TimedRedisCache(TimedCacheMixin, RedisCache):
+    pass
+
+
+class TimedHasherMixin:
+    '''
+    Замер времени хеширования паролей. Алгоритм и формат хеша
+    те же, что у исходного хешера, поэтому старые пароли
+    проверяются без изменений.
+    '''
+    def encode(self, password, salt, *args, **kwargs):
+        with timed('hash'):
+            return super().encode(password, salt, *args, **kwargs)
+
+
+class TimedPBKDF2PasswordHasher(TimedHasherMixin, PBKDF2PasswordHasher):
+    pass
+
+
+class TimedArgon2PasswordHasher(TimedHasherMixin, TunedArgon2PasswordHasher):
+    pass
+
+
+def escape(value) -> str:
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    return ','.join(f'{name}="{escape(value)}"'
+                    for name, value in zip(names, values))
+
+
+class Counter:
+    '''Счетчик в формате Prometheus.'''
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, value: float = 1):
+        with self._lock:
+            self.series[labels] = self.series.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in list(self.series.items()):
+            yield self.name, format_labels(self.labels, labels), value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{{{labels}}} {value}'
+                     for name, labels, value in self.samples())
+        return lines
+
+
+class Histogram(Counter):
+    '''
+    Гистограмма в формате Prometheus. Для каждого набора меток
+    хранит число наблюдений по корзинам, сумму и количество.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0
+                ]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(counts), total)
+                      for labels, (counts, total) in self.series.items()]
+        for labels, counts, total in series:
+            prefix = format_labels(self.labels, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield (f'{self.name}_bucket', f'{prefix},le="{bound}"',
+                       cumulative)
+            yield f'{self.name}_sum', prefix, total
+            yield f'{self.name}_count', prefix, cumulative
+
+
+REQUEST_DURATION = Histogram(
+    'referalapi_request_duration_seconds',
+    'Время обработки запроса.', ('route', 'method', 'status')
+)
+COMPONENT_DURATION = Histogram(
+    'referalapi_request_component_seconds',
+    'Время обращений к компоненту за запрос.', ('route', 'component')
+)
+COMPONENT_CALLS = Counter(
+    'referalapi_request_component_calls_total',
+    'Число обращений к компоненту.', ('route', 'component')
+)
+
+
+def observe_request(route: str, method: str, status: int,
+                    timings: RequestTimings, total: float):
+    REQUEST_DURATION.observe((route, method, status), total)
+    for component, (count, seconds) in timings.components.items():
+        COMPONENT_DURATION.observe((route, component), seconds)
+        COMPONENT_CALLS.inc((route, component), count)
+
+
+def render() -> str:
+    from .cache import code_cache
+
+    code_cache_hits = Counter(
+        'referalapi_code_cache_total',
+        'Обращения к кешу реферальных кодов.', ('result',)
+    )
+    code_cache_hits.series = {
+        (result,): count for result, count in code_cache.stats.items()
+    }
+    lines = []
+    for metric in (REQUEST_DURATION, COMPONENT_DURATION, COMPONENT_CALLS,
+                   code_cache_hits):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    '''
+    Метрики процесса в формате Prometheus. Если задан METRICS_TOKEN,
+    нужен заголовок Authorization: Bearer <токен>.
+    '''
+    config = settings.PERFORMANCE_METRICS
+    if not config['ENABLED']:
+        raise Http404
+    token = config['TOKEN']
+    if token and not constant_time_compare(
+            request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
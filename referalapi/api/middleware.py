@@ -0,0 +1,55 @@
+import asyncio
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics
+
+
+class PerformanceMetricsMiddleware:
+    '''
+    Замеряет время обработки запроса и обращений к БД, кешу,
+    проверке почты и хешированию паролей. Замеры пишутся
+    в гистограммы по имени маршрута (см. /metrics) и в заголовок
+    Server-Timing. Отключается настройкой PERFORMANCE_METRICS.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = settings.PERFORMANCE_METRICS
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = config['SERVER_TIMING']
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with metrics.collect() as timings:
+            response = self.get_response(request)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        with metrics.collect() as timings:
+            response = await self.get_response(request)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        total = timings.total
+        metrics.observe_request(get_route(request), request.method,
+                                response.status_code, timings, total)
+        if self.server_timing:
+            response['Server-Timing'] = timings.server_timing(total)
+        return response
+
+
+def get_route(request) -> str:
+    '''Имя маршрута из urls.py или путь к view, если имени нет.'''
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    return match.view_name
@@ -0,0 +1,26 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ReferalCursorPagination(CursorPagination):
+    '''
+    Курсорная пагинация списка рефералов по дате создания
+    рефералки и id записи. Порядок совпадает с индексом
+    refers_referer_created_idx, поэтому страница читается
+    по индексу без сортировки.
+    '''
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-created_at', '-id')
+
+
+class ReferTreeCursorPagination(CursorPagination):
+    '''
+    Курсорная пагинация уровня дерева рефералов по id юзера
+    (поле node из api.tree.downline). В таблице замыкания этот
+    порядок совпадает с индексом refer_closure_level_idx.
+    '''
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('node',)
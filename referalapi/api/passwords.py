@@ -0,0 +1,65 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, make_password
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+_executor = None
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    '''
+    Argon2id с параметрами из PASSWORD_HASHING['ARGON2']. Параметры
+    записываются в хеш, поэтому после их изменения старые пароли
+    проверяются как раньше и перехешируются при следующем входе.
+    '''
+    @property
+    def config(self) -> dict:
+        return settings.PASSWORD_HASHING['ARGON2']
+
+    @property
+    def time_cost(self) -> int:
+        return self.config['TIME_COST']
+
+    @property
+    def memory_cost(self) -> int:
+        return self.config['MEMORY_COST']
+
+    @property
+    def parallelism(self) -> int:
+        return self.config['PARALLELISM']
+
+
+def get_executor() -> ThreadPoolExecutor:
+    '''
+    Отдельный пул потоков для хеширования паролей, чтобы долгие
+    вычисления не занимали потоки для запросов к БД. Argon2
+    и PBKDF2 отпускают GIL, поэтому потоки хешируют параллельно.
+    '''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASHING['THREADS'],
+            thread_name_prefix='password-hash'
+        )
+    return _executor
+
+
+async def ahash_password(password: str) -> str:
+    '''Хеширует пароль в пуле потоков, не блокируя цикл событий.'''
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), partial(context.run, make_password, password)
+    )
+
+
+@receiver(setting_changed)
+def reset_password_executor(*, setting, **kwargs):
+    global _executor
+    if setting == 'PASSWORD_HASHING' and _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -1,75 +1,125 @@
 from datetime import timedelta
 
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.password_validation import validate_password
 from django.core import exceptions as django_exceptions
-from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from djoser.serializers import UserCreateSerializer
-from rest_framework import serializers
+from rest_framework import ISO_8601, serializers
 from rest_framework.relations import SlugRelatedField
 from rest_framework.settings import api_settings
 
 from users.models import Codes, Refers, User
 
-from .utils import check_email, get_timeout
+from .cache import CachedCode, code_cache
+from .codegen import code_generator, is_reserved
+from .utils import check_email
 
 
 class UserCreationSerializer(UserCreateSerializer):
-    '''Serializer для создания пользователя.'''
+    '''
+    Serializer для создания пользователя.
+    Юзер и его рефералка создаются в одной транзакции. Владелец кода
+    берется из предварительной проверки по кешу, а в БД код
+    перепроверяется тем же запросом, которым вставляется рефералка.
+    '''
     referral_code = serializers.CharField(write_only=True, required=False)
 
     class Meta:
         model = User
-        fields = ('id', 'email', 'password', 'username', 'referral_code')
+        fields = ('id', 'referral_code', 'email', 'password', 'username')
 
     def create(self, validated_data):
         referral_code = validated_data.pop('referral_code', None)
+        # Пароль хешируется до транзакции. Асинхронная регистрация
+        # хеширует его в отдельном пуле потоков и передает в контексте.
+        password = (self.context.get('password_hash')
+                    or make_password(validated_data['password']))
 
-        if referral_code:
-            code = cache.get(f'{referral_code}')
-            if not code:
-                try:
-                    code = Codes.objects.get(code=referral_code)
-                    cache.set(f'{referral_code}',
-                              {
-                                  'id': code.id,
-                                  'code': code.code,
-                                  'user': code.user.id,
-                                  'created_at': code.created_at,
-                                  'live_days': code.live_days,
-                                  'expires_at': code.expires_at,
-                                  'is_expired': code.is_expired
-                              },
-                              timeout=timedelta(days=1).total_seconds())
-                    if code.is_expired:
-                        raise serializers.ValidationError(
-                            'Срок годности реферального кода истек.'
-                        )
-                    code = cache.get(f'{code.code}')
-                except Codes.DoesNotExist:
-                    raise serializers.ValidationError(
-                        'Реферальный код недействителен.'
-                    )
-
-            if code['is_expired'] is True:
-                raise serializers.ValidationError(
-                    'Срок годности реферального кода истек!'
+        try:
+            with transaction.atomic():
+                # Транзакция начинается с записи: SQLite не может
+                # повысить блокировку чтения до записи без ожидания.
+                user = User.objects.create(
+                    email=User.objects.normalize_email(
+                        validated_data['email']
+                    ),
+                    username=User.normalize_username(
+                        validated_data['username']
+                    ),
+                    password=password,
                 )
-        user = User.objects.create_user(
-            email=validated_data['email'],
-            username=validated_data['username'],
-            password=validated_data['password'],
-        )
-
-        if referral_code:
-            Refers.objects.create(
-                referer_id=code['user'],
-                referal=user
+                if referral_code:
+                    self.create_refer(referral_code, user)
+        except IntegrityError:
+            # Параллельная регистрация с тем же именем или почтой
+            # прошла проверку уникальности раньше.
+            raise serializers.ValidationError(
+                'Пользователь с таким именем или почтой уже существует.'
             )
         return user
 
+    def create_refer(self, code: CachedCode, user: User) -> Refers:
+        '''
+        Рефералка по коду из validate_referral_code. Если код после
+        проверки удалили, передали или он истек, ошибка берется
+        из БД, а для кода с новым владельцем вставка повторяется.
+        '''
+        refer = Refers.objects.create_from_code(code.code, code.user_id, user)
+        if refer is None:
+            refer = Refers.objects.create_from_code(
+                code.code, self.get_referer_id(code.code), user
+            )
+        if refer is None:
+            raise serializers.ValidationError(
+                'Реферальный код недействителен.'
+            )
+        return refer
+
+    @staticmethod
+    def get_referer_id(referral_code: str) -> int:
+        '''Владелец кода, если код существует и не истек.'''
+        code = Codes.objects.filter(code=referral_code).values_list(
+            'user_id', 'expires_at'
+        ).first()
+        if code is None:
+            raise serializers.ValidationError(
+                'Реферальный код недействителен.'
+            )
+        if timezone.now() > code[1]:
+            raise serializers.ValidationError(
+                'Срок годности реферального кода истек.'
+            )
+        return code[0]
+
+    def validate_referral_code(self, value):
+        '''
+        Предварительная проверка кода по кешу: несуществующие
+        и истекшие коды отклоняются до проверки почты и хеширования
+        пароля, обычно без запроса к БД. Возвращает CachedCode,
+        чтобы create не искал владельца кода повторно.
+        '''
+        code = code_cache.fetch(value)
+        if code is None:
+            raise serializers.ValidationError(
+                'Реферальный код недействителен.'
+            )
+        if code.is_expired:
+            raise serializers.ValidationError(
+                'Срок годности реферального кода истек.'
+            )
+        return code
+
     def validate_email(self, value):
-        '''Проверка email на существование через Hunter.io'''
-        is_valid = check_email(value)
+        '''
+        Проверка email на существование через Hunter.io.
+        Асинхронная регистрация передает уже готовый результат
+        проверки в контексте.
+        '''
+        is_valid = self.context.get('email_is_valid')
+        if is_valid is None:
+            is_valid = check_email(value)
         if not is_valid:
             raise serializers.ValidationError('Этот email недействителен.')
         return value
@@ -96,6 +146,7 @@ class UserCreationSerializer(UserCreateSerializer):
 class CodeSerializer(serializers.ModelSerializer):
     '''
     Serializer для создания реферального кода.
+    Если код не передан, он генерируется на сервере.
     '''
     user = SlugRelatedField(
         slug_field='username',
@@ -108,18 +159,24 @@ class CodeSerializer(serializers.ModelSerializer):
         fields = ('id', 'code', 'user', 'created_at',
                   'live_days', 'expires_at', 'is_expired')
         read_only_fields = ('user', 'expires_at')
+        extra_kwargs = {'code': {'required': False}}
+        # Код уникален сам по себе, поэтому проверка пары (code, user)
+        # лишняя и к тому же требует передать код.
+        validators = []
+
+    def validate_code(self, value):
+        if is_reserved(value):
+            raise serializers.ValidationError(
+                'Коды такого вида выдаются только сервером.'
+            )
+        return value
 
     def validate(self, data):
         if self.context.get('request').method == 'POST':
             user = self.context['request'].user
 
-            code = cache.get(f'user_{user.id}')
-            if code:
-                raise serializers.ValidationError(
-                    'Одновременно можно иметь только 1 код!'
-                )
-            code = user.code.filter(user=user)
-            if code.exists():
+            if (code_cache.get_for_user(user.id)
+                    or user.code.filter(user=user).exists()):
                 raise serializers.ValidationError(
                     'Одновременно можно иметь только 1 код!'
                 )
@@ -127,57 +184,15 @@ class CodeSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        code = Codes.objects.create(**validated_data)
-
-        cache.set(
-            f'{code.code}',
-            {
-                'id': code.id,
-                'code': code.code,
-                'user': code.user.id,
-                'created_at': code.created_at,
-                'live_days': code.live_days,
-                'expires_at': code.expires_at,
-                'is_expired': code.is_expired
-            },
-            timeout=timedelta(days=code.live_days).total_seconds()
-        )
-        cache.set(
-            f'user_{code.user.id}',
-            code.code,
-            timeout=timedelta(days=code.live_days).total_seconds()
-        )
-
-        return code
+        if not validated_data.get('code'):
+            validated_data['code'] = code_generator.generate()
+        return super().create(validated_data)
 
     def update(self, instance, validated_data):
         if 'live_days' in validated_data:
-            new_live_days = validated_data['live_days']
             instance.expires_at = instance.created_at + timedelta(
-                days=new_live_days
+                days=validated_data['live_days']
             )
-
-            timeout = get_timeout(instance.expires_at)
-
-            cache.set(
-                f'{instance.code}',
-                {
-                    'id': instance.id,
-                    'code': instance.code,
-                    'user': instance.user.id,
-                    'created_at': instance.created_at,
-                    'live_days': new_live_days,
-                    'expires_at': instance.expires_at,
-                    'is_expired': instance.is_expired
-                },
-                timeout=timeout.total_seconds()
-            )
-            cache.set(
-                f'user_{instance.user.id}',
-                instance.code,
-                timeout=timeout.total_seconds()
-            )
-
         return super().update(instance, validated_data)
 
 
@@ -191,6 +206,45 @@ class UserReferalSerializer(serializers.ModelSerializer):
         fields = ('username', 'date_joined')
 
 
+class ReferalListSerializer(serializers.ListSerializer):
+    '''
+    Облегченный вывод списка рефералов только для чтения: ответ
+    собирается из строк Refers.objects.for_referer обычными dict,
+    без моделей и без ReferalSerializer на каждую строку.
+    Вид ответа тот же.
+    '''
+
+    def get_date_formatter(self):
+        '''
+        Вывод даты как у поля date_joined, но с часовым поясом,
+        найденным один раз на весь список, а не для каждой строки.
+        '''
+        field = self.child.fields['referal'].fields['date_joined']
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        field_timezone = getattr(field, 'timezone', None)
+        if field_timezone is None:
+            field_timezone = field.default_timezone()
+        if (field_timezone is None or not isinstance(output_format, str)
+                or output_format.lower() != ISO_8601):
+            return field.to_representation
+
+        def to_representation(value):
+            value = value.astimezone(field_timezone).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return to_representation
+
+    def to_representation(self, data):
+        date_joined = self.get_date_formatter()
+        return [
+            {'referal': {'username': row['referal__username'],
+                         'date_joined': date_joined(
+                             row['referal__date_joined'])}}
+            for row in data
+        ]
+
+
 class ReferalSerializer(serializers.ModelSerializer):
     '''
     Serializer для просмотра списка собственных рефералов пользователя и
@@ -201,3 +255,84 @@ class ReferalSerializer(serializers.ModelSerializer):
     class Meta:
         model = Refers
         fields = ('referal',)
+        list_serializer_class = ReferalListSerializer
+
+
+class ReferDailyStatsSerializer(serializers.Serializer):
+    day = serializers.DateField()
+    count = serializers.IntegerField()
+
+
+class ReferStatsSerializer(serializers.Serializer):
+    '''
+    Serializer для статистики рефералов пользователя.
+    '''
+    referer = serializers.IntegerField()
+    total = serializers.IntegerField()
+    daily = ReferDailyStatsSerializer(many=True)
+
+
+class ReferTreeLevelSerializer(serializers.Serializer):
+    level = serializers.IntegerField()
+    count = serializers.IntegerField()
+
+
+class ReferTreeSerializer(serializers.Serializer):
+    '''
+    Serializer для числа рефералов пользователя по уровням дерева.
+    '''
+    referer = serializers.IntegerField()
+    depth = serializers.IntegerField()
+    levels = ReferTreeLevelSerializer(many=True)
+
+
+class ReferTreeMemberSerializer(serializers.ModelSerializer):
+    '''
+    Serializer для рефералов одного уровня дерева. referer - id юзера,
+    по коду которого зарегистрировался реферал.
+    '''
+    referer = serializers.IntegerField(source='parent_id', read_only=True)
+
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'date_joined', 'referer')
+
+
+class LeaderboardEntrySerializer(serializers.Serializer):
+    rank = serializers.IntegerField()
+    user = serializers.IntegerField()
+    username = serializers.CharField()
+    count = serializers.IntegerField()
+
+
+class LeaderboardSerializer(serializers.Serializer):
+    '''
+    Serializer для рейтинга рефереров за окно.
+    '''
+    window = serializers.CharField()
+    results = LeaderboardEntrySerializer(many=True)
+
+
+class LeaderboardRankSerializer(serializers.Serializer):
+    '''
+    Serializer для места пользователя в рейтинге рефереров.
+    '''
+    window = serializers.CharField()
+    rank = serializers.IntegerField(allow_null=True)
+    count = serializers.IntegerField()
+
+
+class EventSerializer(serializers.Serializer):
+    id = serializers.CharField()
+    type = serializers.CharField()
+    data = serializers.JSONField()
+    created_at = serializers.CharField()
+
+
+class EventBatchSerializer(serializers.Serializer):
+    '''
+    Serializer для событий журнала. last_id - id, после которого
+    читать в следующем запросе.
+    '''
+    last_id = serializers.CharField()
+    events = EventSerializer(many=True)
@@ -0,0 +1,133 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from users.models import Codes, Refers, User
+
+from .authentication import user_cache
+from .bloom import code_filter
+from .cache import code_cache, code_response_cache, referals_version
+from .counters import change_refer_counters
+from .events import code_created, get_event_log, referral_created
+from .leaderboard import leaderboard
+from .tree import add_edge, remove_edge, use_closure
+
+
+@receiver(post_init, sender=Codes)
+def remember_code(sender, instance, **kwargs):
+    '''Запоминает исходное значение кода, чтобы сбросить старый ключ.'''
+    instance._cached_code = instance.__dict__.get('code')
+
+
+@receiver(post_save, sender=Codes)
+def update_code_cache(sender, instance, created, **kwargs):
+    previous = instance._cached_code
+    renamed = previous and previous != instance.code
+    if renamed:
+        transaction.on_commit(
+            partial(code_cache.delete, previous, instance.user_id)
+        )
+    if created or renamed:
+        transaction.on_commit(
+            partial(code_filter.add_many, [instance.code])
+        )
+    instance._cached_code = instance.code
+    transaction.on_commit(partial(code_cache.set, instance))
+    transaction.on_commit(
+        partial(code_response_cache.delete, instance.user_id)
+    )
+    if not created:
+        transaction.on_commit(code_cache.bump)
+
+
+@receiver(post_delete, sender=Codes)
+def invalidate_code_cache(sender, instance, **kwargs):
+    transaction.on_commit(
+        partial(code_cache.delete, instance.code, instance.user_id)
+    )
+
+
+@receiver(post_save, sender=Refers)
+@receiver(post_delete, sender=Refers)
+def bump_referals_version(sender, instance, **kwargs):
+    transaction.on_commit(
+        partial(referals_version.bump, instance.referer_id)
+    )
+
+
+@receiver(post_save, sender=Refers)
+def increment_refer_counters(sender, instance, created, **kwargs):
+    if created:
+        change_refer_counters(instance.referer_id, instance.created_at, 1)
+
+
+@receiver(post_delete, sender=Refers)
+def decrement_refer_counters(sender, instance, **kwargs):
+    change_refer_counters(instance.referer_id, instance.created_at, -1)
+
+
+@receiver(post_save, sender=Refers)
+def increment_leaderboard(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(partial(leaderboard.add, [instance]))
+
+
+@receiver(post_delete, sender=Refers)
+def decrement_leaderboard(sender, instance, **kwargs):
+    transaction.on_commit(partial(leaderboard.add, [instance], -1))
+
+
+@receiver(post_save, sender=Refers)
+def publish_referral_created(sender, instance, created, **kwargs):
+    if created:
+        get_event_log().publish(
+            *referral_created(instance, instance.referal.username)
+        )
+
+
+@receiver(post_save, sender=Codes)
+def publish_code_created(sender, instance, created, **kwargs):
+    if created:
+        get_event_log().publish(*code_created(instance))
+
+
+@receiver(post_save, sender=Refers)
+def add_refer_closure(sender, instance, created, **kwargs):
+    if created and use_closure():
+        add_edge(instance.referer_id, instance.referal_id)
+
+
+@receiver(post_delete, sender=Refers)
+def remove_refer_closure(sender, instance, **kwargs):
+    if use_closure():
+        remove_edge(instance.referer_id, instance.referal_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    transaction.on_commit(partial(user_cache.delete, instance.pk))
+    transaction.on_commit(partial(code_response_cache.delete, instance.pk))
+
+
+@receiver(post_init, sender=User)
+def remember_referal_fields(sender, instance, **kwargs):
+    '''Запоминает поля юзера, которые видны в списке рефералов.'''
+    instance._referal_fields = (instance.__dict__.get('username'),
+                                instance.__dict__.get('date_joined'))
+
+
+@receiver(post_save, sender=User)
+def bump_referers_versions(sender, instance, created, update_fields,
+                           **kwargs):
+    if update_fields and not {'username', 'date_joined'} & update_fields:
+        return
+    fields = (instance.username, instance.date_joined)
+    if created or instance._referal_fields == fields:
+        return
+    instance._referal_fields = fields
+    for referer_id in Refers.objects.filter(
+            referal=instance).values_list('referer_id', flat=True):
+        transaction.on_commit(partial(referals_version.bump, referer_id))
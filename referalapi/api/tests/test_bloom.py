@@ -0,0 +1,39 @@
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from api import benchmark
+from api.bloom import code_filter
+from users.models import Codes
+
+
+@override_settings(**benchmark.get_test_settings('fakeredis'))
+class CodeFilterTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        code_filter.reset()
+        benchmark.seed(1, 1)
+        self.code = Codes.objects.get().code
+
+    def test_missing_key_builds_in_background(self):
+        # Пока фильтр не собран, запрос не читает таблицу кодов.
+        with self.assertNumQueries(0):
+            self.assertTrue(code_filter.might_contain('missing'))
+        code_filter._builder.join()
+        self.assertTrue(code_filter.might_contain(self.code))
+        self.assertFalse(code_filter.might_contain('missing'))
+
+    def test_tracks_new_codes(self):
+        code_filter.rebuild()
+        self.assertFalse(code_filter.might_contain('added'))
+        code_filter.add_many(['added'])
+        self.assertTrue(code_filter.might_contain('added'))
+
+
+@override_settings(**benchmark.get_test_settings('locmem'))
+class LocalCodeFilterTests(TransactionTestCase):
+
+    def test_disabled_without_redis(self):
+        self.assertEqual(code_filter.rebuild(), 0)
+        with self.assertNumQueries(0):
+            self.assertTrue(code_filter.might_contain('missing'))
@@ -0,0 +1,115 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from api import benchmark
+from api.bulk import CodesIO, RefersIO, UsersIO
+from api.cache import code_cache
+from api.events import CODE_CREATED, REFERRAL_CREATED
+from users.models import Codes, Event, ReferCounter, Refers, User
+
+
+@override_settings(**benchmark.get_test_settings('locmem'))
+class UsersImportTests(TestCase):
+
+    def setUp(self):
+        User.objects.create(username='old', email='taken@bench.local',
+                            password='')
+
+    def test_skips_taken_username_and_email(self):
+        inserted = UsersIO().import_rows([
+            {'username': 'old', 'email': 'old@bench.local'},
+            {'username': 'new', 'email': 'taken@bench.local'},
+            {'username': 'first', 'email': 'same@bench.local'},
+            {'username': 'second', 'email': 'same@bench.local'},
+            {'username': 'ok', 'email': 'ok@bench.local'},
+        ])
+        self.assertEqual(inserted, 2)
+        self.assertEqual(
+            set(User.objects.values_list('username', flat=True)),
+            {'old', 'first', 'ok'}
+        )
+
+    def test_refers_resolve_imported_users(self):
+        UsersIO().import_rows([
+            {'username': 'referer', 'email': 'referer@bench.local'},
+            {'username': 'referal', 'email': 'referal@bench.local'},
+        ])
+        inserted = RefersIO().import_rows([
+            {'referer': 'referer', 'referal': 'referal'},
+        ])
+        self.assertEqual(inserted, 1)
+        self.assertTrue(Refers.objects.filter(
+            referer__username='referer', referal__username='referal'
+        ).exists())
+
+
+@override_settings(**benchmark.get_test_settings('locmem'))
+class RefersImportTests(TestCase):
+
+    def setUp(self):
+        UsersIO().import_rows([
+            {'username': name, 'email': f'{name}@bench.local'}
+            for name in ('first', 'second', 'taken', 'twice', 'new')
+        ])
+        RefersIO().import_rows([{'referer': 'first', 'referal': 'taken'}])
+
+    def test_counts_only_inserted(self):
+        inserted = RefersIO().import_rows([
+            {'referer': 'second', 'referal': 'taken'},
+            {'referer': 'second', 'referal': 'twice'},
+            {'referer': 'first', 'referal': 'twice'},
+            {'referer': 'second', 'referal': 'new'},
+        ])
+        self.assertEqual(inserted, 2)
+        self.assertEqual(
+            set(Refers.objects.values_list('referer__username',
+                                           'referal__username')),
+            {('first', 'taken'), ('second', 'twice'), ('second', 'new')}
+        )
+        self.assertEqual(ReferCounter.objects.get(
+            user__username='first').total, 1)
+        self.assertEqual(ReferCounter.objects.get(
+            user__username='second').total, 2)
+        self.assertEqual(
+            Event.objects.filter(type=REFERRAL_CREATED).count(), 3
+        )
+
+
+@override_settings(**benchmark.get_test_settings('locmem'))
+class CodesImportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        code_cache.local.clear()
+        UsersIO().import_rows([
+            {'username': name, 'email': f'{name}@bench.local'}
+            for name in ('owner', 'first', 'second', 'third')
+        ])
+        CodesIO().import_rows([
+            {'code': 'OLD', 'user': 'owner', 'live_days': 30},
+        ])
+
+    def test_one_code_per_user(self):
+        inserted = CodesIO().import_rows([
+            {'code': 'OWNER2', 'user': 'owner', 'live_days': 30},
+            {'code': 'OLD', 'user': 'first', 'live_days': 30},
+            {'code': 'FIRST', 'user': 'first', 'live_days': 30},
+            {'code': 'FIRST2', 'user': 'first', 'live_days': 30},
+            {'code': 'FIRST', 'user': 'second', 'live_days': 30},
+            {'code': 'THIRD', 'user': 'third', 'live_days': 30},
+        ])
+        self.assertEqual(inserted, 2)
+        self.assertEqual(
+            set(Codes.objects.values_list('user__username', 'code')),
+            {('owner', 'OLD'), ('first', 'FIRST'), ('third', 'THIRD')}
+        )
+        self.assertEqual(
+            Event.objects.filter(type=CODE_CREATED).count(), 3
+        )
+
+    def test_replaces_cached_missing_code(self):
+        self.assertIsNone(code_cache.fetch('NEW'))
+        CodesIO().import_rows([
+            {'code': 'NEW', 'user': 'first', 'live_days': 30},
+        ])
+        self.assertEqual(code_cache.fetch('NEW').code, 'NEW')
@@ -0,0 +1,64 @@
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from api import benchmark
+from api.bloom import code_filter
+from api.cache import code_cache
+from users.models import User
+
+
+@override_settings(**benchmark.get_test_settings('locmem'))
+class CodeResponseCacheTests(TransactionTestCase):
+    '''
+    Чтение своего кода из CodesViewSet при попадании в кеш ответов
+    не обращается к БД, а изменения кода сбрасывают кеш.
+    '''
+
+    def setUp(self):
+        cache.clear()
+        code_cache.local.clear()
+        code_filter.reset()
+        self.owner = benchmark.seed(1, 0)[0]
+        self.code = self.owner.code.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.urls = ('/api/code/', f'/api/code/{self.code.pk}/')
+
+    def test_hit_skips_db(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.client.get(url)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                with self.assertNumQueries(0):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag']
+                    )
+                self.assertEqual(response.status_code, 304)
+
+    def test_patch_invalidates(self):
+        url = self.urls[1]
+        etag = self.client.get(url)['ETag']
+        self.client.patch(url, {'live_days': 20})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['live_days'], 20)
+        self.assertEqual(self.client.get('/api/code/').json()[0]
+                         ['live_days'], 20)
+
+    def test_delete_invalidates(self):
+        self.client.get(self.urls[0])
+        self.client.delete(self.urls[1])
+        self.assertEqual(self.client.get(self.urls[0]).status_code, 404)
+
+    def test_create(self):
+        user = User.objects.create(username='new', password='',
+                                   email='new@bench.local')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/code/').status_code, 404)
+        response = self.client.post('/api/code/', {'live_days': 10})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.client.get('/api/code/').json(),
+                         [response.json()])
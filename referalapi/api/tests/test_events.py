@@ -0,0 +1,122 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api import benchmark
+from api.events import (CODE_CREATED, REFERRAL_CREATED, RedisEventLog,
+                        get_event_log)
+from users.models import Event as EventRecord
+from users.models import User
+
+
+@override_settings(**benchmark.get_test_settings('locmem'))
+class AsyncEventsTests(TransactionTestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create(username='staff', password='',
+                                         email='staff@bench.local',
+                                         is_staff=True)
+        self.user = User.objects.create(username='user', password='',
+                                        email='user@bench.local')
+        log = get_event_log()
+        log.append_many([(CODE_CREATED, {'n': 1}), (CODE_CREATED, {'n': 2})])
+        self.last_id = log.last_id()
+
+    def get(self, user, url='/api/async/events/', **params):
+        # AsyncClient в Django 3.2 передает data не в строку запроса.
+        return AsyncClient().get(
+            f'{url}?{urlencode(params)}',
+            authorization=f'Bearer {AccessToken.for_user(user)}'
+        )
+
+    async def test_long_poll(self):
+        response = await self.get(self.staff, after='0', timeout=0)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['last_id'], self.last_id)
+        self.assertEqual([event['data'] for event in data['events']],
+                         [{'n': 1}, {'n': 2}])
+        self.assertTrue(all(event['created_at']
+                            for event in data['events']))
+
+    async def test_long_poll_timeout(self):
+        response = await self.get(self.staff, after=self.last_id, timeout=0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(),
+                         {'last_id': self.last_id, 'events': []})
+
+    async def test_permissions(self):
+        response = await AsyncClient().get('/api/async/events/')
+        self.assertEqual(response.status_code, 401)
+        response = await self.get(self.user)
+        self.assertEqual(response.status_code, 403)
+
+    async def test_bad_after(self):
+        response = await self.get(self.staff, after='x')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(**benchmark.get_test_settings('fakeredis'))
+class RedisEventLogTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.log = get_event_log()
+
+    def consume(self, group):
+        output = StringIO()
+        call_command('consume_events', '--group', group, '--once',
+                     '--block', '0', stdout=output)
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_consumer_group(self):
+        self.assertIsInstance(self.log, RedisEventLog)
+        first, second = self.log.append_many([(CODE_CREATED, {'n': 1}),
+                                              (CODE_CREATED, {'n': 2})])
+        events = self.log.read_group('analytics', 'worker', 10)
+        self.assertEqual([event.id for event in events], [first, second])
+        self.log.ack('analytics', [first])
+        # Неподтвержденное событие выдается снова.
+        events = self.log.read_group('analytics', 'worker', 10)
+        self.assertEqual([event.id for event in events], [second])
+        self.log.ack('analytics', [second])
+        self.assertEqual(self.log.read_group('analytics', 'worker', 10), [])
+        # У другой группы своя позиция.
+        self.assertEqual(len(self.consume('billing')), 2)
+
+    def test_relay_keeps_created_at(self):
+        created_at = timezone.now() - timedelta(minutes=5)
+        EventRecord.objects.create(type=REFERRAL_CREATED, data={'n': 1},
+                                   created_at=created_at)
+        self.log.append_many([(CODE_CREATED, {'n': 2})])
+        events = self.consume('analytics')
+        self.assertFalse(EventRecord.objects.exists())
+        # Перенесенное событие идет в потоке позже, но с исходным
+        # временем создания.
+        self.assertEqual([event['data'] for event in events],
+                         [{'n': 2}, {'n': 1}])
+        self.assertEqual(events[1]['created_at'], created_at.isoformat())
+        self.assertLess(events[1]['created_at'], events[0]['created_at'])
+
+    def test_signup_and_code_events(self):
+        owner = benchmark.seed(1, 0)[0]
+        code = owner.code.get().code
+        with self.settings(PASSWORD_HASHERS=benchmark.FAST_HASHERS):
+            response = self.client.post('/api/users/', {
+                'username': 'invited', 'email': 'invited@bench.local',
+                'password': benchmark.BENCHMARK_PASSWORD,
+                'referral_code': code,
+            })
+        self.assertEqual(response.status_code, 201)
+        events = self.log.read('0', 10)
+        self.assertEqual([event.type for event in events],
+                         [REFERRAL_CREATED])
+        self.assertEqual(events[0].data['referer'], owner.pk)
+        self.assertEqual(events[0].data['username'], 'invited')
@@ -0,0 +1,56 @@
+import json
+
+from asgiref.sync import async_to_sync
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api import benchmark
+from api.async_utils import StreamingASGIHandler
+
+
+@override_settings(
+    REFERAL_EXPORT={'CHUNK_SIZE': 7, 'BATCH_SIZE': 5},
+    **benchmark.get_test_settings('locmem')
+)
+class ExportTests(TransactionTestCase):
+
+    def setUp(self):
+        self.owner = benchmark.seed(1, 30)[0]
+        self.url = f'/api/referer/{self.owner.pk}/export/'
+        self.token = str(AccessToken.for_user(self.owner))
+
+    async def asgi_get(self, path):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await StreamingASGIHandler()({
+            'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': b'',
+            'headers': [(b'host', b'testserver'),
+                        (b'authorization', f'Bearer {self.token}'.encode())],
+        }, receive, send)
+        return messages
+
+    def test_asgi(self):
+        # Запросы к БД идут не в цикле событий, ответ не обрывается.
+        messages = async_to_sync(self.asgi_get)(self.url)
+        self.assertEqual(messages[0]['status'], 200)
+        body = b''.join(message.get('body', b'')
+                        for message in messages[1:])
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(len(rows), 30)
+        self.assertFalse(messages[-1].get('more_body', False))
+
+    def test_wsgi(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = client.get(self.url, {'output': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 31)
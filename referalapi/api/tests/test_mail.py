@@ -0,0 +1,55 @@
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from api import benchmark
+from api.mail import queue_code_email, send_queued_emails
+from users.models import OutgoingEmail, User
+
+
+class RequeueBackend(EmailBackend):
+    '''Письмо ставят в очередь заново, пока оно отправляется.'''
+
+    def send_messages(self, messages):
+        queue_code_email(User.objects.get(username='user'), 'NEW')
+        return super().send_messages(messages)
+
+
+class FailingBackend(EmailBackend):
+
+    def send_messages(self, messages):
+        raise OSError('SMTP недоступен')
+
+
+@override_settings(**benchmark.get_test_settings('locmem'))
+class SendQueuedEmailsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='user', password='',
+                                        email='user@bench.local')
+        queue_code_email(self.user, 'OLD')
+
+    def test_sent(self):
+        self.assertEqual(send_queued_emails(EmailBackend()), (1, 0))
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.SENT)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_requeued_while_sending(self):
+        send_queued_emails(RequeueBackend())
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertIn('NEW', email.body)
+        self.assertEqual(send_queued_emails(EmailBackend()), (1, 0))
+        self.assertIn('NEW', mail.outbox[-1].body)
+
+    def test_failed(self):
+        self.assertEqual(send_queued_emails(FailingBackend()), (0, 1))
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, 'SMTP недоступен')
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(send_queued_emails(EmailBackend()), (0, 0))
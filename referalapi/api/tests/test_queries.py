@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api import benchmark
+from api.bloom import code_filter
+from api.cache import code_cache
+
+
+@override_settings(**benchmark.get_test_settings(
+    'locmem', PASSWORD_HASHERS=benchmark.FAST_HASHERS
+))
+class QueryBudgetTests(TransactionTestCase):
+    '''
+    Сценарии бенчмарка не делают больше запросов к БД, чем указано
+    в benchmark.QUERY_BUDGETS. TransactionTestCase, а не TestCase:
+    кеши обновляются после коммита (transaction.on_commit).
+    '''
+
+    def setUp(self):
+        # Кеши процесса переживают очистку БД между тестами.
+        cache.clear()
+        code_cache.local.clear()
+        code_filter.reset()
+        self.owners = benchmark.seed(2, 5)
+
+    def test_query_budgets(self):
+        scenarios = benchmark.get_scenarios(self.owners, repeat=1)
+        for name, scenario in scenarios.items():
+            if name not in benchmark.QUERY_BUDGETS:
+                continue
+            with self.subTest(name):
+                client = APIClient()
+                scenario(client, 0)
+                with CaptureQueriesContext(connection) as context:
+                    response = scenario(client, 1)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(
+                    len(context), benchmark.QUERY_BUDGETS[name],
+                    '\n'.join(query['sql'] for query in context)
+                )
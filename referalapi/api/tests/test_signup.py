@@ -0,0 +1,142 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api import benchmark
+from api.bloom import code_filter
+from api.cache import code_cache
+from users.models import Codes, Event, ReferCounter, Refers, User
+
+# Регистрация по коду: две проверки уникальности, BEGIN (на SQLite),
+# юзер, рефералка вместе с проверкой кода, счетчики (на PostgreSQL
+# одним запросом) и событие в журнале без Redis.
+REFERRAL_SIGNUP_QUERIES = {'sqlite': 8, 'postgresql': 6}
+
+
+@override_settings(**benchmark.get_test_settings(
+    'locmem', PASSWORD_HASHERS=benchmark.FAST_HASHERS
+))
+class ReferralSignupTests(TransactionTestCase):
+
+    def setUp(self):
+        # Кеши процесса переживают очистку БД между тестами.
+        cache.clear()
+        code_cache.local.clear()
+        code_filter.reset()
+        self.owner = benchmark.seed(1, 1)[0]
+        self.code = self.owner.code.get()
+        # Прогрев: код попадает в кеш, как после первой регистрации.
+        self.signup('warmup')
+
+    def signup(self, username):
+        return APIClient().post('/api/users/', {
+            'username': username,
+            'email': f'{username}@bench.local',
+            'password': benchmark.BENCHMARK_PASSWORD,
+            'referral_code': self.code.code,
+        })
+
+    def test_queries(self):
+        with self.assertNumQueries(
+                REFERRAL_SIGNUP_QUERIES.get(connection.vendor, 8)):
+            response = self.signup('invited')
+        self.assertEqual(response.status_code, 201, response.data)
+        refer = Refers.objects.get(referal__username='invited')
+        self.assertEqual(refer.referer_id, self.owner.pk)
+        self.assertEqual(ReferCounter.objects.get(user=self.owner).total, 3)
+        self.assertEqual(
+            Event.objects.filter(type='referral.created').count(), 2
+        )
+
+    def test_expired_code_rolls_back(self):
+        # Код истек в БД, а в кеше еще действителен.
+        Codes.objects.filter(pk=self.code.pk).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        response = self.signup('late')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username='late').exists())
+        self.assertEqual(ReferCounter.objects.get(user=self.owner).total, 2)
+        self.assertEqual(
+            Event.objects.filter(type='referral.created').count(), 1
+        )
+
+
+@override_settings(**benchmark.get_test_settings(
+    'locmem', PASSWORD_HASHERS=benchmark.FAST_HASHERS
+))
+class ConcurrentSignupTests(TransactionTestCase):
+    '''
+    Параллельные регистрации по одному коду, каждое имя регистрируют
+    два потока: одна попытка успешна, вторая получает 400, юзеров без
+    рефералок нет, счетчик рефералов сходится.
+    '''
+
+    def setUp(self):
+        cache.clear()
+        code_cache.local.clear()
+        code_filter.reset()
+        self.owner = benchmark.seed(1, 0)[0]
+        self.code = self.owner.code.get().code
+
+    def test_duplicates(self):
+        for url in ('/api/users/', '/api/async/users/'):
+            with self.subTest(url=url):
+                User.objects.filter(username__startswith='load').delete()
+                result = benchmark.load_signups(40, 8, self.code,
+                                                duplicates=True, url=url)
+                self.assertEqual(result['ok'], 40, result['error_kinds'])
+                self.assertEqual(result['error_kinds'], {'400': 40})
+                self.assertEqual(benchmark.check_signups(self.owner), [])
+
+
+@override_settings(**benchmark.get_test_settings('locmem'))
+class SignupBodyTests(TransactionTestCase):
+
+    def test_non_object_body(self):
+        for url in ('/api/users/', '/api/async/users/'):
+            for body in ('[]', '"x"', '1'):
+                with self.subTest(url=url, body=body):
+                    response = APIClient().post(
+                        url, body, content_type='application/json'
+                    )
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('non_field_errors', response.json())
+
+    @mock.patch('api.serializers.check_email', return_value=True)
+    @mock.patch('api.async_views.get_email_verifier')
+    def test_invalid_field_values(self, async_verifier, verifier):
+        # Некорректные значения отклоняются без обращения к Hunter.io
+        # и к кешу кодов.
+        async_verifier.return_value.ais_valid = mock.AsyncMock(
+            return_value=True
+        )
+        bodies = (
+            {'email': 123},
+            {'email': 'bad-email'},
+            {'email': ['a@bench.local']},
+            {'referral_code': ['x']},
+            {'referral_code': {'code': 'x'}},
+        )
+        for url in ('/api/users/', '/api/async/users/'):
+            for body in bodies:
+                with self.subTest(url=url, body=body):
+                    async_verifier.reset_mock()
+                    verifier.reset_mock()
+                    response = APIClient().post(url, {
+                        'username': 'user',
+                        'email': 'user@bench.local',
+                        'password': benchmark.BENCHMARK_PASSWORD,
+                        **body,
+                    }, format='json')
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(set(response.json()), set(body))
+                    if 'email' in body:
+                        async_verifier.return_value.ais_valid.\
+                            assert_not_called()
+                        verifier.assert_not_called()
@@ -0,0 +1,63 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api import benchmark
+from users.models import User
+
+CREATE_TABLES = (
+    'CREATE TABLE token_blacklist_outstandingtoken '
+    '(id integer PRIMARY KEY, jti varchar(255), expires_at datetime)',
+    'CREATE TABLE token_blacklist_blacklistedtoken '
+    '(id integer PRIMARY KEY, token_id integer)',
+)
+
+
+@override_settings(**benchmark.get_test_settings('locmem'))
+class ImportTokenBlacklistTests(TransactionTestCase):
+    '''Токены из черного списка в SQL не принимаются после переноса.'''
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='user', password='',
+                                   email='user@bench.local')
+        self.revoked = RefreshToken.for_user(user)
+        self.valid = RefreshToken.for_user(user)
+        expires_at = connection.ops.adapt_datetimefield_value(
+            timezone.now() + timedelta(days=1)
+        )
+        with connection.cursor() as cursor:
+            for sql in CREATE_TABLES:
+                cursor.execute(sql)
+            cursor.executemany(
+                'INSERT INTO token_blacklist_outstandingtoken '
+                'VALUES (%s, %s, %s)',
+                [(1, self.revoked['jti'], expires_at),
+                 (2, self.valid['jti'], expires_at)]
+            )
+            cursor.execute(
+                'INSERT INTO token_blacklist_blacklistedtoken VALUES (1, 1)'
+            )
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE token_blacklist_blacklistedtoken')
+            cursor.execute('DROP TABLE token_blacklist_outstandingtoken')
+
+    def refresh(self, token):
+        return APIClient().post('/api/auth/jwt/refresh/',
+                                {'refresh': str(token)})
+
+    def test_import(self):
+        output = StringIO()
+        call_command('import_token_blacklist', stdout=output)
+        self.assertIn('1', output.getvalue())
+        self.assertEqual(self.refresh(self.revoked).status_code, 401)
+        self.assertEqual(self.refresh(self.valid).status_code, 200)
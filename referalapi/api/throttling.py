@@ -0,0 +1,178 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from hashlib import md5
+from typing import Optional
+
+from django.core.exceptions import ImproperlyConfigured
+from redis.exceptions import RedisError
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .metrics import timed
+from .utils import get_redis
+
+SLIDING_WINDOW_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    return 0
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return tonumber(oldest[2]) + window - now
+'''
+
+
+class RedisSlidingWindow:
+    '''
+    Скользящее окно в Redis: метки запросов лежат в sorted set,
+    проверка и запись выполняются одним Lua-скриптом (EVALSHA),
+    то есть атомарно и за один запрос к Redis.
+    '''
+    def __init__(self):
+        self._script = None
+
+    def hit(self, client, key: str, limit: int, duration: int) -> float:
+        if self._script is None:
+            self._script = client.register_script(SLIDING_WINDOW_SCRIPT)
+        now = int(time.time() * 1000)
+        wait = self._script(
+            keys=[key],
+            args=[now, duration * 1000, limit,
+                  f'{now}:{secrets.token_hex(4)}'],
+            client=client
+        )
+        return int(wait) / 1000
+
+
+class LocalSlidingWindow:
+    '''
+    Скользящее окно в памяти процесса. Используется, если кеш
+    не в Redis или Redis недоступен; лимит тогда действует
+    на каждый процесс отдельно.
+    '''
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, duration: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = deque()
+                if len(self._windows) > self.max_keys:
+                    self._windows.popitem(last=False)
+            else:
+                self._windows.move_to_end(key)
+            while window and window[0] <= now - duration:
+                window.popleft()
+            if len(window) < limit:
+                window.append(now)
+                return 0.0
+            return window[0] + duration - now
+
+
+redis_window = RedisSlidingWindow()
+local_window = LocalSlidingWindow()
+
+
+def hit(key: str, limit: int, duration: int) -> float:
+    '''
+    Учитывает запрос в окне duration секунд. Возвращает 0, если
+    лимит не превышен, иначе сколько секунд ждать.
+    '''
+    client = get_redis()
+    if client is not None:
+        try:
+            with timed('throttle'):
+                return redis_window.hit(client, key, limit, duration)
+        except RedisError:
+            pass
+    return local_window.hit(key, limit, duration)
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    '''
+    Базовый троттлинг со скользящим окном вместо истории запросов
+    в кеше (которую SimpleRateThrottle читает и пишет целиком).
+    Лимиты берутся из DEFAULT_THROTTLE_RATES по scope,
+    None отключает ограничение.
+    '''
+    cache_format = 'throttle:v1:%(scope)s:%(ident)s'
+
+    def get_rate(self):
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured(
+                f'Не задан лимит для scope {self.scope!r}.'
+            )
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.wait_time = hit(self.key, self.num_requests, self.duration)
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
+
+    def format_key(self, ident) -> str:
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class SignupRateThrottle(SlidingWindowThrottle):
+    '''Регистрации с одного IP.'''
+    scope = 'signup'
+
+    def get_cache_key(self, request, view):
+        return self.format_key(self.get_ident(request))
+
+
+class ReferralCodeRateThrottle(SlidingWindowThrottle):
+    '''Регистрации по одному реферальному коду.'''
+    scope = 'signup_referral_code'
+
+    def get_cache_key(self, request, view):
+        # Тело, которое не объект JSON, отклонит сериализатор.
+        if not isinstance(request.data, Mapping):
+            return None
+        code = request.data.get('referral_code')
+        if not code:
+            return None
+        return self.format_key(md5(str(code).encode()).hexdigest())
+
+
+class SendEmailRateThrottle(SlidingWindowThrottle):
+    '''Запросы письма с кодом от одного юзера.'''
+    scope = 'send_email'
+
+    def get_cache_key(self, request, view):
+        return self.format_key(request.user.pk)
+
+
+SIGNUP_THROTTLES = (SignupRateThrottle, ReferralCodeRateThrottle)
+SEND_EMAIL_THROTTLES = (SendEmailRateThrottle,)
+
+
+def check_throttles(request, throttle_classes) -> Optional[float]:
+    '''
+    Проверка лимитов для вьюх вне DRF. Возвращает время ожидания
+    в секундах, если лимит превышен, иначе None.
+    '''
+    waits = []
+    for throttle_class in throttle_classes:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, None):
+            waits.append(throttle.wait())
+    return max(waits) if waits else None
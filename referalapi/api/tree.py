@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+
+from users.models import ReferClosure, Refers, User
+
+REFERS = Refers._meta.db_table
+CLOSURE = ReferClosure._meta.db_table
+
+DOWNLINE_SQL = f'''
+WITH RECURSIVE tree (user_id, depth) AS (
+    SELECT referal_id, 1 FROM {REFERS} WHERE referer_id = %s
+    UNION ALL
+    SELECT refers.referal_id, tree.depth + 1
+    FROM {REFERS} AS refers JOIN tree ON refers.referer_id = tree.user_id
+    WHERE tree.depth < %s
+)
+'''
+
+LEVEL_COUNTS_SQL = DOWNLINE_SQL + '''
+SELECT depth, COUNT(*) FROM tree GROUP BY depth ORDER BY depth
+'''
+
+LEVEL_IDS_SQL = DOWNLINE_SQL + '''
+SELECT user_id FROM tree WHERE depth = %s
+'''
+
+ADD_EDGE_SQL = f'''
+INSERT INTO {CLOSURE} (ancestor_id, descendant_id, depth)
+SELECT up.ancestor_id, down.descendant_id, up.depth + down.depth + 1
+FROM (
+    SELECT ancestor_id, depth FROM {CLOSURE} WHERE descendant_id = %s
+    UNION ALL SELECT %s, 0
+) AS up CROSS JOIN (
+    SELECT descendant_id, depth FROM {CLOSURE} WHERE ancestor_id = %s
+    UNION ALL SELECT %s, 0
+) AS down
+WHERE up.depth + down.depth < %s AND up.ancestor_id <> down.descendant_id
+ON CONFLICT DO NOTHING
+'''
+
+SUBTREE_SQL = f'''
+SELECT descendant_id FROM {CLOSURE} WHERE ancestor_id = %s
+UNION ALL SELECT %s
+'''
+
+REMOVE_EDGE_SQL = f'''
+DELETE FROM {CLOSURE}
+WHERE descendant_id IN ({SUBTREE_SQL})
+AND ancestor_id NOT IN ({SUBTREE_SQL})
+'''
+
+REBUILD_FIRST_SQL = f'''
+INSERT INTO {CLOSURE} (ancestor_id, descendant_id, depth)
+SELECT referer_id, referal_id, 1 FROM {REFERS}
+WHERE referer_id <> referal_id
+ON CONFLICT DO NOTHING
+'''
+
+REBUILD_NEXT_SQL = f'''
+INSERT INTO {CLOSURE} (ancestor_id, descendant_id, depth)
+SELECT closure.ancestor_id, refers.referal_id, %s
+FROM {CLOSURE} AS closure
+JOIN {REFERS} AS refers ON refers.referer_id = closure.descendant_id
+WHERE closure.depth = %s AND closure.ancestor_id <> refers.referal_id
+ON CONFLICT DO NOTHING
+'''
+
+
+def get_max_depth() -> int:
+    return settings.REFER_TREE['MAX_DEPTH']
+
+
+def use_closure(closure=None) -> bool:
+    if closure is None:
+        return settings.REFER_TREE['CLOSURE']
+    return closure
+
+
+def level_counts(user_id: int, depth: int, closure=None) -> list:
+    '''
+    Число рефералов юзера на каждом уровне дерева до depth
+    включительно: рекурсивный CTE по Refers или одна выборка
+    по индексу таблицы замыкания.
+    '''
+    if use_closure(closure):
+        return list(
+            ReferClosure.objects.filter(ancestor_id=user_id,
+                                        depth__lte=depth)
+            .values('depth').annotate(count=Count('descendant_id'))
+            .order_by('depth').values_list('depth', 'count')
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(LEVEL_COUNTS_SQL, [user_id, depth])
+        return cursor.fetchall()
+
+
+def downline(user_id: int, level: int, closure=None):
+    '''
+    Рефералы юзера уровня level (1 - прямые рефералы) с id
+    их реферера в поле parent_id. Сортировать и листать нужно
+    по полю node: в таблице замыкания это id потомка, и страница
+    читается по индексу refer_closure_level_idx без сортировки.
+    '''
+    if use_closure(closure):
+        queryset = User.objects.filter(
+            ancestors__ancestor_id=user_id, ancestors__depth=level
+        ).annotate(node=F('ancestors__descendant_id'))
+    else:
+        queryset = User.objects.filter(
+            id__in=RawSQL(LEVEL_IDS_SQL, [user_id, level, level])
+        ).annotate(node=F('id'))
+    parents = Refers.objects.filter(referal_id=OuterRef('pk'))
+    return queryset.only('id', 'username', 'date_joined').annotate(
+        parent_id=Subquery(parents.values('referer_id')[:1])
+    )
+
+
+def add_edge(referer_id: int, referal_id: int):
+    '''
+    Добавляет в замыкание пути через новую рефералку: каждый предок
+    реферера (и он сам) получает каждого потомка реферала
+    (и его самого), если расстояние не больше MAX_DEPTH.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_EDGE_SQL, [referer_id, referer_id, referal_id,
+                                      referal_id, get_max_depth()])
+
+
+def remove_edge(referer_id: int, referal_id: int):
+    '''
+    Убирает из замыкания пути через удаленную рефералку: связи
+    поддерева реферала с внешними предками удаляются, затем
+    восстанавливаются по оставшимся рефералкам, ведущим в поддерево.
+    '''
+    with transaction.atomic(savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute(REMOVE_EDGE_SQL, [referal_id] * 4)
+        subtree = RawSQL(SUBTREE_SQL, [referal_id, referal_id])
+        entries = (Refers.objects.filter(referal_id__in=subtree)
+                   .exclude(referer_id__in=subtree)
+                   .values_list('referer_id', 'referal_id'))
+        for entry in entries:
+            add_edge(*entry)
+
+
+def rebuild_closure(max_depth=None) -> int:
+    '''
+    Пересобирает замыкание по таблице Refers обходом в ширину:
+    один INSERT ... SELECT на уровень. Возвращает число связей.
+    '''
+    max_depth = max_depth or get_max_depth()
+    with transaction.atomic():
+        ReferClosure.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(REBUILD_FIRST_SQL)
+            total = cursor.rowcount
+            for depth in range(2, max_depth + 1):
+                cursor.execute(REBUILD_NEXT_SQL, [depth, depth - 1])
+                if not cursor.rowcount:
+                    break
+                total += cursor.rowcount
+    return total
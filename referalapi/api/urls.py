@@ -1,13 +1,17 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter as Router
 
-from .views import (CodesViewSet, CustomUserViewSet, ReferalViewSet,
-                    RefererViewSet, SendEmail)
+from . import async_views
+from .views import (CodesViewSet, CustomUserViewSet, EventViewSet,
+                    LeaderboardViewSet, ReferalViewSet, RefererViewSet,
+                    SendEmail)
 
 router_v1 = Router()
 router_v1.register('users', CustomUserViewSet, basename='user')
 router_v1.register('code', CodesViewSet, basename='code')
 router_v1.register('referals', ReferalViewSet, basename='referal')
+router_v1.register('leaderboard', LeaderboardViewSet, basename='leaderboard')
+router_v1.register('events', EventViewSet, basename='event')
 router_v1.register(
     r'referer/(?P<user_id>\d+)', RefererViewSet, basename='referer'
 )
@@ -16,4 +20,10 @@ urlpatterns = [
     path('', include(router_v1.urls)),
     path('auth/', include('djoser.urls.jwt')),
     path('send-code-email/', SendEmail.as_view()),
+    path('async/users/', async_views.signup),
+    path('async/code/', async_views.code_list),
+    path('async/code/<int:pk>/', async_views.code_detail),
+    path('async/send-code-email/', async_views.send_code_email),
+    path('async/events/', async_views.events),
+    path('async/events/stream/', async_views.event_stream),
 ]
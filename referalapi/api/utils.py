@@ -1,29 +1,27 @@
 import datetime as dt
+from itertools import islice
 
-import requests
+from django.conf import settings
+from django.db import connections
 from django.utils import timezone
+from django_redis import get_redis_connection
 
-from users.constans import HUNTER_API_KEY
-
-from .exceptions import APIError
+from .verification import get_email_verifier
 
 
 def check_email(email) -> bool:
     '''
-    Проверяет действительность почты через сервис hunter.io.
+    Проверяет действительность почты через настроенный бэкенд
+    (по умолчанию сервис hunter.io) с кешированием результата.
     '''
-    endpoint = f'https://api.hunter.io/v2/email-verifier?email={email}&api_key={HUNTER_API_KEY}'
+    return get_email_verifier().is_valid(email)
 
-    response = requests.get(endpoint)
 
-    if response.status_code == 200:
-        result = response.json()
-        if (result.get('data', {}).get('status') == 'valid'
-                or result.get('data', {}).get('status') == 'accept_all'):
-            return True
-        return False
-    raise APIError(f'Ошибка при запросе к API Hunter.io,'
-                   f'статус код ответа: {response.status_code}.')
+def check_emails(emails) -> dict:
+    '''
+    Проверяет несколько адресов за один запрос к кешу.
+    '''
+    return get_email_verifier().check_many(emails)
 
 
 def get_timeout(expires_at: dt.date) -> dt.timedelta:
@@ -33,3 +31,41 @@ def get_timeout(expires_at: dt.date) -> dt.timedelta:
     if timezone.now() < expires_at:
         return expires_at - timezone.now()
     return dt.timedelta(seconds=0)
+
+
+def batched(iterable, size: int):
+    '''
+    Разбивает итерируемый объект на списки длиной не больше size.
+    '''
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def get_redis():
+    '''
+    Клиент Redis, на котором работает кеш по умолчанию,
+    или None, если кеш не в Redis (например, locmem в разработке).
+    '''
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+def close_unusable_connections(**kwargs):
+    '''
+    Проверка постоянных соединений с БД перед запросом, как
+    CONN_HEALTH_CHECKS в Django 4.1+: соединение, которое сервер
+    или пулер закрыл, пока оно простаивало, закрывается, и запрос
+    открывает новое вместо ошибки на первом обращении к БД.
+    Подключается к request_started (см. ApiConfig.ready).
+    '''
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if (connection.connection is not None
+                and connection.settings_dict['CONN_MAX_AGE'] != 0
+                and not connection.in_atomic_block
+                and not connection.is_usable()):
+            connection.close()
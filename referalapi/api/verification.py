@@ -0,0 +1,258 @@
+import asyncio
+import threading
+import weakref
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+from users.constans import HUNTER_API_KEY
+
+from .exceptions import APIError
+from .metrics import timed
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+VALID_STATUSES = frozenset(('valid', 'accept_all'))
+ACCEPT_ALL = 'accept_all'
+
+
+class BaseEmailVerifier:
+    '''
+    Базовый бэкенд проверки почты.
+    Метод verify возвращает статус почты в терминах Hunter.io:
+    valid, invalid, accept_all, webmail, disposable, unknown.
+    '''
+    def verify(self, email: str) -> str:
+        raise NotImplementedError
+
+    async def averify(self, email: str) -> str:
+        return await sync_to_async(self.verify, thread_sensitive=False)(email)
+
+
+class HunterEmailVerifier(BaseEmailVerifier):
+    '''
+    Проверка почты через сервис hunter.io.
+    Использует одну сессию с пулом соединений и таймаутами на запрос,
+    чтобы медленный ответ сервиса не блокировал воркер.
+    Асинхронная проверка идет через httpx, если он установлен.
+    '''
+    endpoint = 'https://api.hunter.io/v2/email-verifier'
+
+    def __init__(self, api_key=None, timeout=(3.05, 5), pool_size=10):
+        self.api_key = api_key or HUNTER_API_KEY
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def verify(self, email):
+        try:
+            response = self.session.get(
+                self.endpoint,
+                params={'email': email, 'api_key': self.api_key},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise APIError(f'Ошибка при запросе к API Hunter.io: {e}.')
+        return self.get_status(response)
+
+    async def averify(self, email):
+        if httpx is None:
+            return await super().averify(email)
+        try:
+            response = await self.get_async_client().get(
+                self.endpoint,
+                params={'email': email, 'api_key': self.api_key}
+            )
+        except httpx.HTTPError as e:
+            raise APIError(f'Ошибка при запросе к API Hunter.io: {e}.')
+        return self.get_status(response)
+
+    def get_async_client(self):
+        '''Клиент httpx с пулом соединений, свой для каждого event loop.'''
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            connect, read = (self.timeout if isinstance(self.timeout, tuple)
+                             else (self.timeout, self.timeout))
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read, connect=connect),
+                limits=httpx.Limits(max_connections=self.pool_size)
+            )
+            self._async_clients[loop] = client
+        return client
+
+    @staticmethod
+    def get_status(response) -> str:
+        if response.status_code != 200:
+            raise APIError(f'Ошибка при запросе к API Hunter.io,'
+                           f'статус код ответа: {response.status_code}.')
+        return response.json().get('data', {}).get('status')
+
+
+class StubEmailVerifier(BaseEmailVerifier):
+    '''
+    Локальный бэкенд без сетевых запросов для тестов и разработки.
+    Почта считается действительной, если ее домен не указан
+    в invalid_domains.
+    '''
+    def __init__(self, invalid_domains=(), accept_all_domains=()):
+        self.invalid_domains = frozenset(invalid_domains)
+        self.accept_all_domains = frozenset(accept_all_domains)
+
+    def verify(self, email):
+        domain = get_domain(email)
+        if domain in self.invalid_domains:
+            return 'invalid'
+        if domain in self.accept_all_domains:
+            return ACCEPT_ALL
+        return 'valid'
+
+
+class EmailVerificationService:
+    '''
+    Кеширующая обертка над бэкендом проверки почты.
+    Результаты хранятся по ключу почты (положительные и отрицательные
+    с разным сроком жизни), а домены со статусом accept_all
+    кешируются целиком: любая почта на таком домене проходит проверку
+    без запроса к бэкенду.
+    '''
+    email_key = 'email_check:v1:{}'
+    domain_key = 'email_domain:v1:{}'
+
+    def __init__(self, backend, timeout, negative_timeout):
+        self.backend = backend
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+
+    def is_valid(self, email: str) -> bool:
+        return self.check_many([email])[email]
+
+    async def ais_valid(self, email: str) -> bool:
+        return (await self.acheck_many([email]))[email]
+
+    def check_many(self, emails) -> dict:
+        '''
+        Проверяет несколько адресов, читая кеш одним запросом.
+        Возвращает словарь {email: bool}.
+        '''
+        result, pending = self.read_cache(emails)
+        statuses, accept_all = {}, set()
+        for email, (_, domain_key) in pending.items():
+            if domain_key in accept_all:
+                statuses[email] = ACCEPT_ALL
+                continue
+            with timed('email'):
+                statuses[email] = self.backend.verify(email)
+            if statuses[email] == ACCEPT_ALL:
+                accept_all.add(domain_key)
+        result.update(self.write_cache(pending, statuses))
+        return result
+
+    async def acheck_many(self, emails) -> dict:
+        '''
+        Асинхронный вариант check_many: адреса, которых нет в кеше,
+        проверяются бэкендом параллельно.
+        '''
+        result, pending = await sync_to_async(
+            self.read_cache, thread_sensitive=False)(emails)
+        with timed('email'):
+            statuses = dict(zip(pending, await asyncio.gather(
+                *(self.backend.averify(email) for email in pending)
+            )))
+        result.update(await sync_to_async(
+            self.write_cache, thread_sensitive=False)(pending, statuses))
+        return result
+
+    def read_cache(self, emails) -> tuple:
+        '''
+        Возвращает результаты из кеша и ключи адресов,
+        которых в кеше нет.
+        '''
+        keys = {}
+        for email in emails:
+            normalized = email.strip().lower()
+            keys[email] = (self.email_key.format(normalized),
+                           self.domain_key.format(get_domain(normalized)))
+        cached = cache.get_many(
+            [key for pair in keys.values() for key in pair]
+        )
+
+        result, pending = {}, {}
+        for email, (email_key, domain_key) in keys.items():
+            status = cached.get(email_key)
+            if cached.get(domain_key) == ACCEPT_ALL:
+                result[email] = True
+            elif status is not None:
+                result[email] = status in VALID_STATUSES
+            else:
+                pending[email] = (email_key, domain_key)
+        return result, pending
+
+    def write_cache(self, pending: dict, statuses: dict) -> dict:
+        '''Сохраняет статусы проверенных адресов в кеш.'''
+        result = {}
+        positive, negative = {}, {}
+        for email, (email_key, domain_key) in pending.items():
+            status = statuses[email]
+            if status in VALID_STATUSES:
+                positive[email_key] = status
+            else:
+                negative[email_key] = status or 'unknown'
+            if status == ACCEPT_ALL:
+                positive[domain_key] = status
+            result[email] = status in VALID_STATUSES
+
+        if positive:
+            cache.set_many(positive, timeout=self.timeout)
+        if negative:
+            cache.set_many(negative, timeout=self.negative_timeout)
+        return result
+
+
+def get_domain(email: str) -> str:
+    return email.rpartition('@')[2].lower()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_email_verifier() -> EmailVerificationService:
+    '''
+    Возвращает общий для процесса сервис проверки почты,
+    созданный по настройке EMAIL_VERIFICATION.
+    '''
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                config = settings.EMAIL_VERIFICATION
+                backend = import_string(config['BACKEND'])(
+                    **config.get('OPTIONS', {})
+                )
+                _service = EmailVerificationService(
+                    backend,
+                    timeout=config['CACHE_TIMEOUT'],
+                    negative_timeout=config['NEGATIVE_CACHE_TIMEOUT']
+                )
+    return _service
+
+
+@receiver(setting_changed)
+def reset_email_verifier(*, setting, **kwargs):
+    global _service
+    if setting == 'EMAIL_VERIFICATION':
+        _service = None
@@ -1,27 +1,54 @@
-from django.core.cache import cache
-from django.core.mail import send_mail
+from hashlib import md5
+
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import mixins, status, viewsets
-from rest_framework.permissions import AllowAny
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from referalapi.settings import EMAIL_HOST_USER
+from users.constans import MAX_STATS_DAYS
 from users.models import Codes, Refers, User
 
+from .async_utils import streaming_response
+from .bulk import stream_rows
+from .cache import code_cache, code_response_cache, referals_version
+from .counters import get_refer_stats
+from .events import get_event_log, get_read_params
+from .leaderboard import ALL_TIME, leaderboard
+from .mail import queue_code_email
+from .pagination import ReferalCursorPagination, ReferTreeCursorPagination
 from .permissions import IsAuthor
-from .serializers import (CodeSerializer, ReferalSerializer,
+from .serializers import (CodeSerializer, EventBatchSerializer,
+                          LeaderboardRankSerializer, LeaderboardSerializer,
+                          ReferalSerializer, ReferStatsSerializer,
+                          ReferTreeMemberSerializer, ReferTreeSerializer,
                           UserCreationSerializer)
+from .throttling import SEND_EMAIL_THROTTLES, SIGNUP_THROTTLES
+from .tree import downline, get_max_depth, level_counts
+
+EXPORT_FIELDS = ('id', 'username', 'date_joined', 'created_at')
+EXPORT_FORMATS = {
+    'ndjson': ('jsonl', 'application/x-ndjson'),
+    'csv': ('csv', 'text/csv; charset=utf-8'),
+}
 
 
 class CustomUserViewSet(viewsets.ModelViewSet):
     '''
     ViewSet для регистрации новых пользователей.
+    Число регистраций ограничено по IP и по реферальному коду,
+    чтобы не расходовать лимиты Hunter.io и не нагружать БД.
     '''
     queryset = User.objects.all()
     serializer_class = UserCreationSerializer
     http_method_names = ['post',]
     permission_classes = (AllowAny,)
+    throttle_classes = SIGNUP_THROTTLES
 
     def perform_create(self, serializer, *args, **kwargs):
         serializer.save(*args, **kwargs)
@@ -32,6 +59,8 @@ class CodesViewSet(viewsets.ModelViewSet):
     ViewSet для создания, удаления, чтения и редактирования
     реферального кода. Все CRUD действия может выполнять только
     создатель кода. На чтение выдается только собственный код юзера.
+    Ответы на чтение в JSON берутся из CodeResponseCache
+    и поддерживают условные запросы по ETag.
     '''
     serializer_class = CodeSerializer
     http_method_names = ['get', 'post', 'delete', 'patch']
@@ -41,92 +70,338 @@ class CodesViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
     def get_queryset(self):
-        return Codes.objects.filter(user=self.request.user)
+        return Codes.objects.filter(
+            user=self.request.user
+        ).select_related('user')
+
+    def get_cached_code(self, request):
+        '''
+        Код юзера из кеша ответов, при промахе код читается из БД
+        и рендерится в кеш. None, если кода нет.
+        '''
+        cached = code_response_cache.get(request.user.id)
+        if cached is None:
+            code = self.get_queryset().first()
+            if code is None:
+                return None
+            cached = code_response_cache.set(
+                code,
+                request.accepted_renderer.render(
+                    self.get_serializer(code).data
+                )
+            )
+        return cached
+
+    def cached_response(self, request, etag, body):
+        etag = quote_etag(etag)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': etag})
+        response = HttpResponse(
+            body, content_type=request.accepted_renderer.media_type
+        )
+        response['ETag'] = etag
+        return response
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+        if request.accepted_renderer.format == 'json':
+            cached = self.get_cached_code(request)
+            if cached is not None:
+                return self.cached_response(
+                    request, f'{cached.etag}-list',
+                    b'[' + cached.body + b']'
+                )
+        elif self.get_queryset().exists():
+            return super().list(request, *args, **kwargs)
 
-        if not queryset.exists():
-            return Response(
-                {'detail': 'Упс, у вас еще нет своего кода.'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        return Response(
+            {'detail': 'Упс, у вас еще нет своего кода.'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if request.accepted_renderer.format == 'json':
+            cached = self.get_cached_code(request)
+            if (cached is not None
+                    and str(cached.id) == kwargs[self.lookup_field]):
+                return self.cached_response(request, cached.etag,
+                                            cached.body)
+        return super().retrieve(request, *args, **kwargs)
 
-        return super().list(request, *args, **kwargs)
 
-    def destroy(self, request, *args, **kwargs):
-        instance = self.get_object()
+class ConditionalListMixin:
+    '''
+    Отдает 304 Not Modified на повторный запрос списка рефералов,
+    если он не менялся. ETag строится из версии списка реферера
+    и параметров запроса.
+    '''
 
-        cache.delete(f'{instance.code}')
-        cache.delete(f'user_{instance.user.id}')
+    def get_referer_id(self):
+        raise NotImplementedError
 
-        self.perform_destroy(instance)
+    def get_etag(self, request):
+        referer_id = self.get_referer_id()
+        version = referals_version.get(referer_id)
+        params = md5(
+            f'{request.get_full_path()}:{request.accepted_renderer.format}'
+            .encode()
+        ).hexdigest()
+        return quote_etag(f'{referer_id}-{version}-{params}')
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+    def list(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': etag})
+        response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
 
 
-class ReferalViewSet(mixins.ListModelMixin,
+class ReferalViewSet(ConditionalListMixin,
+                     mixins.ListModelMixin,
                      viewsets.GenericViewSet):
     '''
     ViewSet для просмотра списка своих рефералов.
     '''
     model = Refers
     serializer_class = ReferalSerializer
+    pagination_class = ReferalCursorPagination
+
+    def get_referer_id(self):
+        return self.request.user.id
 
     def get_queryset(self):
-        return Refers.objects.filter(referer=self.request.user)
+        return Refers.objects.for_referer(self.get_referer_id())
 
 
-class RefererViewSet(mixins.ListModelMixin,
+class RefererViewSet(ConditionalListMixin,
+                     mixins.ListModelMixin,
                      viewsets.GenericViewSet):
     '''
     ViewSet для просмотра списка рефералов по id реферера.
     '''
     model = Refers
     serializer_class = ReferalSerializer
+    pagination_class = ReferalCursorPagination
     queryset = Refers.objects.all()
 
     def get_referer(self):
-        return get_object_or_404(User, pk=self.kwargs.get('user_id'))
+        return get_object_or_404(User.objects.only('id'),
+                                 pk=self.kwargs.get('user_id'))
+
+    def get_referer_id(self):
+        return self.get_referer().id
 
     def get_queryset(self):
-        referer = self.get_referer()
-        return Refers.objects.filter(referer=referer)
+        return Refers.objects.for_referer(self.kwargs.get('user_id'))
+
+    @action(detail=False, serializer_class=ReferStatsSerializer,
+            pagination_class=None)
+    def stats(self, request, *args, **kwargs):
+        '''
+        Число рефералов юзера всего и по дням за последние days дней
+        (по умолчанию 30). Считается по счетчикам, без обхода Refers.
+        '''
+        try:
+            days = min(max(int(request.query_params.get('days', 30)), 1),
+                       MAX_STATS_DAYS)
+        except ValueError:
+            days = 30
+        referer_id = self.get_referer_id()
+        serializer = self.get_serializer(get_refer_stats(referer_id, days))
+        return Response(serializer.data)
+
+    @action(detail=False, pagination_class=None)
+    def export(self, request, *args, **kwargs):
+        '''
+        Все рефералы юзера потоком в NDJSON (по умолчанию) или CSV
+        (параметр output=csv). Строки читаются из БД частями
+        по REFERAL_EXPORT['CHUNK_SIZE'], поэтому память и время
+        до первого байта не зависят от длины списка.
+        '''
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError(
+                {'output': 'Допустимые значения: '
+                           f'{", ".join(EXPORT_FORMATS)}.'}
+            )
+        fmt, content_type = EXPORT_FORMATS[output]
+        config = settings.REFERAL_EXPORT
+        referer_id = self.get_referer_id()
+        rows = (
+            Refers.objects.filter(referer_id=referer_id)
+            .order_by('-created_at', '-id')
+            .values_list('referal_id', 'referal__username',
+                         'referal__date_joined', 'created_at')
+            .iterator(chunk_size=config['CHUNK_SIZE'])
+        )
+        response = streaming_response(
+            request,
+            stream_rows(fmt, EXPORT_FIELDS, rows, config['BATCH_SIZE']),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="referals-{referer_id}.{output}"'
+        )
+        return response
+
+    @action(detail=False, serializer_class=ReferTreeSerializer,
+            pagination_class=None)
+    def tree(self, request, *args, **kwargs):
+        '''
+        Число рефералов юзера по уровням дерева до depth уровней
+        (по умолчанию и максимум - REFER_TREE['MAX_DEPTH']):
+        рефералы, их рефералы и так далее.
+        '''
+        max_depth = get_max_depth()
+        try:
+            depth = min(max(int(request.query_params.get('depth',
+                                                         max_depth)), 1),
+                        max_depth)
+        except ValueError:
+            depth = max_depth
+        referer_id = self.get_referer_id()
+        levels = [{'level': level, 'count': count}
+                  for level, count in level_counts(referer_id, depth)]
+        serializer = self.get_serializer(
+            {'referer': referer_id, 'depth': depth, 'levels': levels}
+        )
+        return Response(serializer.data)
+
+    @action(detail=False, url_path=r'tree/(?P<level>\d+)',
+            serializer_class=ReferTreeMemberSerializer,
+            pagination_class=ReferTreeCursorPagination)
+    def tree_level(self, request, level, *args, **kwargs):
+        '''
+        Рефералы юзера одного уровня дерева (1 - прямые рефералы)
+        с курсорной пагинацией.
+        '''
+        level = int(level)
+        max_depth = get_max_depth()
+        if not 1 <= level <= max_depth:
+            raise ValidationError(
+                {'level': f'Уровень должен быть от 1 до {max_depth}.'}
+            )
+        queryset = downline(self.get_referer_id(), level)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class LeaderboardViewSet(viewsets.GenericViewSet):
+    '''
+    ViewSet для рейтинга рефереров по числу рефералов за все время
+    или за окно (параметр window: all, day, week, month).
+    '''
+    serializer_class = LeaderboardSerializer
+    pagination_class = None
+
+    def get_window(self):
+        window = self.request.query_params.get('window', ALL_TIME)
+        if window not in leaderboard.windows:
+            raise ValidationError(
+                {'window': 'Допустимые значения: '
+                           f'{", ".join(leaderboard.windows)}.'}
+            )
+        return window
+
+    def list(self, request, *args, **kwargs):
+        '''
+        Первые limit рефереров (по умолчанию 10, максимум
+        LEADERBOARD['SIZE']).
+        '''
+        window = self.get_window()
+        size = leaderboard.config['SIZE']
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1),
+                        size)
+        except ValueError:
+            limit = 10
+        top = leaderboard.top(window, limit)
+        names = dict(User.objects.filter(
+            id__in=[user_id for user_id, _ in top]
+        ).values_list('id', 'username'))
+        results = [
+            {'rank': rank, 'user': user_id, 'username': names[user_id],
+             'count': count}
+            for rank, (user_id, count) in enumerate(top, 1)
+            if user_id in names
+        ]
+        serializer = self.get_serializer(
+            {'window': window, 'results': results}
+        )
+        return Response(serializer.data)
+
+    @action(detail=False, serializer_class=LeaderboardRankSerializer)
+    def me(self, request, *args, **kwargs):
+        '''Место текущего юзера в рейтинге.'''
+        window = self.get_window()
+        rank, count = leaderboard.rank(window, request.user.id)
+        serializer = self.get_serializer(
+            {'window': window, 'rank': rank, 'count': count}
+        )
+        return Response(serializer.data)
+
+
+class EventViewSet(viewsets.GenericViewSet):
+    '''
+    ViewSet для чтения журнала событий (api.events) другими
+    сервисами вместо повторного чтения списков рефералов. Доступен
+    только персоналу. Ожидание новых событий занимало бы
+    синхронный воркер, поэтому здесь оно ограничено
+    EVENT_LOG['SYNC_MAX_WAIT'] (по умолчанию 0 - без ожидания);
+    длинный опрос и поток Server-Sent Events - в асинхронных
+    вьюхах /api/async/events/.
+    '''
+    serializer_class = EventBatchSerializer
+    permission_classes = (IsAdminUser,)
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        '''
+        До limit событий (по умолчанию 100) после after
+        (Last-Event-ID или after, по умолчанию $ - только новые).
+        '''
+        log = get_event_log()
+        try:
+            after, limit, timeout = get_read_params(
+                log, request.query_params, request.headers
+            )
+        except ValueError:
+            raise ValidationError({'after': 'Некорректный id события.'})
+        events = log.read(
+            after, limit,
+            block=min(timeout, settings.EVENT_LOG['SYNC_MAX_WAIT'])
+        )
+        serializer = self.get_serializer(
+            {'last_id': events[-1].id if events else after,
+             'events': events}
+        )
+        return Response(serializer.data)
 
 
 class SendEmail(APIView):
     '''
     View для отправки email с реферальным кодом юзера
-    на его почту по запросу.
+    на его почту по запросу. Письмо ставится в очередь и
+    отправляется командой send_emails.
     '''
+    throttle_classes = SEND_EMAIL_THROTTLES
 
     def get(self, request):
         user = request.user
-        email = user.email
-
-        ref_code = cache.get(f'user_{user.id}')
-
-        if not ref_code:
-            try:
-                ref_code = Codes.objects.get(user=user)
-                cache.set(f'user_{user.id}',
-                          ref_code.code)
-                ref_code = ref_code.code
-            except Codes.DoesNotExist:
-                return Response(
-                    {'detail': 'У вас нет своего реферального кода!'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
 
-        send_mail(
-            subject='Your referral code',
-            message=f'Ваш реферальный код: {ref_code}',
-            from_email=EMAIL_HOST_USER,
-            recipient_list=[email],
-            fail_silently=False,
-        )
+        ref_code = code_cache.fetch_for_user(user.id)
+        if ref_code is None:
+            return Response(
+                {'detail': 'У вас нет своего реферального кода!'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        queue_code_email(user, ref_code)
 
         return Response(
-            {'detail': 'Реферальный код отправлен на вашу почту.'},
-            status=status.HTTP_200_OK
+            {'detail': 'Реферальный код будет отправлен на вашу почту.'},
+            status=status.HTTP_202_ACCEPTED
         )
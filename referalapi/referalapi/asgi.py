@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'referalapi.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Как get_asgi_application, но с обработчиком, который отдает
+# асинхронные потоки (поток событий /api/async/events/stream/).
+from api.async_utils import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
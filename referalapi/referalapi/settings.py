@@ -25,12 +25,18 @@ INSTALLED_APPS = [
     'drf_spectacular',
     'rest_framework',
     'djoser',
-    'rest_framework_simplejwt.token_blacklist',
     'api',
     'users'
 ]
 
+PERFORMANCE_METRICS = {
+    'ENABLED': os.getenv('PERFORMANCE_METRICS', 'False') == 'True',
+    'SERVER_TIMING': os.getenv('SERVER_TIMING', 'True') == 'True',
+    'TOKEN': os.getenv('METRICS_TOKEN', ''),
+}
+
 MIDDLEWARE = [
+    'api.middleware.PerformanceMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,12 +67,41 @@ TEMPLATES = [
 WSGI_APPLICATION = 'referalapi.wsgi.application'
 
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite3')
+
+DB_POOLER = os.getenv('DB_POOLER', 'False') == 'True'
+
+# Проверять постоянные соединения перед запросом
+# (api.utils.close_unusable_connections).
+DB_HEALTH_CHECKS = os.getenv('DB_HEALTH_CHECKS', 'True') == 'True'
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'referalapi'),
+            'USER': os.getenv('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            'DISABLE_SERVER_SIDE_CURSORS': DB_POOLER,
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # Тестовая БД в файле, а не в памяти: в общей памяти
+            # параллельные записи падают с "table is locked", а не
+            # ждут блокировку, как в рабочей БД.
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
     }
-}
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -85,6 +120,37 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+PASSWORD_HASHING = {
+    'PROFILE': os.getenv('PASSWORD_HASHER', 'pbkdf2'),
+    'ARGON2': {
+        'TIME_COST': int(os.getenv('ARGON2_TIME_COST', 2)),
+        'MEMORY_COST': int(os.getenv('ARGON2_MEMORY_COST', 19456)),
+        'PARALLELISM': int(os.getenv('ARGON2_PARALLELISM', 1)),
+    },
+    'THREADS': int(os.getenv('PASSWORD_HASHING_THREADS',
+                             os.cpu_count() or 1)),
+}
+
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'api.passwords.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+if PASSWORD_HASHING['PROFILE'] == 'argon2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
+if PERFORMANCE_METRICS['ENABLED']:
+    TIMED_PASSWORD_HASHERS = {
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher':
+            'api.metrics.TimedPBKDF2PasswordHasher',
+        'api.passwords.TunedArgon2PasswordHasher':
+            'api.metrics.TimedArgon2PasswordHasher',
+    }
+    PASSWORD_HASHERS = [TIMED_PASSWORD_HASHERS.get(name, name)
+                        for name in PASSWORD_HASHERS]
+
+
 AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
@@ -92,9 +158,24 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_THROTTLE_RATES': {
+        'signup': os.getenv('THROTTLE_SIGNUP', '20/hour'),
+        'signup_referral_code': os.getenv('THROTTLE_SIGNUP_REFERRAL_CODE',
+                                          '100/hour'),
+        'send_email': os.getenv('THROTTLE_SEND_EMAIL', '5/hour'),
+    },
 }
 
 DJOSER = {
@@ -108,9 +189,15 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=5),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'AUTH_HEADER_TYPES': ('Bearer',)
+    'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_REFRESH_SERIALIZER':
+        'api.authentication.BlacklistTokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER':
+        'api.authentication.BlacklistTokenVerifySerializer',
 }
 
+USER_CACHE_TIMEOUT = 60
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Referral API',
     'DESCRIPTION': 'Referral sistem',
@@ -120,7 +207,9 @@ SPECTACULAR_SETTINGS = {
 
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": ("api.metrics.TimedRedisCache"
+                    if PERFORMANCE_METRICS['ENABLED']
+                    else "django_redis.cache.RedisCache"),
         "LOCATION": "redis://127.0.0.1:6379/1",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
@@ -149,3 +238,69 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
+
+EMAIL_VERIFICATION_BACKEND = os.getenv(
+    'EMAIL_VERIFICATION_BACKEND', 'api.verification.HunterEmailVerifier'
+)
+
+EMAIL_VERIFICATION = {
+    'BACKEND': EMAIL_VERIFICATION_BACKEND,
+    # Аргументы конструктора, у каждого бэкенда свои.
+    'OPTIONS': {
+        'api.verification.HunterEmailVerifier': {
+            'timeout': (3.05, 5),
+            'pool_size': 10,
+        },
+    }.get(EMAIL_VERIFICATION_BACKEND, {}),
+    'CACHE_TIMEOUT': timedelta(days=7).total_seconds(),
+    'NEGATIVE_CACHE_TIMEOUT': timedelta(hours=1).total_seconds(),
+}
+
+CODE_CACHE_TIMEOUT = timedelta(days=1).total_seconds()
+
+CODE_NEGATIVE_CACHE_TIMEOUT = timedelta(minutes=5).total_seconds()
+
+CODE_GENERATOR = {
+    'KEY': os.getenv('CODE_GENERATOR_KEY', SECRET_KEY),
+    'BLOCK_SIZE': 100,
+    'POOL_SIZE': int(os.getenv('CODE_POOL_SIZE', 0)),
+}
+
+CODE_FILTER = {
+    'CAPACITY': int(os.getenv('CODE_FILTER_CAPACITY', 1000000)),
+    'ERROR_RATE': 0.01,
+}
+
+CODE_LOCAL_CACHE = {
+    'MAX_SIZE': 10000,
+    'TIMEOUT': 30,
+    'STAMP_INTERVAL': 1,
+}
+
+REFER_TREE = {
+    'CLOSURE': os.getenv('REFER_TREE_CLOSURE', 'False') == 'True',
+    'MAX_DEPTH': int(os.getenv('REFER_TREE_MAX_DEPTH', 10)),
+}
+
+LEADERBOARD = {
+    'WINDOWS': {'day': 1, 'week': 7, 'month': 30},
+    'SIZE': 100,
+    'WINDOW_CACHE_TIMEOUT': 60,
+}
+
+EVENT_LOG = {
+    'MAXLEN': int(os.getenv('EVENT_LOG_MAXLEN', 1000000)),
+    'PAGE_SIZE': 1000,
+    'MAX_WAIT': 25,
+    # Ожидание в синхронном /api/events/ занимает воркер.
+    'SYNC_MAX_WAIT': int(os.getenv('EVENT_LOG_SYNC_MAX_WAIT', 0)),
+    'STREAM_TIMEOUT': 300,
+    'RETRY': 3,
+    'CLAIM_IDLE': 60,
+    'POLL_INTERVAL': 1,
+}
+
+REFERAL_EXPORT = {
+    'CHUNK_SIZE': int(os.getenv('REFERAL_EXPORT_CHUNK_SIZE', 2000)),
+    'BATCH_SIZE': 500,
+}
@@ -9,5 +9,19 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
 USER_MAX_LENGTH = 20
+PASSWORD_MAX_LENGTH = 128
 EMAIL_LENGTH = 30
 CODE_MAX_LENGTH = 10
+CODE_PREFIX = 'R'
+SEQUENCE_NAME_LENGTH = 50
+EMAIL_KIND_LENGTH = 20
+EMAIL_SUBJECT_LENGTH = 150
+EVENT_TYPE_LENGTH = 50
+EVENT_GROUP_LENGTH = 100
+
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_DELAY = 60
+EMAIL_MAX_RETRY_DELAY = 3600
+EMAIL_SEND_LEASE = 600
+
+MAX_STATS_DAYS = 365
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.16 on 2026-10-17 22:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def set_refers_created_at(apps, schema_editor):
+    Refers = apps.get_model('users', 'Refers')
+    User = apps.get_model('users', 'User')
+    Refers.objects.update(created_at=models.Subquery(
+        User.objects.filter(pk=models.OuterRef('referal_id'))
+        .values('date_joined')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='refer_counter', serialize=False, to='users.user')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Число рефералов')),
+            ],
+            options={
+                'verbose_name': 'Счетчик рефералов',
+                'verbose_name_plural': 'Счетчики рефералов',
+            },
+        ),
+        migrations.AddField(
+            model_name='refers',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата создания'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_refers_created_at,
+                             migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ReferDailyCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Число рефералов')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refer_daily_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Счетчик рефералов за день',
+                'verbose_name_plural': 'Счетчики рефералов за день',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='referdailycounter',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='unique_refer_day'),
+        ),
+    ]
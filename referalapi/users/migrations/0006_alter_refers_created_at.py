@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-17 22:50
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_refer_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='refers',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата создания'),
+        ),
+    ]
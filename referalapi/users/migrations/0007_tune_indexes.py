@@ -0,0 +1,41 @@
+# Generated by Django 3.2.16 on 2026-10-17 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_alter_refers_created_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='codes',
+            options={'verbose_name': 'Реферальный код', 'verbose_name_plural': 'Реферальные коды'},
+        ),
+        migrations.AlterModelOptions(
+            name='refers',
+            options={'verbose_name': 'Рефералка', 'verbose_name_plural': 'Рефералки'},
+        ),
+        migrations.AlterModelOptions(
+            name='user',
+            options={'verbose_name': 'Пользователь', 'verbose_name_plural': 'Пользователи'},
+        ),
+        migrations.RemoveIndex(
+            model_name='outgoingemail',
+            name='outgoing_email_queue_idx',
+        ),
+        migrations.AddIndex(
+            model_name='codes',
+            index=models.Index(fields=['expires_at'], name='codes_expires_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at'], name='outgoing_email_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='refers',
+            index=models.Index(fields=['referer', 'created_at', 'id'], name='refers_referer_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-17 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_tune_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='password',
+            field=models.CharField(default=None, max_length=128, verbose_name='Пароль'),
+        ),
+    ]
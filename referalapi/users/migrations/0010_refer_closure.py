@@ -0,0 +1,36 @@
+# Generated by Django 3.2.16 on 2026-10-17 23:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField(verbose_name='Уровень')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendants', to=settings.AUTH_USER_MODEL)),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestors', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Связь в дереве рефералов',
+                'verbose_name_plural': 'Связи в дереве рефералов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='referclosure',
+            index=models.Index(fields=['ancestor', 'depth', 'descendant'], name='refer_closure_level_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='referclosure',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_refer_closure'),
+        ),
+    ]
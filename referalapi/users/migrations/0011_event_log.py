@@ -0,0 +1,38 @@
+# Generated by Django 3.2.16 on 2026-10-17 23:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_refer_closure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('type', models.CharField(max_length=50, verbose_name='Тип события')),
+                ('data', models.JSONField(verbose_name='Данные')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Событие',
+                'verbose_name_plural': 'События',
+            },
+        ),
+        migrations.CreateModel(
+            name='EventOffset',
+            fields=[
+                ('group', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Группа')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='Последнее событие')),
+            ],
+            options={
+                'verbose_name': 'Позиция группы потребителей',
+                'verbose_name_plural': 'Позиции групп потребителей',
+            },
+        ),
+    ]
@@ -1,12 +1,16 @@
 from datetime import timedelta
 
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connections, models
+from django.db.models import signals
 from django.utils import timezone
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
-from .constans import CODE_MAX_LENGTH, EMAIL_LENGTH, USER_MAX_LENGTH
+from .constans import (CODE_MAX_LENGTH, EMAIL_KIND_LENGTH, EMAIL_LENGTH,
+                       EMAIL_SUBJECT_LENGTH, EVENT_GROUP_LENGTH,
+                       EVENT_TYPE_LENGTH, PASSWORD_MAX_LENGTH,
+                       SEQUENCE_NAME_LENGTH, USER_MAX_LENGTH)
 
 
 class User(AbstractUser):
@@ -14,7 +18,7 @@ class User(AbstractUser):
     Переопределенная модель юзера.
     '''
     password = models.CharField('Пароль', default=None,
-                                max_length=USER_MAX_LENGTH)
+                                max_length=PASSWORD_MAX_LENGTH)
     first_name = models.CharField('Имя', max_length=USER_MAX_LENGTH,
                                   blank=True)
     last_name = models.CharField('Фамилия', max_length=USER_MAX_LENGTH,
@@ -22,7 +26,6 @@ class User(AbstractUser):
     email = models.EmailField('E-mail', max_length=EMAIL_LENGTH, unique=True)
 
     class Meta:
-        ordering = ('-date_joined',)
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
 
@@ -30,6 +33,58 @@ class User(AbstractUser):
         return self.username
 
 
+class RefersQuerySet(models.QuerySet):
+
+    def create_from_code(self, code: str, referer_id: int, referal):
+        '''
+        Создает рефералку по коду одним запросом INSERT ... SELECT:
+        строка вставляется, только если код еще существует,
+        принадлежит referer_id и не истек. Возвращает рефералку
+        или None, если код не подошел. Сигналы pre_save и post_save
+        отправляются, как при Model.save.
+        '''
+        connection = connections[self.db]
+        refer = self.model(referer_id=referer_id, referal=referal)
+        signals.pre_save.send(sender=self.model, instance=refer, raw=False,
+                              using=self.db, update_fields=None)
+        sql = f'''
+            INSERT INTO {self.model._meta.db_table}
+                (referer_id, referal_id, created_at)
+            SELECT user_id, %s, %s FROM {Codes._meta.db_table}
+            WHERE code = %s AND user_id = %s AND expires_at > %s
+        '''
+        returning = connection.features.can_return_columns_from_insert
+        if returning:
+            sql += ' RETURNING id'
+        created_at = connection.ops.adapt_datetimefield_value(refer.created_at)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [referal.pk, created_at, code, referer_id,
+                                 created_at])
+            if returning:
+                row = cursor.fetchone()
+                refer.pk = row[0] if row else None
+            elif cursor.rowcount == 1:
+                refer.pk = cursor.lastrowid
+        if refer.pk is None:
+            return None
+        refer._state.adding = False
+        refer._state.db = self.db
+        signals.post_save.send(sender=self.model, instance=refer,
+                               created=True, update_fields=None, raw=False,
+                               using=self.db)
+        return refer
+
+    def for_referer(self, referer_id):
+        '''
+        Рефералы юзера строками values() с нужными полями реферала,
+        одним запросом и без создания моделей
+        (см. api.serializers.ReferalListSerializer).
+        '''
+        return self.filter(referer_id=referer_id).values(
+            'id', 'created_at', 'referal__username', 'referal__date_joined'
+        )
+
+
 class Refers(models.Model):
     '''
     Модель связи рефереров с рефералами.
@@ -38,9 +93,11 @@ class Refers(models.Model):
         User, on_delete=models.CASCADE, related_name='referer')
     referal = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='referal')
+    created_at = models.DateTimeField('Дата создания', default=timezone.now)
+
+    objects = RefersQuerySet.as_manager()
 
     class Meta:
-        ordering = ('referer',)
         verbose_name = 'Рефералка'
         verbose_name_plural = 'Рефералки'
         constraints = [
@@ -49,11 +106,57 @@ class Refers(models.Model):
                 name='unique_refer'
             ),
         ]
+        indexes = [
+            models.Index(fields=['referer', 'created_at', 'id'],
+                         name='refers_referer_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.referal} зарегистрировался по рефералке {self.referer}.'
 
 
+class ReferCounter(models.Model):
+    '''
+    Общее число рефералов юзера.
+    Обновляется сигналами модели Refers.
+    '''
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='refer_counter')
+    total = models.PositiveIntegerField('Число рефералов', default=0)
+
+    class Meta:
+        verbose_name = 'Счетчик рефералов'
+        verbose_name_plural = 'Счетчики рефералов'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.total} рефералов.'
+
+
+class ReferDailyCounter(models.Model):
+    '''
+    Число рефералов юзера за день.
+    Обновляется сигналами модели Refers.
+    '''
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='refer_daily_counters')
+    day = models.DateField('День')
+    count = models.PositiveIntegerField('Число рефералов', default=0)
+
+    class Meta:
+        verbose_name = 'Счетчик рефералов за день'
+        verbose_name_plural = 'Счетчики рефералов за день'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'day'],
+                name='unique_refer_day'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.day}: {self.count} рефералов.'
+
+
 class Codes(models.Model):
     '''
     Модель для реферальных кодов.
@@ -80,7 +183,6 @@ class Codes(models.Model):
         super().save(*args, **kwargs)
 
     class Meta:
-        ordering = ('created_at',)
         verbose_name = 'Реферальный код'
         verbose_name_plural = 'Реферальные коды'
         constraints = [
@@ -89,6 +191,143 @@ class Codes(models.Model):
                 name='unique_refer_codes'
             ),
         ]
+        indexes = [
+            models.Index(fields=['expires_at'],
+                         name='codes_expires_at_idx'),
+        ]
 
     def __str__(self):
         return f'{self.code} - реферальный код {self.user.username}.'
+
+
+class OutgoingEmail(models.Model):
+    '''
+    Модель очереди исходящих писем.
+    '''
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Не отправлено'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='emails')
+    kind = models.CharField('Тип письма', max_length=EMAIL_KIND_LENGTH)
+    recipient = models.EmailField('Получатель', max_length=EMAIL_LENGTH)
+    subject = models.CharField('Тема', max_length=EMAIL_SUBJECT_LENGTH)
+    body = models.TextField('Текст письма')
+    status = models.CharField('Статус', max_length=EMAIL_KIND_LENGTH,
+                              choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField('Число попыток', default=0)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    next_attempt_at = models.DateTimeField('Дата следующей попытки',
+                                           default=timezone.now)
+    sent_at = models.DateTimeField('Дата отправки', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'kind'],
+                condition=models.Q(status='pending'),
+                name='unique_pending_email'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['next_attempt_at'],
+                         condition=models.Q(status='pending'),
+                         name='outgoing_email_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} для {self.recipient} ({self.status}).'
+
+
+class Sequence(models.Model):
+    '''
+    Именованный счетчик, из которого блоками выдаются номера
+    (например, для генерации реферальных кодов).
+    '''
+    name = models.CharField('Название', primary_key=True,
+                            max_length=SEQUENCE_NAME_LENGTH)
+    value = models.BigIntegerField('Следующий номер', default=0)
+
+    class Meta:
+        verbose_name = 'Счетчик'
+        verbose_name_plural = 'Счетчики'
+
+    def __str__(self):
+        return f'{self.name}: {self.value}.'
+
+
+class ReferClosure(models.Model):
+    '''
+    Замыкание дерева рефералов: все пары предок - потомок
+    с расстоянием между ними до REFER_TREE['MAX_DEPTH'].
+    Ведется сигналами модели Refers, если включено REFER_TREE['CLOSURE'],
+    и пересобирается командой rebuild_refer_tree.
+    '''
+    ancestor = models.ForeignKey(User, on_delete=models.CASCADE,
+                                 related_name='descendants')
+    descendant = models.ForeignKey(User, on_delete=models.CASCADE,
+                                   related_name='ancestors')
+    depth = models.PositiveSmallIntegerField('Уровень')
+
+    class Meta:
+        verbose_name = 'Связь в дереве рефералов'
+        verbose_name_plural = 'Связи в дереве рефералов'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['ancestor', 'descendant'],
+                name='unique_refer_closure'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['ancestor', 'depth', 'descendant'],
+                         name='refer_closure_level_idx'),
+        ]
+
+    def __str__(self):
+        return (f'{self.descendant_id} - реферал {self.ancestor_id} '
+                f'уровня {self.depth}.')
+
+
+class Event(models.Model):
+    '''
+    Событие журнала (api.events), когда кеш не в Redis. С Redis
+    сюда попадают только события, которые не удалось записать
+    в поток: команда consume_events переносит их в поток позже.
+    '''
+    id = models.BigAutoField(primary_key=True)
+    type = models.CharField('Тип события', max_length=EVENT_TYPE_LENGTH)
+    data = models.JSONField('Данные')
+    created_at = models.DateTimeField('Дата создания', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Событие'
+        verbose_name_plural = 'События'
+
+    def __str__(self):
+        return f'{self.id}: {self.type}.'
+
+
+class EventOffset(models.Model):
+    '''
+    Последнее подтвержденное событие группы потребителей
+    для журнала событий в БД.
+    '''
+    group = models.CharField('Группа', primary_key=True,
+                             max_length=EVENT_GROUP_LENGTH)
+    last_id = models.BigIntegerField('Последнее событие', default=0)
+
+    class Meta:
+        verbose_name = 'Позиция группы потребителей'
+        verbose_name_plural = 'Позиции групп потребителей'
+
+    def __str__(self):
+        return f'{self.group}: {self.last_id}.'